@@ -1,12 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
 from models import User
+from user_cache import user_cache
+import asyncio
 import os
 
 # Security configuration
@@ -14,24 +18,73 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes below BCRYPT_ROUNDS are re-hashed on the next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# bcrypt releases the GIL, so hashing runs on a small thread pool instead of
+# the event loop. At most PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE jobs
+# may be in flight; beyond that requests are rejected with 503.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+_password_executor = ThreadPoolExecutor(
+    max_workers=max(PASSWORD_HASH_WORKERS, 1), thread_name_prefix="password-hash"
+)
+_password_jobs_in_flight = 0
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
 
-def get_user(db: Session, username: str):
-    return db.query(User).filter(User.username == username).first()
+async def _run_password_job(func, *args):
+    """Run a bcrypt call on the password pool, shedding load when it is saturated"""
+    global _password_jobs_in_flight
+    if PASSWORD_HASH_WORKERS <= 0:
+        return func(*args)
+    if _password_jobs_in_flight >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent password operations, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    _password_jobs_in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_password_executor, func, *args)
+    finally:
+        _password_jobs_in_flight -= 1
+
+async def verify_password_async(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    """Verify off the event loop; also returns a new hash if the old one needs upgrading"""
+    return await _run_password_job(pwd_context.verify_and_update, plain_password, hashed_password)
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = get_user(db, username)
+async def get_password_hash_async(password) -> str:
+    return await _run_password_job(pwd_context.hash, password)
+
+async def get_user(db: AsyncSession, username: str):
+    result = await db.execute(select(User).filter(User.username == username))
+    return result.scalars().first()
+
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await get_user(db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    verified, new_hash = await verify_password_async(password, user.hashed_password)
+    if not verified:
         return False
+    if new_hash:
+        # Transparently upgrade hashes made with an old scheme or fewer rounds
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -44,7 +97,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -58,9 +111,13 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
     
-    user = get_user(db, username=username)
+    # Hot users authenticate from the cache without touching the database
+    user = user_cache.get(username)
     if user is None:
-        raise credentials_exception
+        user = await get_user(db, username=username)
+        if user is None:
+            raise credentials_exception
+        user_cache.set(user)
     return user
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+API Benchmark Suite
+Drives the hot API paths at a fixed concurrency and reports throughput,
+p50/p95/p99 latency and SQL queries per request for each scenario. By default
+the app runs in-process against a throwaway SQLite database and an in-memory
+MongoDB stand-in (needs the mongomock-motor package); --real uses the servers
+configured by DATABASE_URL and MONGODB_URL instead.
+
+Results are saved as JSON; pass an earlier file to --compare to flag
+regressions.
+
+Usage:
+    python benchmark_api.py [--requests 300] [--concurrency 16] [--output results.json]
+    python benchmark_api.py --compare baseline.json [--threshold 0.10]
+    python benchmark_api.py --real --scenarios campaigns,global_statistics
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+CITIES = ["New York", "Chicago", "Houston", "Seattle", "Boston"]
+SCENARIOS = ["login", "donate", "list_donations", "campaigns", "city_rankings", "global_statistics"]
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def load_app(args):
+    """Point the app at SQLite and a MongoDB stand-in (unless --real), then import it"""
+    if not args.real:
+        fd, path = tempfile.mkstemp(suffix=".db", prefix="benchmark_")
+        os.close(fd)
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("❌ The in-process MongoDB stand-in needs mongomock-motor (pip install mongomock-motor), or use --real")
+        import database
+        mongodb = AsyncMongoMockClient()[database.mongodb.name]
+        database.mongodb = mongodb
+        for name in dir(database):
+            if name.endswith("_collection"):
+                setattr(database, name, mongodb[getattr(database, name).name])
+
+    from main import app
+    from database import async_engine
+    return app, async_engine
+
+class QueryCounter:
+    """Counts SQL statements sent through the async engine"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+async def setup(client, args):
+    """Register users and campaigns for the scenarios to use"""
+    suffix = int(time.time())
+    ctx = {"users": [], "tokens": [], "campaign_ids": [], "rng": random.Random(args.seed)}
+    print(f"Creating {args.users} users and {args.campaigns} campaigns...")
+    for i in range(args.users):
+        username = f"bench{i:04d}_{suffix}"
+        response = await client.post("/register", json={
+            "username": username,
+            "email": f"{username}@example.com",
+            "full_name": f"Benchmark User {i}",
+            "city": CITIES[i % len(CITIES)],
+            "password": "password"
+        })
+        response.raise_for_status()
+        response = await client.post("/login", data={"username": username, "password": "password"})
+        response.raise_for_status()
+        ctx["users"].append(username)
+        ctx["tokens"].append({"Authorization": f"Bearer {response.json()['access_token']}"})
+
+    for i in range(args.campaigns):
+        response = await client.post("/campaigns", headers=ctx["tokens"][i % args.users], json={
+            "title": f"Benchmark Campaign {i}",
+            "description": "Created by benchmark_api.py",
+            "target_amount": 10000.0
+        })
+        response.raise_for_status()
+        ctx["campaign_ids"].append(response.json()["id"])
+    return ctx
+
+def request_for(scenario, ctx, i):
+    """The (method, url, kwargs) of request number i of a scenario"""
+    users, tokens = ctx["users"], ctx["tokens"]
+    if scenario == "login":
+        return "POST", "/login", {"data": {"username": users[i % len(users)], "password": "password"}}
+    if scenario == "donate":
+        return "POST", "/donations", {"headers": tokens[i % len(tokens)], "json": {
+            "amount": round(ctx["rng"].uniform(5, 500), 2),
+            "campaign_id": ctx["rng"].choice(ctx["campaign_ids"])
+        }}
+    if scenario == "list_donations":
+        return "GET", "/donations", {"headers": tokens[i % len(tokens)], "params": {"limit": 20}}
+    if scenario == "campaigns":
+        return "GET", "/campaigns", {"params": {"limit": 20}}
+    if scenario == "city_rankings":
+        return "GET", "/city-rankings", {"headers": tokens[i % len(tokens)]}
+    return "GET", "/global-statistics", {}
+
+async def run_scenario(client, scenario, ctx, args, queries):
+    latencies, errors, next_request = [], 0, 0
+    requests = [request_for(scenario, ctx, i) for i in range(args.requests)]
+
+    async def worker():
+        nonlocal errors, next_request
+        while next_request < len(requests):
+            method, url, kwargs = requests[next_request]
+            next_request += 1
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    queries_before = queries.count
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(ms, 50), 2),
+        "p95_ms": round(percentile(ms, 95), 2),
+        "p99_ms": round(percentile(ms, 99), 2),
+        "queries_per_request": round((queries.count - queries_before) / max(len(latencies), 1), 2)
+    }
+
+def report(results):
+    print(f"\n📊 {'scenario':<18} {'req/s':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'queries':>8} {'errors':>7}")
+    for scenario, result in results.items():
+        print(
+            f"   {scenario:<18} {result['throughput_rps']:>9.1f} {result['p50_ms']:>7.2f}ms "
+            f"{result['p95_ms']:>7.2f}ms {result['p99_ms']:>7.2f}ms "
+            f"{result['queries_per_request']:>8.2f} {result['errors']:>7}"
+        )
+
+def compare(results, baseline_path, threshold):
+    """Print the change against a saved run; returns the regressed scenarios"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+
+    regressions = []
+    print(f"\n📈 Compared with {baseline_path} (regression threshold {threshold:.0%})")
+    for scenario, result in results.items():
+        before = baseline.get(scenario)
+        if before is None:
+            continue
+        throughput = result["throughput_rps"] / before["throughput_rps"] - 1 if before["throughput_rps"] else 0.0
+        p95 = result["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        regressed = throughput < -threshold or p95 > threshold
+        if regressed:
+            regressions.append(scenario)
+        print(
+            f"   {scenario:<18} req/s {throughput:+7.1%}   p95 {p95:+7.1%}   "
+            f"queries {before['queries_per_request']:.2f} -> {result['queries_per_request']:.2f}"
+            f"{'   ⚠️  regression' if regressed else ''}"
+        )
+    return regressions
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args):
+    import httpx
+    app, async_engine = load_app(args)
+    queries = QueryCounter(async_engine)
+
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            ctx = await setup(client, args)
+            results = {}
+            for scenario in args.scenarios:
+                print(f"Running {scenario} ({args.requests} requests, concurrency {args.concurrency})...")
+                results[scenario] = await run_scenario(client, scenario, ctx, args, queries)
+    finally:
+        await app.router.shutdown()
+
+    report(results)
+    output = args.output or f"benchmark_{datetime.utcnow():%Y%m%dT%H%M%SZ}.json"
+    with open(output, "w") as f:
+        json.dump({
+            "meta": {
+                "timestamp": datetime.utcnow().isoformat(),
+                "git_revision": git_revision(),
+                "python": platform.python_version(),
+                "database": async_engine.dialect.name,
+                "mongodb": "real" if args.real else "in-memory stand-in",
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "users": args.users,
+                "campaigns": args.campaigns,
+                "seed": args.seed
+            },
+            "results": results
+        }, f, indent=2)
+    print(f"\n💾 Results saved to {output}")
+
+    if args.compare:
+        return not compare(results, args.compare, args.threshold)
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--users", type=int, default=20, help="accounts to spread requests over")
+    parser.add_argument("--campaigns", type=int, default=10, help="campaigns to donate to")
+    parser.add_argument("--scenarios", type=lambda value: value.split(","), default=SCENARIOS,
+                        help=f"comma-separated subset of: {','.join(SCENARIOS)}")
+    parser.add_argument("--seed", type=int, default=42, help="random seed for request payloads")
+    parser.add_argument("--real", action="store_true", help="use DATABASE_URL and MONGODB_URL instead of SQLite and the stand-in")
+    parser.add_argument("--output", help="where to save the JSON results")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change that counts as a regression")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+if __name__ == "__main__":
+    main()
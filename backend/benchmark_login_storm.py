@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Login Storm Benchmark
+Measures the latency of an unrelated endpoint (GET /categories) while many
+clients hammer POST /login, showing whether bcrypt work stalls the event loop.
+The app runs in-process against a throwaway SQLite database.
+
+Usage:
+    python benchmark_login_storm.py [--users 20] [--concurrency 32] [--duration 10]
+
+Compare against hashing on the event loop:
+    PASSWORD_HASH_WORKERS=0 python benchmark_login_storm.py
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    _fd, _path = tempfile.mkstemp(suffix=".db", prefix="login_storm_")
+    os.close(_fd)
+    os.environ["DATABASE_URL"] = f"sqlite:///{_path}"
+
+import httpx
+from main import app
+import auth
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def report(label, samples):
+    ms = [s * 1000 for s in samples]
+    print(
+        f"   {label:<14} n={len(ms):<6} p50={percentile(ms, 50):8.2f}ms "
+        f"p95={percentile(ms, 95):8.2f}ms p99={percentile(ms, 99):8.2f}ms"
+    )
+
+async def probe(client, stop, samples, interval=0.01):
+    """Hit an endpoint that does no password work and record its latency"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await client.get("/categories")
+        samples.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+
+async def login_loop(client, stop, users, worker, counts):
+    i = worker
+    while not stop.is_set():
+        response = await client.post(
+            "/login", data={"username": users[i % len(users)], "password": "password"}
+        )
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+        i += 1
+
+async def run(args):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        print(f"Creating {args.users} users...")
+        users = []
+        for i in range(args.users):
+            username = f"storm{i:04d}_{int(time.time())}"
+            response = await client.post("/register", json={
+                "username": username,
+                "email": f"{username}@example.com",
+                "full_name": f"Storm User {i}",
+                "city": "Benchmark City",
+                "password": "password"
+            })
+            response.raise_for_status()
+            users.append(username)
+        
+        # Baseline: probe alone
+        baseline, stop = [], asyncio.Event()
+        task = asyncio.create_task(probe(client, stop, baseline))
+        await asyncio.sleep(args.duration / 2)
+        stop.set()
+        await task
+        
+        # Storm: probe while `concurrency` clients log in back to back
+        storm, counts, stop = [], {}, asyncio.Event()
+        tasks = [asyncio.create_task(probe(client, stop, storm))]
+        tasks += [
+            asyncio.create_task(login_loop(client, stop, users, worker, counts))
+            for worker in range(args.concurrency)
+        ]
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+    
+    mode = "inline" if auth.PASSWORD_HASH_WORKERS <= 0 else f"thread pool of {auth.PASSWORD_HASH_WORKERS}"
+    print(f"\n📊 GET /categories latency (password hashing: {mode})")
+    report("baseline", baseline)
+    report("login storm", storm)
+    logins = sum(counts.values())
+    print(f"   logins: {logins} in {args.duration:.0f}s ({logins / args.duration:.1f}/s), status codes: {counts}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="number of accounts to log in with")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent login clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="storm duration in seconds")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+from sqlalchemy import distinct, func, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import CampaignAnalytics, Donation, RollupWatermark
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Run the donation rollup in the app every N seconds (0 leaves it to
+# rollup_campaign_analytics.py, e.g. from cron)
+CAMPAIGN_ANALYTICS_ROLLUP_SECONDS = int(os.getenv("CAMPAIGN_ANALYTICS_ROLLUP_SECONDS", "0"))
+ROLLUP_NAME = "campaign_analytics_donations"
+
+# Campaign views and shares are counted in memory and flushed this often, so a
+# crash loses at most this many seconds of counts
+CAMPAIGN_COUNTER_FLUSH_SECONDS = float(os.getenv("CAMPAIGN_COUNTER_FLUSH_SECONDS", "5"))
+# After this many failed flushes in a row the buffered counts are dropped
+# instead of being retried (and growing) forever
+CAMPAIGN_COUNTER_MAX_FAILED_FLUSHES = int(os.getenv("CAMPAIGN_COUNTER_MAX_FAILED_FLUSHES", "12"))
+
+def day_start(moment: datetime) -> datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+class CampaignAnalyticsService:
+    """Per-campaign daily rows in campaign_analytics, so reports never scan donations.
+
+    The rollup recomputes whole days of donations with one set-based
+    INSERT ... SELECT ... GROUP BY upsert per day. Recomputing (rather than
+    adding) keeps it idempotent, and the watermark of the first day not yet
+    final lets an interrupted run resume where it stopped.
+
+    Views and shares are buffered per (campaign, day) and added to the same
+    rows by one batched upsert per flush, so writes scale with the number of
+    campaigns viewed rather than the number of views.
+    """
+
+    def __init__(self):
+        self._pending_counts: Dict[Tuple[int, datetime], Dict[str, int]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._failed_flushes = 0
+        self._session_factory = None
+        self._tasks: List[asyncio.Task] = []
+
+    @staticmethod
+    def _insert(db: AsyncSession):
+        return postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+
+    @staticmethod
+    def _day(db: AsyncSession, column):
+        """Midnight of a timestamp column, in the form the DateTime column stores"""
+        if db.bind.dialect.name == "postgresql":
+            return func.date_trunc("day", column)
+        # Must match SQLAlchemy's SQLite DateTime format to hit the unique key
+        return func.strftime("%Y-%m-%d 00:00:00.000000", column)
+
+    async def _watermark(self, db: AsyncSession) -> Optional[datetime]:
+        watermark = await db.get(RollupWatermark, ROLLUP_NAME)
+        if watermark is not None:
+            return watermark.watermark
+        first = (await db.execute(select(func.min(Donation.created_at)))).scalar()
+        return day_start(first) if first is not None else None
+
+    async def rollup(self, db: AsyncSession, until: Optional[datetime] = None) -> int:
+        """Roll donations up to (and including) today into daily rows; returns the days processed"""
+        until = day_start(until or datetime.utcnow())
+        day = await self._watermark(db)
+        if day is None:
+            return 0
+
+        processed = 0
+        while day <= until:
+            next_day = day + timedelta(days=1)
+            date = self._day(db, Donation.created_at)
+            source = (
+                select(
+                    Donation.campaign_id,
+                    date,
+                    literal(0),
+                    literal(0),
+                    func.count(distinct(Donation.donor_id)),
+                    func.sum(Donation.amount)
+                )
+                .where(Donation.created_at >= day, Donation.created_at < next_day)
+                .group_by(Donation.campaign_id, date)
+            )
+            stmt = self._insert(db)(CampaignAnalytics).from_select(
+                ["campaign_id", "date", "views", "shares", "unique_donors", "total_donations"], source
+            )
+            # Views and shares come from the counter path and are left alone
+            await db.execute(stmt.on_conflict_do_update(
+                index_elements=[CampaignAnalytics.campaign_id, CampaignAnalytics.date],
+                set_={
+                    "unique_donors": stmt.excluded.unique_donors,
+                    "total_donations": stmt.excluded.total_donations
+                }
+            ))
+
+            # Today is rolled up again next time; earlier days are final
+            await db.merge(RollupWatermark(name=ROLLUP_NAME, watermark=min(next_day, until)))
+            await db.commit()
+            processed += 1
+            day = next_day
+        return processed
+
+    async def get_series(
+        self, db: AsyncSession, campaign_id: int, start: datetime, end: datetime
+    ) -> List[CampaignAnalytics]:
+        """Daily rows for a campaign between two days, inclusive, oldest first"""
+        result = await db.execute(
+            select(CampaignAnalytics)
+            .where(
+                CampaignAnalytics.campaign_id == campaign_id,
+                CampaignAnalytics.date >= day_start(start),
+                CampaignAnalytics.date <= day_start(end)
+            )
+            .order_by(CampaignAnalytics.date)
+        )
+        return result.scalars().all()
+
+    def record_view(self, campaign_id: int):
+        self._count(campaign_id, "views")
+
+    def record_share(self, campaign_id: int):
+        self._count(campaign_id, "shares")
+
+    def _count(self, campaign_id: int, field: str):
+        key = (campaign_id, day_start(datetime.utcnow()))
+        counts = self._pending_counts.get(key)
+        if counts is None:
+            counts = self._pending_counts[key] = {"views": 0, "shares": 0}
+        counts[field] += 1
+
+    async def flush_counts(self, db: AsyncSession):
+        """Add the buffered views and shares to their daily rows in one executemany upsert"""
+        async with self._flush_lock:
+            if not self._pending_counts:
+                return
+            pending, self._pending_counts = self._pending_counts, {}
+            # Sorted so concurrent workers lock rows in the same order
+            params = [
+                {"campaign_id": campaign_id, "date": date, **counts}
+                for (campaign_id, date), counts in sorted(pending.items())
+            ]
+            stmt = self._insert(db)(CampaignAnalytics)
+            try:
+                await db.execute(stmt.on_conflict_do_update(
+                    index_elements=[CampaignAnalytics.campaign_id, CampaignAnalytics.date],
+                    set_={
+                        "views": CampaignAnalytics.views + stmt.excluded.views,
+                        "shares": CampaignAnalytics.shares + stmt.excluded.shares
+                    }
+                ), params)
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                self._failed_flushes += 1
+                if self._failed_flushes >= CAMPAIGN_COUNTER_MAX_FAILED_FLUSHES:
+                    logger.error(
+                        "Dropping view/share counts of %d campaign days after %d failed flushes",
+                        len(pending), self._failed_flushes
+                    )
+                    self._failed_flushes = 0
+                else:
+                    self._requeue(pending)
+                raise
+            self._failed_flushes = 0
+
+    def _requeue(self, pending: Dict[Tuple[int, datetime], Dict[str, int]]):
+        for key, counts in pending.items():
+            current = self._pending_counts.setdefault(key, {"views": 0, "shares": 0})
+            current["views"] += counts["views"]
+            current["shares"] += counts["shares"]
+
+    async def get_live_counts(self, db: AsyncSession, campaign_id: int) -> Dict[str, int]:
+        """All-time views and shares: persisted totals plus this process's unflushed counts"""
+        result = await db.execute(
+            select(
+                func.coalesce(func.sum(CampaignAnalytics.views), 0),
+                func.coalesce(func.sum(CampaignAnalytics.shares), 0)
+            ).where(CampaignAnalytics.campaign_id == campaign_id)
+        )
+        views, shares = result.one()
+        for (pending_id, _), counts in self._pending_counts.items():
+            if pending_id == campaign_id:
+                views += counts["views"]
+                shares += counts["shares"]
+        return {"views": views, "shares": shares}
+
+    async def start(self, session_factory):
+        """Start the counter flusher and, if configured, the periodic rollup"""
+        self._session_factory = session_factory
+        if not self._tasks:
+            self._tasks.append(asyncio.create_task(self._flush_counts_periodically()))
+            if CAMPAIGN_ANALYTICS_ROLLUP_SECONDS > 0:
+                self._tasks.append(asyncio.create_task(self._rollup_periodically()))
+
+    async def close(self):
+        """Stop the background tasks and write out any buffered counts"""
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        if self._session_factory is not None:
+            async with self._session_factory() as db:
+                await self.flush_counts(db)
+
+    async def _flush_counts_periodically(self):
+        while True:
+            await asyncio.sleep(CAMPAIGN_COUNTER_FLUSH_SECONDS)
+            try:
+                async with self._session_factory() as db:
+                    await self.flush_counts(db)
+            except Exception:
+                logger.exception("Failed to flush campaign view/share counts")
+
+    async def _rollup_periodically(self):
+        while True:
+            try:
+                async with self._session_factory() as db:
+                    await self.rollup(db)
+            except Exception:
+                logger.exception("Campaign analytics rollup failed")
+            await asyncio.sleep(CAMPAIGN_ANALYTICS_ROLLUP_SECONDS)
+
+# Global instance
+campaign_analytics_service = CampaignAnalyticsService()
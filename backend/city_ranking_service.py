@@ -1,176 +1,998 @@
-from pymongo import MongoClient, ASCENDING, DESCENDING
-from database import city_rankings_collection, user_activities_collection
-from typing import List, Dict, Any
-from datetime import datetime
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure, ServerSelectionTimeoutError
+from sortedcontainers import SortedList
+from database import city_rankings_collection, user_activities_collection, city_donors_collection
+from database import city_ranking_buckets_collection
+from database import analytics_collection as default_analytics_collection
+from metrics import CITY_RANKING_FLUSH, CITY_RANKING_RECALCULATION
+from typing import List, Dict, Any, Awaitable, Callable, Iterable, Optional, Tuple
+from datetime import datetime, timedelta
 import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# How often (seconds) a worker reloads its rank index from MongoDB so that
+# writes made by other workers become visible; 0 disables the reload.
+RANK_INDEX_REFRESH_SECONDS = float(os.getenv("RANK_INDEX_REFRESH_SECONDS", "60"))
+
+# Write-behind donation pipeline: queued donations are coalesced per city and
+# flushed every WRITE_BEHIND_FLUSH_SECONDS; at most WRITE_BEHIND_MAX_PENDING
+# donations are buffered before callers have to wait for a flush.
+WRITE_BEHIND_FLUSH_SECONDS = float(os.getenv("WRITE_BEHIND_FLUSH_SECONDS", "0.5"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+# How long a caller waits on a full buffer; if MongoDB is still behind after
+# that, the oldest queued activity records are dropped (city totals and
+# day/week/month bucket counts never are)
+WRITE_BEHIND_BACKPRESSURE_TIMEOUT_SECONDS = float(os.getenv("WRITE_BEHIND_BACKPRESSURE_TIMEOUT_SECONDS", "5"))
+
+# Materialized platform-wide totals, kept in the analytics collection
+GLOBAL_ROLLUP_ID = "global_city_rollup"
+
+# Time-bucketed leaderboards: per-(period, bucket, city) counters in
+# city_ranking_buckets, plus a rolling window summed from the daily buckets.
+# They are the long-lived rollups, so they are kept forever by default.
+# CITY_BUCKET_RETENTION_DAYS > 0 expires day and week buckets that long after
+# they close, but never sooner than the raw activities they summarise or the
+# rolling window; month buckets are never expired.
+BUCKET_PERIODS = ("day", "week", "month")
+ROLLING_PERIOD = "rolling_30d"
+ROLLING_WINDOW_DAYS = 30
+RANKING_PERIODS = BUCKET_PERIODS + (ROLLING_PERIOD,)
+CITY_BUCKET_RETENTION_DAYS = int(os.getenv("CITY_BUCKET_RETENTION_DAYS", "0"))
+EXPIRING_BUCKET_PERIODS = ("day", "week")
+
+# user_activities storage: "collection" (a regular collection) or
+# "timeseries" (a MongoDB 5.0+ time-series collection bucketed per city).
+# Raw activities are kept forever unless USER_ACTIVITY_RETENTION_DAYS is set,
+# which deletes older activity history; the buckets above keep the totals.
+USER_ACTIVITY_STORAGE = os.getenv("USER_ACTIVITY_STORAGE", "collection")
+USER_ACTIVITY_RETENTION_DAYS = int(os.getenv("USER_ACTIVITY_RETENTION_DAYS", "0"))
+_ACTIVITY_RETENTION_INDEX = "activity_retention"
+
+_BUCKET_KEY_FORMATS = {"day": "%Y-%m-%d", "week": "%G-W%V", "month": "%Y-%m"}
+
+def _bucket_start(period: str, timestamp: datetime) -> datetime:
+    day = datetime(timestamp.year, timestamp.month, timestamp.day)
+    if period == "day":
+        return day
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+def _bucket_end(period: str, start: datetime) -> datetime:
+    if period == "day":
+        return start + timedelta(days=1)
+    if period == "week":
+        return start + timedelta(days=7)
+    return (start + timedelta(days=32)).replace(day=1)
+
+def _bucket_retention_days(period: str) -> int:
+    """Days a closed bucket of the period is kept, or 0 to keep it forever"""
+    if period not in EXPIRING_BUCKET_PERIODS or CITY_BUCKET_RETENTION_DAYS <= 0:
+        return 0
+    return max(CITY_BUCKET_RETENTION_DAYS, USER_ACTIVITY_RETENTION_DAYS, ROLLING_WINDOW_DAYS)
+
+def _bucket_key(period: str, start: datetime) -> str:
+    return start.strftime(_BUCKET_KEY_FORMATS[period])
+
+def _rolling_window_start(now: datetime) -> datetime:
+    return _bucket_start("day", now) - timedelta(days=ROLLING_WINDOW_DAYS - 1)
+
+class CityRankIndex:
+    """In-memory order-statistics index of cities keyed on (total_donations desc, city).
+
+    Backed by a SortedList (a B-tree-like list of sorted sublists), so inserting,
+    moving and ranking a city are O(log n) and reading a window of k ranks is
+    O(log n + k). Each city keeps a small snapshot of its ranking row so reads
+    can be served without touching MongoDB.
+    """
+
+    ROW_FIELDS = ("city", "total_donations", "total_donors", "donation_count", "average_donation")
 
-class CityRankingService:
     def __init__(self):
-        self.collection = city_rankings_collection
-        self.activities_collection = user_activities_collection
-        self._create_indexes()
+        self._entries = SortedList()
+        self._rows: Dict[str, Dict[str, Any]] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, city):
+        return city in self._rows
+
+    @staticmethod
+    def _key(row: Dict[str, Any]) -> Tuple[float, str]:
+        return (-row["total_donations"], row["city"])
+
+    @classmethod
+    def _snapshot(cls, city_doc: Dict[str, Any]) -> Dict[str, Any]:
+        row = {field: city_doc.get(field) for field in cls.ROW_FIELDS}
+        if city_doc.get("donation_count"):
+            row["average_donation"] = city_doc["total_donations"] / city_doc["donation_count"]
+        return row
+
+    def load(self, city_docs: Iterable[Dict[str, Any]]):
+        """Replace the index contents with the given city ranking documents"""
+        self._rows = {doc["city"]: self._snapshot(doc) for doc in city_docs}
+        self._entries = SortedList(self._key(row) for row in self._rows.values())
+
+    def upsert(self, city_doc: Dict[str, Any]) -> Tuple[Optional[int], int]:
+        """Insert or move a city, returning its (old_rank, new_rank)"""
+        row = self._snapshot(city_doc)
+        old_rank = None
+        old_row = self._rows.get(row["city"])
+        if old_row is not None:
+            old_key = self._key(old_row)
+            old_rank = self._entries.index(old_key) + 1
+            self._entries.remove(old_key)
+        new_key = self._key(row)
+        self._entries.add(new_key)
+        self._rows[row["city"]] = row
+        return old_rank, self._entries.index(new_key) + 1
+
+    def get(self, city: str) -> Optional[Dict[str, Any]]:
+        """Snapshot row of a city, or None if it is not indexed"""
+        row = self._rows.get(city)
+        return dict(row) if row is not None else None
+
+    def rank(self, city: str) -> Optional[int]:
+        """1-based rank of a city, or None if it is not indexed"""
+        row = self._rows.get(city)
+        if row is None:
+            return None
+        return self._entries.index(self._key(row)) + 1
+
+    def cities(self, start_rank: int, end_rank: int) -> List[str]:
+        """Cities ranked start_rank..end_rank (inclusive, 1-based)"""
+        start = max(start_rank, 1) - 1
+        if end_rank <= start:
+            return []
+        return [city for _, city in self._entries.islice(start, end_rank)]
+
+    def window(self, start_rank: int, end_rank: int) -> List[Dict[str, Any]]:
+        """Ranking rows for start_rank..end_rank (inclusive, 1-based)"""
+        first = max(start_rank, 1)
+        return [
+            {**self._rows[city], "rank": rank}
+            for rank, city in enumerate(self.cities(first, end_rank), first)
+        ]
+
+class CityRankingService:
+    def __init__(self, collection=None, activities_collection=None, analytics_collection=None,
+                 donors_collection=None, buckets_collection=None):
+        # Collections are Motor (AsyncIOMotorCollection) handles; any stand-in
+        # with the same async API, e.g. mongomock-motor, can be passed in.
+        self.collection = collection if collection is not None else city_rankings_collection
+        self.activities_collection = (
+            activities_collection if activities_collection is not None else user_activities_collection
+        )
+        self.analytics_collection = (
+            analytics_collection if analytics_collection is not None else default_analytics_collection
+        )
+        # One document per (city, donor_id) pair; keeps city documents constant-size
+        self.donors_collection = donors_collection if donors_collection is not None else city_donors_collection
+        self.buckets_collection = (
+            buckets_collection if buckets_collection is not None else city_ranking_buckets_collection
+        )
+        self.rank_index = CityRankIndex()
+        # One rank index per time window, for the bucket it currently covers
+        self.period_indexes = {period: CityRankIndex() for period in RANKING_PERIODS}
+        self._period_buckets: Dict[str, str] = {}
+        self._rank_index_loaded_at = 0.0
+        self._pending_deltas: Dict[str, Dict[str, Any]] = {}
+        self._pending_activities: List[Dict[str, Any]] = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._backpressure_flush: Optional[asyncio.Task] = None
+        self._global_rollup_stale = False
+        self._rank_index_stale = False
+        # Claims this worker's first-time donors in city_donors until the city
+        # totals counting them are written; _donors_to_mark are written but
+        # not yet marked as counted
+        self._worker_id = ObjectId()
+        self._donors_to_mark: Dict[str, set] = {}
+        self._flush_listeners: List[Callable[[List[str]], Awaitable[None]]] = []
     
-    def _create_indexes(self):
+    async def _create_indexes(self):
         """Create MongoDB indexes for efficient querying"""
         # Compound index for city rankings
-        self.collection.create_index([
+        await self.collection.create_index([
             ("total_donations", DESCENDING),
             ("city", ASCENDING)
         ])
         
         # Index for city lookups
-        self.collection.create_index("city", unique=True)
+        await self.collection.create_index("city", unique=True)
+        
+        # Distinct donors per city
+        await self.donors_collection.create_index(
+            [("city", ASCENDING), ("donor_id", ASCENDING)], unique=True
+        )
+        
+        # Time-bucketed counters: point lookups, rolling-window scans and TTL
+        await self.buckets_collection.create_index(
+            [("period", ASCENDING), ("bucket", ASCENDING), ("city", ASCENDING)], unique=True
+        )
+        await self.buckets_collection.create_index([("period", ASCENDING), ("bucket_start", ASCENDING)])
+        await self.buckets_collection.create_index("expires_at", expireAfterSeconds=0)
+        # Keep buckets that an earlier retention setting stamped to expire
+        kept = [period for period in BUCKET_PERIODS if not _bucket_retention_days(period)]
+        if kept:
+            await self.buckets_collection.update_many(
+                {"period": {"$in": kept}, "expires_at": {"$exists": True}}, {"$unset": {"expires_at": ""}}
+            )
+        
+        # Must run before any activity index implicitly creates the collection
+        await self._configure_activity_storage()
         
         # Index for user activities
-        self.activities_collection.create_index([
+        await self.activities_collection.create_index([
             ("user_id", ASCENDING),
             ("timestamp", DESCENDING)
         ])
         
-        # Index for city-based activity queries
-        self.activities_collection.create_index([
+        # Index for a city's recent activities (get_city_statistics)
+        await self.activities_collection.create_index([
             ("city", ASCENDING),
-            ("activity_type", ASCENDING)
+            ("timestamp", DESCENDING)
         ])
+        
+        # Superseded by the index above and never used by a query
+        try:
+            await self.activities_collection.drop_index("city_1_activity_type_1")
+        except OperationFailure:
+            pass
     
-    async def update_city_ranking(self, city: str, donation_amount: float, donor_id: int):
-        """Update city ranking when a donation is made"""
-        # Update city ranking document
-        self.collection.update_one(
-            {"city": city},
-            {
-                "$inc": {
-                    "total_donations": donation_amount,
-                    "total_donors": 1,
-                    "donation_count": 1
-                },
-                "$addToSet": {"donor_ids": donor_id},
-                "$set": {"last_updated": datetime.utcnow()}
-            },
-            upsert=True
+    async def _configure_activity_storage(self):
+        """Create the activities collection in the configured mode and apply retention"""
+        database = self.activities_collection.database
+        name = self.activities_collection.name
+        retention_seconds = USER_ACTIVITY_RETENTION_DAYS * 24 * 60 * 60
+        
+        if USER_ACTIVITY_STORAGE == "timeseries":
+            info = await self._activity_collection_info()
+            if info is not None and info.get("type") != "timeseries":
+                # A regular collection cannot become a time-series one in place
+                if await self.activities_collection.estimated_document_count():
+                    raise RuntimeError(
+                        f"{name} is a regular collection but USER_ACTIVITY_STORAGE=timeseries; "
+                        "run migrate_user_activities.py to move its activities into a "
+                        "time-series collection, or set USER_ACTIVITY_STORAGE=collection"
+                    )
+                # Nothing to keep; dropping it also drops its activity_retention index
+                await self.activities_collection.drop()
+                info = None
+            if info is None:
+                options = {
+                    "timeseries": {"timeField": "timestamp", "metaField": "city", "granularity": "minutes"}
+                }
+                if retention_seconds:
+                    options["expireAfterSeconds"] = retention_seconds
+                await database.create_collection(name, **options)
+            else:
+                await database.command("collMod", name, expireAfterSeconds=retention_seconds or "off")
+            return
+        
+        if not retention_seconds:
+            # Keep activities forever: remove any TTL index from an earlier setting
+            try:
+                await self.activities_collection.drop_index(_ACTIVITY_RETENTION_INDEX)
+            except OperationFailure:
+                pass
+            return
+        try:
+            await self.activities_collection.create_index(
+                "timestamp", name=_ACTIVITY_RETENTION_INDEX, expireAfterSeconds=retention_seconds
+            )
+        except OperationFailure:
+            info = await self._activity_collection_info()
+            if info is not None and info.get("type") == "timeseries":
+                raise RuntimeError(
+                    f"{name} is a time-series collection but USER_ACTIVITY_STORAGE=collection; "
+                    "run migrate_user_activities.py to move its activities into a regular "
+                    "collection, or set USER_ACTIVITY_STORAGE=timeseries"
+                )
+            # The TTL index exists with another retention; change it in place
+            await database.command(
+                "collMod", name,
+                index={"name": _ACTIVITY_RETENTION_INDEX, "expireAfterSeconds": retention_seconds}
+            )
+    
+    async def _activity_collection_info(self) -> Optional[Dict[str, Any]]:
+        """The listCollections entry (type, options) of the activities collection, or None"""
+        cursor = await self.activities_collection.database.list_collections(
+            filter={"name": self.activities_collection.name}
         )
+        collections = await cursor.to_list(length=1)
+        return collections[0] if collections else None
+    
+    async def migrate_activity_storage(self, batch_size: int = 10000) -> int:
+        """Move user activities into a collection of the USER_ACTIVITY_STORAGE type; returns activities copied.
+
+        Regular and time-series collections cannot be converted in place, so
+        the old collection is renamed aside, the new one is created with its
+        indexes and retention, activities still inside the retention window
+        are copied over in batches and the old collection is dropped (with its
+        TTL index). A rerun after an interruption starts the copy over. Run it
+        with the API stopped.
+        """
+        database = self.activities_collection.database
+        old = database[f"{self.activities_collection.name}_migrating"]
+        if await database.list_collection_names(filter={"name": old.name}):
+            # An earlier run stopped part-way; discard its partial copy
+            await self.activities_collection.drop()
+        else:
+            info = await self._activity_collection_info()
+            if info is None or (info.get("type") == "timeseries") == (USER_ACTIVITY_STORAGE == "timeseries"):
+                return 0
+            await self.activities_collection.rename(old.name)
+        await self._create_indexes()
         
-        # Log user activity
-        await self._log_user_activity(donor_id, city, "donation", donation_amount)
+        query = {}
+        if USER_ACTIVITY_RETENTION_DAYS:
+            query["timestamp"] = {"$gte": datetime.utcnow() - timedelta(days=USER_ACTIVITY_RETENTION_DAYS)}
+        copied = 0
+        batch = []
+        async for activity in old.find(query):
+            batch.append(activity)
+            if len(batch) >= batch_size:
+                await self.activities_collection.insert_many(batch, ordered=False)
+                copied += len(batch)
+                batch = []
+        if batch:
+            await self.activities_collection.insert_many(batch, ordered=False)
+            copied += len(batch)
+        await old.drop()
+        return copied
+    
+    async def update_city_ranking(self, city: str, donation_amount: float, donor_id: int):
+        """Queue a donation for the next batched city ranking write"""
+        await self.update_city_rankings([(city, donation_amount, donor_id)])
+    
+    async def update_city_rankings(self, donations: Iterable[Tuple[str, float, int]]):
+        """Queue a batch of (city, amount, donor_id) donations, merged into one delta per city.
+
+        Callers have already committed the donations, so this never raises:
+        the deltas are queued first and flush failures are only logged.
+        """
+        for city, donation_amount, donor_id in donations:
+            now = datetime.utcnow()
+            delta = self._pending_deltas.setdefault(city, self._empty_delta())
+            delta["total_donations"] += donation_amount
+            delta["donation_count"] += 1
+            delta["donor_ids"].add(donor_id)
+            # Bucket counts ride with the delta, so shed activity records still count
+            day = delta["days"].setdefault(_bucket_start("day", now), [0.0, 0])
+            day[0] += donation_amount
+            day[1] += 1
+            
+            # Log user activity
+            await self._log_user_activity(donor_id, city, "donation", donation_amount, now)
         
-        # Recalculate rankings
-        await self._recalculate_rankings()
+        # Backpressure: once the buffer is full, the caller waits for a flush
+        if len(self._pending_activities) >= WRITE_BEHIND_MAX_PENDING:
+            await self._wait_for_flush()
+    
+    async def _wait_for_flush(self):
+        """Wait (bounded) for a flush, then shed activity records over the cap"""
+        if self._backpressure_flush is None or self._backpressure_flush.done():
+            self._backpressure_flush = asyncio.create_task(self.flush())
+            self._backpressure_flush.add_done_callback(self._log_flush_failure)
+        try:
+            # Shielded: a timed-out caller must not cancel a write in progress
+            await asyncio.wait_for(
+                asyncio.shield(self._backpressure_flush), WRITE_BEHIND_BACKPRESSURE_TIMEOUT_SECONDS
+            )
+        except asyncio.TimeoutError:
+            logger.warning("City ranking flush still running after %.1fs", WRITE_BEHIND_BACKPRESSURE_TIMEOUT_SECONDS)
+        except Exception:
+            pass  # Logged by _log_flush_failure
+        
+        overflow = len(self._pending_activities) - WRITE_BEHIND_MAX_PENDING
+        if overflow > 0:
+            del self._pending_activities[:overflow]
+            logger.warning("Dropped %d queued user activities; MongoDB is not keeping up", overflow)
+    
+    @staticmethod
+    def _log_flush_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Failed to flush queued city ranking updates", exc_info=task.exception())
     
-    async def _log_user_activity(self, user_id: int, city: str, activity_type: str, amount: float = None):
-        """Log user activity for analytics"""
+    async def load_city_totals(self, totals: Dict[str, Dict[str, Any]]):
+        """Write pre-aggregated per-city totals in one flush, without activity records.
+
+        ``totals`` maps city to total_donations, donation_count and a set of
+        donor_ids; used for bulk loads such as seeding.
+        """
+        for city, total in totals.items():
+            delta = self._pending_deltas.setdefault(city, self._empty_delta())
+            delta["total_donations"] += total["total_donations"]
+            delta["donation_count"] += total["donation_count"]
+            delta["donor_ids"] |= total["donor_ids"]
+        await self.flush()
+    
+    async def _log_user_activity(self, user_id: int, city: str, activity_type: str, amount: float = None,
+                                 timestamp: Optional[datetime] = None):
+        """Queue a user activity record for analytics"""
         activity = {
             "user_id": user_id,
             "city": city,
             "activity_type": activity_type,
             "amount": amount,
-            "timestamp": datetime.utcnow()
+            "timestamp": timestamp or datetime.utcnow()
         }
-        self.activities_collection.insert_one(activity)
+        self._pending_activities.append(activity)
     
-    async def _recalculate_rankings(self):
-        """Recalculate city rankings based on total donations"""
-        # Get all cities sorted by total donations
-        cities = list(self.collection.find().sort("total_donations", DESCENDING))
+    async def start(self):
+        """Create indexes, warm the rank index and start the background flusher"""
+        await self._create_indexes()
+        if await self._migrate_donor_arrays():
+            await self.rebuild_global_statistics()
+        await self._recalculate_rankings()
+        await self._load_period_indexes(force=True)
+        if await self.analytics_collection.find_one({"_id": GLOBAL_ROLLUP_ID}) is None:
+            await self.rebuild_global_statistics()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+    
+    async def close(self):
+        """Stop the background flusher and write out anything still queued"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+    
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(WRITE_BEHIND_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush queued city ranking updates")
+    
+    def add_flush_listener(self, listener: Callable[[List[str]], Awaitable[None]]):
+        """Register a coroutine called with the cities each flush changed, including re-ranked ones"""
+        self._flush_listeners.append(listener)
+    
+    async def flush(self):
+        """Write all queued donations to MongoDB and move the affected cities.
+
+        Only deltas whose city totals are known not to have been written are
+        requeued; anything after that write is best effort, because retrying
+        it would apply the ``$inc`` a second time.
+        """
+        async with self._flush_lock:
+            if not self._pending_deltas and not self._pending_activities:
+                return
+            deltas, self._pending_deltas = self._pending_deltas, {}
+            activities, self._pending_activities = self._pending_activities, []
+            
+            with CITY_RANKING_FLUSH.time():
+                try:
+                    await self._record_donors(deltas)
+                except Exception:
+                    # No city totals were written yet; retry the whole batch
+                    self._requeue(deltas, activities)
+                    raise
+                
+                upserted, failed = await self._write_city_totals(deltas, activities)
+                if failed:
+                    # Unordered bulk write: only the failed cities were not applied
+                    self._requeue(
+                        {city: deltas.pop(city) for city in failed},
+                        [activity for activity in activities if activity["city"] in failed]
+                    )
+                    activities = [activity for activity in activities if activity["city"] not in failed]
+                
+                # Only now are the written cities' new donors counted
+                self._queue_donor_marks(deltas)
+                try:
+                    await self._mark_donors_counted()
+                except Exception:
+                    logger.exception("Failed to mark city donors as counted; retrying on the next flush")
+                
+                city_docs = await self._write_side_effects(deltas, activities, upserted)
+                operations, touched = self._update_city_ranks(city_docs)
+                if operations:
+                    await self.collection.bulk_write(operations, ordered=False)
+            
+            # Cities whose totals changed plus every city whose rank moved
+            changed = sorted(touched | set(deltas))
+            for listener in self._flush_listeners:
+                try:
+                    await listener(changed)
+                except Exception:
+                    logger.exception("City ranking flush listener failed")
+    
+    def _requeue(self, deltas: Dict[str, Dict[str, Any]], activities: List[Dict[str, Any]]):
+        for city, delta in deltas.items():
+            pending = self._pending_deltas.setdefault(city, self._empty_delta())
+            pending["total_donations"] += delta["total_donations"]
+            pending["donation_count"] += delta["donation_count"]
+            # Their first-time donors are counted again by the retry
+            pending["donor_ids"] |= delta["donor_ids"]
+            for day, (amount, count) in delta["days"].items():
+                pending_day = pending["days"].setdefault(day, [0.0, 0])
+                pending_day[0] += amount
+                pending_day[1] += count
+        self._pending_activities[:0] = activities
+    
+    @staticmethod
+    def _empty_delta() -> Dict[str, Any]:
+        # donor_ids holds the batch's donors until its city totals are written;
+        # new_donors counts the first-time donors among them (_record_donors);
+        # days maps day start to the [amount, count] still to add to buckets
+        return {"total_donations": 0.0, "donation_count": 0, "donor_ids": set(), "new_donors": 0, "days": {}}
+    
+    async def _record_donors(self, deltas: Dict[str, Dict[str, Any]]):
+        """Upsert (city, donor_id) pairs and count the first-time donors per city.
+
+        A new pair stays unmarked (counted: False) until the city totals that
+        count it are written, so a requeued batch counts its donors again.
+        Pairs without the field predate this and are already counted.
+        """
+        await self._mark_donors_counted()
+        pairs = [(city, donor_id) for city, delta in deltas.items() for donor_id in sorted(delta["donor_ids"])]
+        if not pairs:
+            return
+        operations = [
+            UpdateOne(
+                {"city": city, "donor_id": donor_id},
+                {"$setOnInsert": {
+                    "city": city, "donor_id": donor_id, "first_donation_at": datetime.utcnow(), "counted": False
+                }},
+                upsert=True
+            )
+            for city, donor_id in pairs
+        ]
+        try:
+            await self.donors_collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as error:
+            # Another worker upserting the same pair loses with a duplicate key
+            # error, which just means the donor was already recorded
+            if any(write_error["code"] != 11000 for write_error in error.details["writeErrors"]):
+                raise
         
-        # Update ranks
-        for rank, city_doc in enumerate(cities, 1):
-            self.collection.update_one(
-                {"_id": city_doc["_id"]},
+        # Claim the unmarked pairs so that no other worker counts them too
+        unmarked = [
+            {"city": city, "donor_id": {"$in": sorted(delta["donor_ids"])}, "counted": False}
+            for city, delta in deltas.items() if delta["donor_ids"]
+        ]
+        await self.donors_collection.bulk_write([
+            UpdateMany({**pair_filter, "claimed_by": {"$in": [None, self._worker_id]}},
+                       {"$set": {"claimed_by": self._worker_id}})
+            for pair_filter in unmarked
+        ], ordered=False)
+        async for donor in self.donors_collection.find(
+            {"$or": unmarked, "claimed_by": self._worker_id}, {"city": 1}
+        ):
+            deltas[donor["city"]]["new_donors"] += 1
+    
+    def _queue_donor_marks(self, deltas: Dict[str, Dict[str, Any]]):
+        for city, delta in deltas.items():
+            if delta["donor_ids"]:
+                self._donors_to_mark.setdefault(city, set()).update(delta["donor_ids"])
+    
+    async def _mark_donors_counted(self):
+        """Mark the claimed donors whose city totals were written as counted"""
+        if not self._donors_to_mark:
+            return
+        marks, self._donors_to_mark = self._donors_to_mark, {}
+        try:
+            await self.donors_collection.bulk_write([
+                UpdateMany(
+                    {"city": city, "donor_id": {"$in": sorted(donor_ids)}, "claimed_by": self._worker_id},
+                    {"$set": {"counted": True}, "$unset": {"claimed_by": ""}}
+                )
+                for city, donor_ids in marks.items()
+            ], ordered=False)
+        except Exception:
+            self._queue_donor_marks({city: {"donor_ids": donor_ids} for city, donor_ids in marks.items()})
+            raise
+    
+    async def _write_city_totals(
+        self, deltas: Dict[str, Dict[str, Any]], activities: List[Dict[str, Any]]
+    ) -> Tuple[int, set]:
+        """Apply the coalesced deltas to the city documents; returns (cities created, cities not written)"""
+        cities = list(deltas)
+        try:
+            result = await self.collection.bulk_write([
+                UpdateOne(
+                    {"city": city},
+                    {
+                        "$inc": {
+                            "total_donations": deltas[city]["total_donations"],
+                            "total_donors": deltas[city]["new_donors"],
+                            "donation_count": deltas[city]["donation_count"]
+                        },
+                        "$set": {"last_updated": datetime.utcnow()}
+                    },
+                    upsert=True
+                )
+                for city in cities
+            ], ordered=False)
+            return result.upserted_count, set()
+        except BulkWriteError as error:
+            failed = {cities[write_error["index"]] for write_error in error.details["writeErrors"]}
+            logger.error("City ranking write failed for %d of %d cities; retrying those", len(failed), len(cities))
+            return error.details.get("nUpserted", 0), failed
+        except ServerSelectionTimeoutError:
+            # No server was reached, so nothing was written
+            self._requeue(deltas, activities)
+            raise
+        except Exception:
+            # The write may have landed; retrying could count it twice
+            self._global_rollup_stale = True
+            self._rank_index_stale = True
+            self._queue_donor_marks(deltas)
+            logger.exception("City ranking write of %d cities may be partly applied; not retried", len(cities))
+            raise
+    
+    async def _write_side_effects(
+        self, deltas: Dict[str, Dict[str, Any]], activities: List[Dict[str, Any]], upserted: int
+    ) -> List[Dict[str, Any]]:
+        """Best-effort writes that follow the city totals; returns the updated city documents"""
+        now = datetime.utcnow()
+        try:
+            await self.analytics_collection.update_one(
+                {"_id": GLOBAL_ROLLUP_ID},
                 {
-                    "$set": {
-                        "rank": rank,
-                        "average_donation": city_doc["total_donations"] / city_doc["donation_count"]
-                    }
-                }
+                    "$inc": {
+                        "total_cities": upserted,
+                        "total_donations": sum(d["total_donations"] for d in deltas.values()),
+                        "total_donors": sum(d["new_donors"] for d in deltas.values()),
+                        "donation_count": sum(d["donation_count"] for d in deltas.values())
+                    },
+                    "$set": {"last_updated": now}
+                },
+                upsert=True
             )
+        except Exception:
+            # City totals are already applied; rebuild the rollup on next read
+            self._global_rollup_stale = True
+            logger.exception("Failed to update the global statistics rollup")
+        
+        if activities:
+            try:
+                await self.activities_collection.insert_many(activities, ordered=False)
+            except Exception:
+                # Rankings are already applied; losing analytics beats double counting
+                logger.exception("Failed to write %d user activities", len(activities))
+        
+        try:
+            await self._write_period_buckets(deltas)
+        except Exception:
+            # Force the windowed indexes to reload from whatever was written
+            self._period_buckets.clear()
+            logger.exception("Failed to update time-bucketed city rankings")
+        
+        try:
+            return await self.collection.find(
+                {"city": {"$in": list(deltas)}},
+                {"city": 1, "total_donations": 1, "total_donors": 1, "donation_count": 1}
+            ).to_list(length=None)
+        except Exception:
+            # Totals are written; reload the rank index instead of moving cities
+            self._rank_index_stale = True
+            logger.exception("Failed to read back updated city documents")
+            return []
     
-    async def get_top_cities(self, limit: int = 3) -> List[Dict[str, Any]]:
-        """Get top N cities by total donations"""
-        cities = list(self.collection.find().sort("total_donations", DESCENDING).limit(limit))
-        return [
+    async def _write_period_buckets(self, deltas: Dict[str, Dict[str, Any]]):
+        """Add the deltas' per-day donations to their day/week/month buckets and the windowed indexes"""
+        increments: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        for city, delta in deltas.items():
+            for day, (amount, count) in delta["days"].items():
+                for period in BUCKET_PERIODS:
+                    start = _bucket_start(period, day)
+                    increment = increments.setdefault(
+                        (period, _bucket_key(period, start), city),
+                        {"bucket_start": start, "total_donations": 0.0, "donation_count": 0}
+                    )
+                    increment["total_donations"] += amount
+                    increment["donation_count"] += count
+        if not increments:
+            return
+        
+        # Roll windows over before writing, so a reload cannot already include
+        # this batch when the increments are added to the indexes below
+        now = datetime.utcnow()
+        await self._load_period_indexes()
+        
+        await self.buckets_collection.bulk_write([
+            UpdateOne(
+                {"period": period, "bucket": bucket, "city": city},
+                {
+                    "$inc": {
+                        "total_donations": increment["total_donations"],
+                        "donation_count": increment["donation_count"]
+                    },
+                    "$setOnInsert": self._bucket_fields(period, increment["bucket_start"])
+                },
+                upsert=True
+            )
+            for (period, bucket, city), increment in increments.items()
+        ], ordered=False)
+        
+        rolling_start = _rolling_window_start(now)
+        for (period, bucket, city), increment in increments.items():
+            if self._period_buckets.get(period) == bucket:
+                self._bump_period_index(period, city, increment)
+            if period == "day" and increment["bucket_start"] >= rolling_start:
+                self._bump_period_index(ROLLING_PERIOD, city, increment)
+    
+    @staticmethod
+    def _bucket_fields(period: str, start: datetime) -> Dict[str, Any]:
+        fields = {"bucket_start": start}
+        retention_days = _bucket_retention_days(period)
+        if retention_days:
+            fields["expires_at"] = _bucket_end(period, start) + timedelta(days=retention_days)
+        return fields
+    
+    def _bump_period_index(self, period: str, city: str, increment: Dict[str, Any]):
+        row = self.period_indexes[period].get(city) or {"city": city, "total_donations": 0.0, "donation_count": 0}
+        row["total_donations"] += increment["total_donations"]
+        row["donation_count"] += increment["donation_count"]
+        self.period_indexes[period].upsert(row)
+    
+    def _current_bucket(self, period: str, now: datetime) -> str:
+        if period == ROLLING_PERIOD:
+            return f"{_bucket_key('day', _rolling_window_start(now))}..{_bucket_key('day', now)}"
+        return _bucket_key(period, _bucket_start(period, now))
+    
+    async def _load_period_indexes(self, force: bool = False):
+        """(Re)load the windowed rank indexes whose bucket has rolled over"""
+        now = datetime.utcnow()
+        for period in RANKING_PERIODS:
+            bucket = self._current_bucket(period, now)
+            if not force and self._period_buckets.get(period) == bucket:
+                continue
+            if period == ROLLING_PERIOD:
+                rows = await self.buckets_collection.aggregate([
+                    {"$match": {"period": "day", "bucket_start": {"$gte": _rolling_window_start(now)}}},
+                    {
+                        "$group": {
+                            "_id": "$city",
+                            "total_donations": {"$sum": "$total_donations"},
+                            "donation_count": {"$sum": "$donation_count"}
+                        }
+                    },
+                    {"$project": {"_id": 0, "city": "$_id", "total_donations": 1, "donation_count": 1}}
+                ]).to_list(length=None)
+            else:
+                rows = await self.buckets_collection.find(
+                    {"period": period, "bucket": bucket},
+                    {"_id": 0, "city": 1, "total_donations": 1, "donation_count": 1}
+                ).to_list(length=None)
+            self.period_indexes[period].load(rows)
+            self._period_buckets[period] = bucket
+    
+    async def _migrate_donor_arrays(self) -> int:
+        """Move legacy donor_ids arrays into city_donors and fix total_donors"""
+        migrated = 0
+        async for city_doc in self.collection.find(
+            {"donor_ids": {"$exists": True}}, {"city": 1, "donor_ids": 1}
+        ):
+            donor_ids = sorted(set(city_doc["donor_ids"]))
+            if donor_ids:
+                await self.donors_collection.bulk_write([
+                    UpdateOne(
+                        {"city": city_doc["city"], "donor_id": donor_id},
+                        {"$setOnInsert": {"city": city_doc["city"], "donor_id": donor_id}},
+                        upsert=True
+                    )
+                    for donor_id in donor_ids
+                ], ordered=False)
+            total_donors = await self.donors_collection.count_documents({"city": city_doc["city"]})
+            await self.collection.update_one(
+                {"_id": city_doc["_id"]},
+                {"$set": {"total_donors": total_donors}, "$unset": {"donor_ids": ""}}
+            )
+            migrated += 1
+        if migrated:
+            logger.info("Migrated donor_ids arrays of %d cities to city_donors", migrated)
+        return migrated
+    
+    def _update_city_ranks(self, city_docs: List[Dict[str, Any]]) -> Tuple[List[UpdateOne], set]:
+        """Move cities in the rank index; returns average updates and every city whose rank moved"""
+        touched = set()
+        for city_doc in city_docs:
+            old_rank, new_rank = self.rank_index.upsert(city_doc)
+            
+            # A new city pushes everything below it down; a moved city only
+            # shifts the cities between its old and new positions.
+            if old_rank is None:
+                first, last = new_rank, len(self.rank_index)
+            else:
+                first, last = min(old_rank, new_rank), max(old_rank, new_rank)
+            touched.update(self.rank_index.cities(first, last))
+        
+        # Ranks are not persisted: another worker's index may order the
+        # cities differently until its next refresh, so they are derived on read
+        operations = [
+            UpdateOne(
+                {"city": city_doc["city"]},
+                {"$set": {"average_donation": city_doc["total_donations"] / city_doc["donation_count"]}}
+            )
+            for city_doc in city_docs
+        ]
+        return operations, touched
+    
+    async def _load_rank_index(self) -> List[Dict[str, Any]]:
+        """Warm the rank index from MongoDB, returning the loaded documents"""
+        city_docs = await self.collection.find(
+            {},
             {
-                "city": city["city"],
-                "total_donations": city["total_donations"],
-                "total_donors": city["total_donors"],
-                "rank": city["rank"],
-                "average_donation": city["average_donation"]
+                "city": 1, "total_donations": 1, "total_donors": 1,
+                "donation_count": 1, "rank": 1, "average_donation": 1
             }
-            for city in cities
-        ]
+        ).to_list(length=None)
+        self.rank_index.load(city_docs)
+        self._rank_index_loaded_at = time.monotonic()
+        self._rank_index_stale = False
+        return city_docs
+    
+    def _rank_index_expired(self) -> bool:
+        if self._rank_index_stale:
+            return True
+        if RANK_INDEX_REFRESH_SECONDS <= 0:
+            return False
+        return time.monotonic() - self._rank_index_loaded_at >= RANK_INDEX_REFRESH_SECONDS
+    
+    async def _refresh_rank_index(self):
+        """Reload the rank index if it is older than RANK_INDEX_REFRESH_SECONDS or a flush left it stale"""
+        if not self._rank_index_expired():
+            return
+        # Hold the flush lock so a concurrent flush cannot move cities in the
+        # index between our read and the reload
+        async with self._flush_lock:
+            if self._rank_index_expired():
+                if self._rank_index_stale:
+                    await self._recalculate_rankings()
+                else:
+                    await self._load_rank_index()
+                await self._load_period_indexes(force=True)
+    
+    async def _recalculate_rankings(self):
+        """Rebuild the rank index from MongoDB and persist any averages that drifted"""
+        with CITY_RANKING_RECALCULATION.time():
+            city_docs = await self._load_rank_index()
+            
+            operations = []
+            for city_doc in city_docs:
+                average_donation = city_doc["total_donations"] / city_doc["donation_count"]
+                update = {}
+                if city_doc.get("average_donation") != average_donation:
+                    update["$set"] = {"average_donation": average_donation}
+                if "rank" in city_doc:
+                    # Written by older versions that persisted ranks
+                    update["$unset"] = {"rank": ""}
+                if update:
+                    operations.append(UpdateOne({"_id": city_doc["_id"]}, update))
+            if operations:
+                await self.collection.bulk_write(operations, ordered=False)
+    
+    async def get_top_cities(self, limit: int = 3) -> List[Dict[str, Any]]:
+        """Get top N cities by total donations"""
+        await self._refresh_rank_index()
+        return self.rank_index.window(1, limit)
     
     async def get_city_context(self, user_city: str, context_size: int = 3) -> Dict[str, Any]:
         """Get user's city ranking context (3 cities above and below)"""
+        await self._refresh_rank_index()
+        
         # Find user's city rank
-        user_city_doc = self.collection.find_one({"city": user_city})
-        if not user_city_doc:
+        user_rank = self.rank_index.rank(user_city)
+        if user_rank is None:
             return {"user_city_rank": None, "user_city_context": []}
         
-        user_rank = user_city_doc["rank"]
-        
         # Get cities around user's city
         start_rank = max(1, user_rank - context_size)
         end_rank = user_rank + context_size
         
-        context_cities = list(
-            self.collection.find(
-                {"rank": {"$gte": start_rank, "$lte": end_rank}}
-            ).sort("rank", ASCENDING)
-        )
+        return {
+            "user_city_rank": user_rank,
+            "user_city_context": self.rank_index.window(start_rank, end_rank)
+        }
+    
+    async def get_period_rankings(self, period: str, user_city: str, limit: int = 3,
+                                  context_size: int = 3) -> Dict[str, Any]:
+        """Get top cities and the user's city context for a time window"""
+        await self._refresh_rank_index()
+        now = datetime.utcnow()
+        if any(self._period_buckets.get(p) != self._current_bucket(p, now) for p in RANKING_PERIODS):
+            async with self._flush_lock:
+                await self._load_period_indexes()
+        
+        index = self.period_indexes[period]
+        user_rank = index.rank(user_city)
+        user_city_context = []
+        if user_rank is not None:
+            user_city_context = index.window(max(1, user_rank - context_size), user_rank + context_size)
         
         return {
+            "period": period,
+            "bucket": self._period_buckets[period],
+            "top_cities": index.window(1, limit),
             "user_city_rank": user_rank,
-            "user_city_context": [
-                {
-                    "city": city["city"],
-                    "total_donations": city["total_donations"],
-                    "total_donors": city["total_donors"],
-                    "rank": city["rank"],
-                    "average_donation": city["average_donation"]
-                }
-                for city in context_cities
-            ]
+            "user_city_context": user_city_context
         }
     
     async def get_city_statistics(self, city: str) -> Dict[str, Any]:
         """Get detailed statistics for a specific city"""
-        city_doc = self.collection.find_one({"city": city})
+        city_doc = await self.collection.find_one({"city": city})
         if not city_doc:
             return None
         
+        # Cities ahead in (total_donations desc, city asc) order, the rank index's order
+        ahead = await self.collection.count_documents({
+            "$or": [
+                {"total_donations": {"$gt": city_doc["total_donations"]}},
+                {"total_donations": city_doc["total_donations"], "city": {"$lt": city}}
+            ]
+        })
+        
         # Get recent activities for this city
-        recent_activities = list(
-            self.activities_collection.find(
-                {"city": city}
-            ).sort("timestamp", DESCENDING).limit(10)
-        )
+        recent_activities = await self.activities_collection.find(
+            {"city": city}, {"_id": 0}
+        ).sort("timestamp", DESCENDING).limit(10).to_list(length=10)
         
         return {
             "city": city_doc["city"],
             "total_donations": city_doc["total_donations"],
             "total_donors": city_doc["total_donors"],
-            "rank": city_doc["rank"],
+            "rank": ahead + 1,
             "average_donation": city_doc["average_donation"],
             "donation_count": city_doc["donation_count"],
             "last_updated": city_doc["last_updated"],
             "recent_activities": recent_activities
         }
     
-    async def get_global_statistics(self) -> Dict[str, Any]:
-        """Get global platform statistics"""
-        total_cities = self.collection.count_documents({})
-        total_donations = sum(
-            city["total_donations"] 
-            for city in self.collection.find({}, {"total_donations": 1})
-        )
-        total_donors = sum(
-            city["total_donors"] 
-            for city in self.collection.find({}, {"total_donors": 1})
+    async def rebuild_global_statistics(self) -> Dict[str, Any]:
+        """Recompute the global rollup from city_rankings with one $group pass"""
+        totals = await self.collection.aggregate([
+            {
+                "$group": {
+                    "_id": None,
+                    "total_cities": {"$sum": 1},
+                    "total_donations": {"$sum": "$total_donations"},
+                    "total_donors": {"$sum": "$total_donors"},
+                    "donation_count": {"$sum": "$donation_count"}
+                }
+            }
+        ]).to_list(length=1)
+        rollup = totals[0] if totals else {
+            "total_cities": 0, "total_donations": 0.0, "total_donors": 0, "donation_count": 0
+        }
+        rollup.pop("_id", None)
+        rollup["last_updated"] = datetime.utcnow()
+        
+        await self.analytics_collection.update_one(
+            {"_id": GLOBAL_ROLLUP_ID}, {"$set": rollup}, upsert=True
         )
+        self._global_rollup_stale = False
+        return rollup
+    
+    async def get_global_statistics(self) -> Dict[str, Any]:
+        """Get global platform statistics from the materialized rollup"""
+        rollup = None
+        if not self._global_rollup_stale:
+            rollup = await self.analytics_collection.find_one({"_id": GLOBAL_ROLLUP_ID})
+        if rollup is None:
+            rollup = await self.rebuild_global_statistics()
         
+        total_cities = rollup.get("total_cities", 0)
+        total_donations = rollup.get("total_donations", 0.0)
         return {
             "total_cities": total_cities,
             "total_donations": total_donations,
-            "total_donors": total_donors,
+            "total_donors": rollup.get("total_donors", 0),
             "average_donation_per_city": total_donations / total_cities if total_cities > 0 else 0
         }
 
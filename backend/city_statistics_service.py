@@ -0,0 +1,165 @@
+from sqlalchemy import Float, case, cast, func, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import CityStatistics, Donation, Refund, User
+from datetime import datetime
+from typing import Any, Iterable, List, Optional, Tuple
+
+SECONDS_PER_MONTH = 30.44 * 24 * 3600
+
+# Columns written by every upsert, in from_select order
+UPSERT_COLUMNS = [
+    "city", "total_donations", "donation_count", "total_donors", "average_donation",
+    "donation_frequency", "first_donation_at", "last_updated"
+]
+
+class CityStatisticsService:
+    """Keeps the city_statistics table current with atomic upserts.
+
+    Donations and refunds add their deltas with ``INSERT ... ON CONFLICT (city)
+    DO UPDATE``, so city analytics are single-row reads instead of GROUP BY
+    joins over donations. ``rebuild`` recomputes every row from scratch.
+    """
+
+    @staticmethod
+    def _insert(dialect: str):
+        return postgresql.insert if dialect == "postgresql" else sqlite.insert
+
+    @staticmethod
+    def _months_since(dialect: str, start, now: datetime):
+        """Months between ``start`` and ``now``, at least 1, as a SQL expression"""
+        if dialect == "postgresql":
+            return func.greatest(func.extract("epoch", literal(now) - start) / SECONDS_PER_MONTH, 1.0)
+        return func.max((func.julianday(literal(now)) - func.julianday(start)) * 86400 / SECONDS_PER_MONTH, 1.0)
+
+    def _upsert(self, dialect: str, stmt, now: datetime, accumulate: bool = True):
+        """Add the inserted row to an existing city row, or replace it when ``accumulate`` is False"""
+        table = CityStatistics.__table__
+        excluded = stmt.excluded
+        if accumulate:
+            total = table.c.total_donations + excluded.total_donations
+            count = table.c.donation_count + excluded.donation_count
+            donors = table.c.total_donors + excluded.total_donors
+            first = func.coalesce(table.c.first_donation_at, excluded.first_donation_at)
+        else:
+            total, count, donors, first = (
+                excluded.total_donations, excluded.donation_count, excluded.total_donors, excluded.first_donation_at
+            )
+        return stmt.on_conflict_do_update(index_elements=[table.c.city], set_={
+            "total_donations": total,
+            "donation_count": count,
+            "total_donors": donors,
+            "average_donation": case((count > 0, total / cast(count, Float)), else_=0.0),
+            "donation_frequency": cast(count, Float) / self._months_since(dialect, first, now),
+            "first_donation_at": first,
+            "last_updated": now
+        })
+
+    def upsert_from_select(self, db: AsyncSession, source, now: datetime):
+        """Upsert statement fed by a SELECT of one (city, amount, donor_id, is_new_donor) delta per row"""
+        rows = source.subquery()
+        dialect = db.bind.dialect.name
+        return self._upsert(dialect, self._insert(dialect)(CityStatistics).from_select(UPSERT_COLUMNS, select(
+            rows.c.city,
+            rows.c.amount,
+            literal(1),
+            rows.c.is_new_donor,
+            rows.c.amount,
+            literal(1.0),
+            literal(now),
+            literal(now)
+        )), now)
+
+    async def record_donations(
+        self,
+        db: AsyncSession,
+        deltas: Iterable[Tuple[str, float, int, int]],
+        now: Optional[datetime] = None
+    ):
+        """Apply (city, amount, donation_count, new_donors) deltas with one executemany upsert"""
+        now = now or datetime.utcnow()
+        params = [
+            {
+                "city": city,
+                "total_donations": amount,
+                "donation_count": count,
+                "total_donors": new_donors,
+                "average_donation": amount / count if count else 0.0,
+                "donation_frequency": float(count),
+                "first_donation_at": now if count else None,
+                "last_updated": now
+            }
+            for city, amount, count, new_donors in deltas
+        ]
+        if params:
+            dialect = db.bind.dialect.name
+            await db.execute(self._upsert(dialect, self._insert(dialect)(CityStatistics), now), params)
+
+    async def record_refund(self, db: AsyncSession, city: str, amount: float, now: Optional[datetime] = None):
+        """Take a processed refund off its city's totals"""
+        await self.record_donations(db, [(city, -amount, 0, 0)], now)
+
+    async def rebuild(self, db: AsyncSession, now: Optional[datetime] = None):
+        """Recompute every city from donations and processed refunds in one set-based pass"""
+        for stmt in self.rebuild_statements(db.bind.dialect.name, now or datetime.utcnow()):
+            await db.execute(stmt)
+        await db.commit()
+
+    def rebuild_statements(self, dialect: str, now: datetime) -> List[Any]:
+        """The statements of ``rebuild``, in order; migrations run them on a sync connection"""
+        refunds = (
+            select(User.city.label("city"), func.sum(Refund.refund_amount).label("refunded"))
+            .join(Donation, Donation.id == Refund.donation_id)
+            .join(User, User.id == Donation.donor_id)
+            .where(Refund.status == "processed")
+            .group_by(User.city)
+            .subquery()
+        )
+        donations = (
+            select(
+                User.city.label("city"),
+                func.sum(Donation.amount).label("total_donations"),
+                func.count(Donation.id).label("donation_count"),
+                func.count(Donation.donor_id.distinct()).label("total_donors"),
+                func.min(Donation.created_at).label("first_donation_at")
+            )
+            .join(User, User.id == Donation.donor_id)
+            .group_by(User.city)
+            .subquery()
+        )
+        total = donations.c.total_donations - func.coalesce(refunds.c.refunded, 0.0)
+        months = self._months_since(dialect, donations.c.first_donation_at, now)
+        source = (
+            select(
+                donations.c.city,
+                total,
+                donations.c.donation_count,
+                donations.c.total_donors,
+                total / cast(donations.c.donation_count, Float),
+                cast(donations.c.donation_count, Float) / months,
+                donations.c.first_donation_at,
+                literal(now)
+            )
+            .select_from(donations.outerjoin(refunds, refunds.c.city == donations.c.city))
+            # SQLite needs a WHERE clause to parse INSERT ... SELECT ... ON CONFLICT
+            .where(literal(True))
+        )
+
+        return [
+            # Cities without donations any more keep their row, with zeroed totals
+            update(CityStatistics).values(
+                total_donations=0.0, donation_count=0, total_donors=0, average_donation=0.0,
+                donation_frequency=0.0, first_donation_at=None, last_updated=now
+            ),
+            self._upsert(
+                dialect, self._insert(dialect)(CityStatistics).from_select(UPSERT_COLUMNS, source), now,
+                accumulate=False
+            )
+        ]
+
+    async def get(self, db: AsyncSession, city: str) -> Optional[CityStatistics]:
+        result = await db.execute(select(CityStatistics).where(CityStatistics.city == city))
+        return result.scalars().first()
+
+# Global instance
+city_statistics_service = CityStatisticsService()
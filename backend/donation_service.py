@@ -0,0 +1,378 @@
+from sqlalchemy import String, bindparam, case, cast, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import ValidationError
+from models import Campaign, Donation, Transaction, User, UserProfile
+from schemas import BulkDonationError, BulkDonationResult, DonationCreate
+from city_ranking_service import city_ranking_service
+from city_statistics_service import city_statistics_service
+from goal_service import goal_service
+from datetime import datetime
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Optional, Tuple
+import codecs
+import csv
+import json
+import os
+
+# Bulk imports are validated, written and committed this many rows at a time
+BULK_DONATION_CHUNK_SIZE = int(os.getenv("BULK_DONATION_CHUNK_SIZE", "5000"))
+# Only the first rejected rows are reported back individually
+BULK_DONATION_MAX_ERRORS = int(os.getenv("BULK_DONATION_MAX_ERRORS", "100"))
+BULK_DONATION_FORMATS = {"text/csv": "csv", "application/x-ndjson": "ndjson"}
+
+# A parsed input record: (line number, fields, parse error)
+ImportRecord = Tuple[int, Optional[Dict[str, Any]], Optional[str]]
+
+async def aiter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """Split a byte stream into text lines without buffering the whole stream"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line + "\n"
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+async def aiter_records(lines: AsyncIterable[str], fmt: str) -> AsyncIterator[ImportRecord]:
+    """Parse NDJSON lines, or CSV lines with a header row, into donation records"""
+    line_no = 0
+    if fmt == "ndjson":
+        async for line in lines:
+            line_no += 1
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line), None
+            except ValueError as e:
+                yield line_no, None, f"Invalid JSON: {e}"
+        return
+    
+    header = None
+    pending, quotes, start = [], 0, 0
+    async for line in lines:
+        line_no += 1
+        if not pending:
+            start = line_no
+        pending.append(line)
+        # A quoted field may span lines; the record ends once quotes balance
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        text = "".join(pending)
+        pending, quotes = [], 0
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        # Empty cells fall back to the schema defaults
+        yield start, {name: value for name, value in zip(header, values) if value != ""}, None
+    if pending:
+        yield start, None, "Unterminated quoted field"
+
+class DonationService:
+    """Writes a donation and its side effects with atomic, set-based SQL.
+
+    The campaign and profile totals are bumped with ``SET x = x + :amount``
+    instead of a Python read-modify-write, so concurrent donations to the same
+    campaign cannot lose updates. The new campaign totals are checked against
+    the campaign's cached goal thresholds in the same transaction.
+    """
+
+    async def create_donation(self, db: AsyncSession, donor_id: int, donation: DonationCreate):
+        """Record a donation; returns the donation row, or None if the campaign does not exist"""
+        if db.bind.dialect.name == "postgresql":
+            created = await self._create_donation_cte(db, donor_id, donation)
+        else:
+            created = await self._create_donation_statements(db, donor_id, donation)
+        
+        if created is None:
+            await db.rollback()
+            return None
+        row, current_amount = created
+        await goal_service.check_goals(db, {donation.campaign_id: current_amount})
+        await db.commit()
+        return row
+    
+    async def _create_donation_cte(self, db: AsyncSession, donor_id: int, donation: DonationCreate):
+        """Single round-trip: every write is a data-modifying CTE of one statement"""
+        # Column defaults and onupdate hooks are not applied inside CTEs, so
+        # timestamps are set explicitly
+        now = datetime.utcnow()
+        campaign_cte = (
+            update(Campaign)
+            .where(Campaign.id == donation.campaign_id)
+            .values(current_amount=Campaign.current_amount + donation.amount, updated_at=now)
+            .returning(Campaign.id, Campaign.current_amount)
+            .cte("updated_campaign")
+        )
+        donation_cte = (
+            insert(Donation)
+            .from_select(
+                ["amount", "donor_id", "campaign_id", "message", "is_anonymous", "created_at"],
+                select(
+                    literal(donation.amount),
+                    literal(donor_id),
+                    campaign_cte.c.id,
+                    literal(donation.message, String),
+                    literal(donation.is_anonymous),
+                    literal(now)
+                )
+            )
+            .returning(*Donation.__table__.c)
+            .cte("new_donation")
+        )
+        transaction_cte = (
+            insert(Transaction)
+            .from_select(
+                [
+                    "donation_id", "transaction_type", "amount", "status",
+                    "payment_method", "transaction_id", "created_at", "updated_at"
+                ],
+                select(
+                    donation_cte.c.id,
+                    literal("donation"),
+                    donation_cte.c.amount,
+                    literal("completed"),
+                    literal("online"),
+                    literal("TXN_") + cast(donation_cte.c.id, String) + literal(f"_{donor_id}"),
+                    literal(now),
+                    literal(now)
+                )
+            )
+            .cte("new_transaction")
+        )
+        profile_cte = (
+            update(UserProfile)
+            .where(UserProfile.user_id == donor_id)
+            .where(select(donation_cte.c.id).exists())
+            .values(total_donated=UserProfile.total_donated + donation.amount, updated_at=now)
+            .cte("updated_profile")
+        )
+        # CTEs read the snapshot from before the statement, so the new
+        # donation is not visible to the first-donation check
+        statistics_cte = city_statistics_service.upsert_from_select(db, select(
+            User.city.label("city"),
+            donation_cte.c.amount.label("amount"),
+            case((select(Donation.id).where(Donation.donor_id == donor_id).exists(), 0), else_=1).label("is_new_donor")
+        ).select_from(donation_cte.join(User, User.id == donation_cte.c.donor_id)), now).cte("updated_city_statistics")
+        
+        result = await db.execute(
+            select(donation_cte, campaign_cte.c.current_amount.label("campaign_current_amount"))
+            .add_cte(transaction_cte, profile_cte, statistics_cte)
+        )
+        row = result.first()
+        return None if row is None else (row, row.campaign_current_amount)
+    
+    async def _create_donation_statements(self, db: AsyncSession, donor_id: int, donation: DonationCreate):
+        """Portable path for databases without data-modifying CTEs (e.g. SQLite)"""
+        result = await db.execute(
+            update(Campaign)
+            .where(Campaign.id == donation.campaign_id)
+            .values(current_amount=Campaign.current_amount + donation.amount)
+            .returning(Campaign.current_amount)
+        )
+        current_amount = result.scalar()
+        if current_amount is None:
+            return None
+        
+        donor = (await db.execute(
+            select(User.city, select(Donation.id).where(Donation.donor_id == donor_id).exists())
+            .where(User.id == donor_id)
+        )).first()
+        
+        result = await db.execute(
+            insert(Donation)
+            .values(
+                amount=donation.amount,
+                donor_id=donor_id,
+                campaign_id=donation.campaign_id,
+                message=donation.message,
+                is_anonymous=donation.is_anonymous
+            )
+            .returning(*Donation.__table__.c)
+        )
+        row = result.one()
+        
+        await db.execute(
+            insert(Transaction).values(
+                donation_id=row.id,
+                transaction_type="donation",
+                amount=donation.amount,
+                status="completed",
+                payment_method="online",
+                transaction_id=f"TXN_{row.id}_{donor_id}"
+            )
+        )
+        await db.execute(
+            update(UserProfile)
+            .where(UserProfile.user_id == donor_id)
+            .values(total_donated=UserProfile.total_donated + donation.amount)
+        )
+        if donor is not None:
+            city, has_donated = donor
+            await city_statistics_service.record_donations(db, [(city, donation.amount, 1, 0 if has_donated else 1)])
+        return row, current_amount
+    
+    async def import_donations(
+        self,
+        db: AsyncSession,
+        records: AsyncIterable[ImportRecord],
+        donor_id: Optional[int] = None,
+        chunk_size: int = BULK_DONATION_CHUNK_SIZE
+    ) -> BulkDonationResult:
+        """Validate and write a stream of donations chunk by chunk.
+
+        Every record is checked against ``DonationCreate``; with ``donor_id``
+        set all donations are recorded for that donor, otherwise each record
+        must carry its own ``donor_id``. Each chunk is committed on its own,
+        so rows already reported as inserted stay written if a later chunk
+        fails.
+        """
+        result = BulkDonationResult()
+        campaign_ids = set()
+        chunk: List[Tuple[int, int, DonationCreate]] = []
+        async for line, record, error in records:
+            if error is None:
+                try:
+                    donation = DonationCreate.model_validate(record)
+                    row_donor_id = donor_id if donor_id is not None else int(record["donor_id"])
+                except ValidationError as e:
+                    first = e.errors()[0]
+                    error = f"{'.'.join(str(loc) for loc in first['loc']) or 'record'}: {first['msg']}"
+                except (KeyError, TypeError, ValueError):
+                    error = "donor_id: a valid integer is required"
+            if error is not None:
+                self._reject(result, line, error)
+                continue
+            
+            chunk.append((line, row_donor_id, donation))
+            if len(chunk) >= chunk_size:
+                await self._import_chunk(db, chunk, result, campaign_ids)
+                chunk = []
+        if chunk:
+            await self._import_chunk(db, chunk, result, campaign_ids)
+        
+        result.campaign_ids = sorted(campaign_ids)
+        return result
+    
+    @staticmethod
+    def _reject(result: BulkDonationResult, line: int, error: str):
+        result.rejected += 1
+        if len(result.errors) < BULK_DONATION_MAX_ERRORS:
+            result.errors.append(BulkDonationError(line=line, error=error))
+    
+    async def _import_chunk(
+        self,
+        db: AsyncSession,
+        chunk: List[Tuple[int, int, DonationCreate]],
+        result: BulkDonationResult,
+        campaign_ids: set
+    ):
+        """Insert one chunk with executemany and apply its totals as one update per key"""
+        chunk_campaigns = {donation.campaign_id for _, _, donation in chunk}
+        existing = set((await db.execute(
+            select(Campaign.id).where(Campaign.id.in_(chunk_campaigns))
+        )).scalars())
+        donor_cities = dict((await db.execute(
+            select(User.id, User.city).where(User.id.in_({donor for _, donor, _ in chunk}))
+        )).all())
+        
+        accepted = []
+        for line, donor, donation in chunk:
+            if donation.campaign_id not in existing:
+                self._reject(result, line, "Campaign not found")
+            elif donor not in donor_cities:
+                self._reject(result, line, "Donor not found")
+            else:
+                accepted.append((donor, donation))
+        if not accepted:
+            return
+        
+        now = datetime.utcnow()
+        try:
+            # Donors with earlier donations do not count towards a city's donors again
+            returning_donors = set((await db.execute(
+                select(Donation.donor_id).where(Donation.donor_id.in_({donor for donor, _ in accepted})).distinct()
+            )).scalars())
+            donation_ids = (await db.execute(
+                insert(Donation).returning(Donation.id, sort_by_parameter_order=True),
+                [
+                    {
+                        "amount": donation.amount,
+                        "donor_id": donor,
+                        "campaign_id": donation.campaign_id,
+                        "message": donation.message,
+                        "is_anonymous": donation.is_anonymous,
+                        "created_at": now
+                    }
+                    for donor, donation in accepted
+                ]
+            )).scalars().all()
+            await db.execute(insert(Transaction), [
+                {
+                    "donation_id": donation_id,
+                    "transaction_type": "donation",
+                    "amount": donation.amount,
+                    "status": "completed",
+                    "payment_method": "online",
+                    "transaction_id": f"TXN_{donation_id}_{donor}",
+                    "created_at": now,
+                    "updated_at": now
+                }
+                for donation_id, (donor, donation) in zip(donation_ids, accepted)
+            ])
+            
+            campaign_totals: Dict[int, float] = {}
+            donor_totals: Dict[int, float] = {}
+            for donor, donation in accepted:
+                campaign_totals[donation.campaign_id] = campaign_totals.get(donation.campaign_id, 0.0) + donation.amount
+                donor_totals[donor] = donor_totals.get(donor, 0.0) + donation.amount
+            await self._add_totals(db, Campaign, Campaign.id, Campaign.current_amount, campaign_totals)
+            await self._add_totals(db, UserProfile, UserProfile.user_id, UserProfile.total_donated, donor_totals)
+            
+            # Only campaigns that still have unreached goals need their new totals read back
+            goal_campaigns = await goal_service.campaigns_with_goals(db, campaign_totals)
+            if goal_campaigns:
+                await goal_service.check_goals(db, dict((await db.execute(
+                    select(Campaign.id, Campaign.current_amount).where(Campaign.id.in_(goal_campaigns))
+                )).all()))
+            
+            city_deltas: Dict[str, list] = {}
+            for donor, donation in accepted:
+                delta = city_deltas.setdefault(donor_cities[donor], [0.0, 0, set()])
+                delta[0] += donation.amount
+                delta[1] += 1
+                if donor not in returning_donors:
+                    delta[2].add(donor)
+            await city_statistics_service.record_donations(db, [
+                (city, amount, count, len(new_donors)) for city, (amount, count, new_donors) in city_deltas.items()
+            ], now)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        
+        result.inserted += len(accepted)
+        result.total_amount += sum(donation.amount for _, donation in accepted)
+        campaign_ids.update(campaign_totals)
+        await city_ranking_service.update_city_rankings(
+            (donor_cities[donor], donation.amount, donor) for donor, donation in accepted
+        )
+    
+    @staticmethod
+    async def _add_totals(db: AsyncSession, model, key_column, total_column, totals: Dict[int, float]):
+        """Add each key's summed amount to its row with a single executemany UPDATE"""
+        table = model.__table__
+        await db.execute(
+            update(table)
+            .where(table.c[key_column.key] == bindparam("b_key"))
+            .values({total_column.key: table.c[total_column.key] + bindparam("b_amount")}),
+            [{"b_key": key, "b_amount": amount} for key, amount in totals.items()]
+        )
+
+# Global instance
+donation_service = DonationService()
@@ -0,0 +1,167 @@
+from bisect import bisect_right
+from collections import OrderedDict
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Campaign, DonationGoal, UserBadge
+from notification_service import notification_service
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import os
+import time
+
+# Unreached-goal threshold cache settings; the TTL bounds how long goals added
+# by another worker can go undetected here
+GOAL_CACHE_TTL_SECONDS = float(os.getenv("GOAL_CACHE_TTL_SECONDS", "60"))
+GOAL_CACHE_MAX_SIZE = int(os.getenv("GOAL_CACHE_MAX_SIZE", "10000"))
+# Notify the campaign creator of each achieved goal and badge them for a "final" one
+GOAL_ACHIEVEMENT_EVENTS = os.getenv("GOAL_ACHIEVEMENT_EVENTS", "true").lower() == "true"
+
+class GoalService:
+    """Detects DonationGoal milestones as campaign totals move.
+
+    Each campaign's unreached goals are cached as parallel lists of sorted
+    thresholds and goal ids, so checking a new ``current_amount`` is a bisect
+    and campaigns without pending goals cost no query at all. Crossed goals
+    are stamped by one ``UPDATE ... WHERE achieved_at IS NULL RETURNING``,
+    which only the first concurrent writer wins.
+    """
+
+    def __init__(self, max_size: int = GOAL_CACHE_MAX_SIZE, ttl_seconds: float = GOAL_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        # campaign_id -> (expires, sorted thresholds, goal ids in the same order)
+        self._entries: "OrderedDict[int, Tuple[float, List[float], List[int]]]" = OrderedDict()
+
+    def _get(self, campaign_id: int) -> Optional[Tuple[List[float], List[int]]]:
+        entry = self._entries.get(campaign_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        self._entries.move_to_end(campaign_id)
+        return entry[1], entry[2]
+
+    async def _load(self, db: AsyncSession, campaign_ids: Iterable[int]) -> Dict[int, Tuple[List[float], List[int]]]:
+        """Cached thresholds for the campaigns, loading every miss with one query"""
+        thresholds = {}
+        missing = set()
+        for campaign_id in campaign_ids:
+            cached = self._get(campaign_id)
+            if cached is None:
+                missing.add(campaign_id)
+            else:
+                thresholds[campaign_id] = cached
+        if not missing:
+            return thresholds
+
+        for campaign_id in missing:
+            thresholds[campaign_id] = ([], [])
+        result = await db.execute(
+            select(DonationGoal.campaign_id, DonationGoal.goal_amount, DonationGoal.id)
+            .where(DonationGoal.campaign_id.in_(missing), DonationGoal.achieved_at.is_(None))
+            .order_by(DonationGoal.campaign_id, DonationGoal.goal_amount, DonationGoal.id)
+        )
+        for campaign_id, goal_amount, goal_id in result:
+            amounts, ids = thresholds[campaign_id]
+            amounts.append(goal_amount)
+            ids.append(goal_id)
+
+        if self.max_size > 0 and self.ttl_seconds > 0:
+            expires = time.monotonic() + self.ttl_seconds
+            for campaign_id in missing:
+                self._entries[campaign_id] = (expires, *thresholds[campaign_id])
+                self._entries.move_to_end(campaign_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return thresholds
+
+    def invalidate(self, *campaign_ids: int):
+        for campaign_id in campaign_ids:
+            self._entries.pop(campaign_id, None)
+
+    async def campaigns_with_goals(self, db: AsyncSession, campaign_ids: Iterable[int]) -> List[int]:
+        """The campaigns that still have unreached goals"""
+        thresholds = await self._load(db, campaign_ids)
+        return [campaign_id for campaign_id, (amounts, _) in thresholds.items() if amounts]
+
+    async def check_goals(self, db: AsyncSession, current_amounts: Dict[int, float]) -> List[Any]:
+        """Stamp the goals crossed by new campaign totals; returns the achieved goal rows.
+
+        Runs in the caller's transaction, so the stamps commit (or roll back)
+        with the donations that caused them.
+        """
+        thresholds = await self._load(db, current_amounts)
+        crossed, crossed_campaigns = [], []
+        for campaign_id, current_amount in current_amounts.items():
+            amounts, ids = thresholds[campaign_id]
+            reached = bisect_right(amounts, current_amount)
+            if reached:
+                crossed.extend(ids[:reached])
+                crossed_campaigns.append(campaign_id)
+        if not crossed:
+            return []
+
+        now = datetime.utcnow()
+        achieved = (await db.execute(
+            update(DonationGoal)
+            .where(DonationGoal.id.in_(crossed), DonationGoal.achieved_at.is_(None))
+            .values(achieved_at=now)
+            .returning(DonationGoal.id, DonationGoal.campaign_id, DonationGoal.goal_amount, DonationGoal.goal_type)
+        )).all()
+        # Reloaded on the next check, so a rolled-back stamp is not lost
+        self.invalidate(*crossed_campaigns)
+        if achieved and GOAL_ACHIEVEMENT_EVENTS:
+            await self._record_achievements(db, achieved, now)
+        return achieved
+
+    async def _record_achievements(self, db: AsyncSession, achieved: List[Any], now: datetime):
+        campaigns = {
+            campaign_id: (creator_id, title)
+            for campaign_id, creator_id, title in await db.execute(
+                select(Campaign.id, Campaign.creator_id, Campaign.title)
+                .where(Campaign.id.in_({goal.campaign_id for goal in achieved}))
+            )
+        }
+        await notification_service.notify(db, [
+            {
+                "user_id": campaigns[goal.campaign_id][0],
+                "title": "Campaign goal reached",
+                "message": f"\"{campaigns[goal.campaign_id][1]}\" reached its {goal.goal_type} goal of ${goal.goal_amount:,.2f}",
+                "notification_type": "campaign",
+                "is_read": False,
+                "created_at": now
+            }
+            for goal in achieved
+        ])
+        badges = [
+            {
+                "user_id": campaigns[goal.campaign_id][0],
+                "badge_type": "campaign_funded",
+                "badge_name": "Campaign Funded",
+                "badge_description": f"\"{campaigns[goal.campaign_id][1]}\" reached its final goal",
+                "earned_at": now
+            }
+            for goal in achieved if goal.goal_type == "final"
+        ]
+        if badges:
+            await db.execute(insert(UserBadge), badges)
+
+    async def create_goal(self, db: AsyncSession, goal: DonationGoal) -> DonationGoal:
+        """Add a goal, stamping it straight away if the campaign has already passed it"""
+        db.add(goal)
+        await db.flush()
+        self.invalidate(goal.campaign_id)
+        current_amount = (await db.execute(
+            select(Campaign.current_amount).where(Campaign.id == goal.campaign_id)
+        )).scalar_one()
+        await self.check_goals(db, {goal.campaign_id: current_amount})
+        await db.commit()
+        await db.refresh(goal)
+        return goal
+
+    async def get_goals(self, db: AsyncSession, campaign_id: int) -> List[DonationGoal]:
+        result = await db.execute(
+            select(DonationGoal).where(DonationGoal.campaign_id == campaign_id).order_by(DonationGoal.goal_amount)
+        )
+        return result.scalars().all()
+
+# Global instance
+goal_service = GoalService()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Bulk Donation Importer
+Streams donations from a CSV (with a header row) or NDJSON file into the
+database in chunks, then applies the campaign, profile and city ranking totals.
+
+Each record has the POST /donations fields (amount, campaign_id, message,
+is_anonymous) plus donor_id, which may be left out when --donor-id is given.
+
+Usage:
+    python import_donations.py donations.csv [--donor-id 1] [--chunk-size 5000]
+    python import_donations.py - --format ndjson < donations.ndjson
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from database import AsyncSessionLocal
+from donation_service import BULK_DONATION_CHUNK_SIZE, aiter_records, donation_service
+from city_ranking_service import city_ranking_service
+
+async def file_lines(f):
+    for line in f:
+        yield line
+
+async def with_default_donor(records, donor_id):
+    async for line, record, error in records:
+        if isinstance(record, dict):
+            record.setdefault("donor_id", donor_id)
+        yield line, record, error
+
+async def run(args):
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    f = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8-sig", newline="")
+
+    print(f"📥 Importing {fmt} donations from {args.path}...")
+    await city_ranking_service.start()
+    started = time.perf_counter()
+    try:
+        records = aiter_records(file_lines(f), fmt)
+        if args.donor_id is not None:
+            records = with_default_donor(records, args.donor_id)
+        async with AsyncSessionLocal() as db:
+            result = await donation_service.import_donations(db, records, chunk_size=args.chunk_size)
+    finally:
+        await city_ranking_service.close()
+        if f is not sys.stdin:
+            f.close()
+    elapsed = time.perf_counter() - started
+
+    print(f"✅ Imported {result.inserted} donations (${result.total_amount:,.2f}) in {elapsed:.1f}s "
+          f"({result.inserted / elapsed * 60 if elapsed else 0:,.0f}/min)")
+    if result.rejected:
+        print(f"⚠️  Rejected {result.rejected} records:")
+        for error in result.errors:
+            print(f"   line {error.line}: {error.error}")
+        if result.rejected > len(result.errors):
+            print(f"   ... and {result.rejected - len(result.errors)} more")
+    return result.rejected == 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="CSV or NDJSON file, or - for stdin")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="input format (default: from the file extension)")
+    parser.add_argument("--donor-id", type=int, help="donor for records without a donor_id")
+    parser.add_argument("--chunk-size", type=int, default=BULK_DONATION_CHUNK_SIZE, help="rows per transaction")
+    sys.exit(0 if asyncio.run(run(parser.parse_args())) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,8 @@ import os
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from models import Base
+from alembic import command
+from alembic.config import Config
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -26,6 +28,18 @@ def init_database():
         # Create all tables
         Base.metadata.create_all(bind=engine)
         
+        # create_all skips tables that already exist; the migrations add the
+        # columns declared since then and backfill them
+        alembic_config = Config(os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini"))
+        alembic_config.set_main_option("sqlalchemy.url", DATABASE_URL)
+        command.upgrade(alembic_config, "head")
+        print("✅ Database migrations applied!")
+        
+        # Likewise add any indexes declared since those tables were created
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+        
         print("✅ Database tables created successfully!")
         
         # Test connection
@@ -0,0 +1,167 @@
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+from pymongo import monitoring
+from sqlalchemy import event
+from metrics import MONGO_COMMAND_LATENCY
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("slow_query")
+
+# Statements and Mongo commands slower than this are written to the slow-query
+# log (0 disables it); SLOW_QUERY_LOG_FILE adds a file handler for that log
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG_FILE = os.getenv("SLOW_QUERY_LOG_FILE")
+# Requests issuing more statements than this are logged as likely N+1 patterns
+QUERY_COUNT_WARNING = int(os.getenv("QUERY_COUNT_WARNING", "25"))
+# Adds a Server-Timing header with the per-request SQL and Mongo totals
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "false").lower() == "true"
+
+if SLOW_QUERY_LOG_FILE:
+    _handler = logging.FileHandler(SLOW_QUERY_LOG_FILE)
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    slow_query_logger.addHandler(_handler)
+    slow_query_logger.setLevel(logging.INFO)
+
+_IN_LIST = re.compile(r"\((?:\s*(?:\?|\$\d+|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|\$\d+|%\(\w+\)s|:\w+)\s*\)")
+_VALUES_ROWS = re.compile(r"(VALUES\s*\([^()]*\))(?:\s*,\s*\([^()]*\))+", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+class RequestStats:
+    """SQL and Mongo work done on behalf of one HTTP request"""
+
+    __slots__ = ("scope", "sql_count", "sql_ms", "mongo_count", "mongo_ms")
+
+    def __init__(self, scope: Optional[Dict[str, Any]] = None):
+        self.scope = scope
+        self.sql_count = 0
+        self.sql_ms = 0.0
+        self.mongo_count = 0
+        self.mongo_ms = 0.0
+
+    @property
+    def endpoint(self) -> str:
+        if self.scope is None:
+            return "background"
+        route = self.scope.get("route")
+        return f"{self.scope['method']} {getattr(route, 'path', self.scope['path'])}"
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+def current_request_stats() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+def statement_shape(statement: str) -> str:
+    """Collapse whitespace, IN lists and multi-row VALUES so similar statements group together"""
+    shape = _WHITESPACE.sub(" ", statement).strip()
+    shape = _IN_LIST.sub("(...)", shape)
+    shape = _VALUES_ROWS.sub(r"\1, ...", shape)
+    return shape[:500]
+
+def command_shape(command: Dict[str, Any]) -> str:
+    """Command name, collection and the field names it filters or groups on"""
+    name = next(iter(command), "?")
+    shape = f"{name} {command.get(name)}"
+    if isinstance(command.get("filter"), dict):
+        shape += f" filter={sorted(command['filter'])}"
+    if isinstance(command.get("pipeline"), list):
+        shape += f" pipeline={[next(iter(stage), '?') for stage in command['pipeline']]}"
+    return shape
+
+def _log_slow(kind: str, elapsed_ms: float, shape: str):
+    if SLOW_QUERY_MS and elapsed_ms >= SLOW_QUERY_MS:
+        stats = _request_stats.get()
+        endpoint = stats.endpoint if stats is not None else "background"
+        slow_query_logger.warning("slow %s %.1fms [%s] %s", kind, elapsed_ms, endpoint, shape)
+
+def instrument_engine(engine):
+    """Count and time every statement sent through a (sync) SQLAlchemy engine"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("query_started", None)
+        if started is None:
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.sql_count += 1
+            stats.sql_ms += elapsed_ms
+        _log_slow("sql", elapsed_ms, statement_shape(statement))
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """pymongo listener that adds command counts and timings to the current request"""
+
+    def __init__(self):
+        self._shapes: Dict[Any, str] = {}
+
+    def started(self, event):
+        if SLOW_QUERY_MS:
+            self._shapes[(event.connection_id, event.request_id)] = command_shape(event.command)
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+    def _finished(self, event):
+        elapsed_ms = event.duration_micros / 1000
+        shape = self._shapes.pop((event.connection_id, event.request_id), event.command_name)
+        MONGO_COMMAND_LATENCY.labels(event.command_name).observe(elapsed_ms / 1000)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.mongo_count += 1
+            stats.mongo_ms += elapsed_ms
+        _log_slow("mongo", elapsed_ms, shape)
+
+class QueryStatsMiddleware:
+    """ASGI middleware that scopes query stats to each request.
+
+    Logs requests whose statement count suggests an N+1 pattern and, with
+    SERVER_TIMING_HEADER, reports the totals in a Server-Timing header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start" and SERVER_TIMING_HEADER:
+                total_ms = (time.perf_counter() - started) * 1000
+                timing = (
+                    f'sql;dur={stats.sql_ms:.1f};desc="{stats.sql_count} queries", '
+                    f'mongo;dur={stats.mongo_ms:.1f};desc="{stats.mongo_count} commands", '
+                    f"app;dur={total_ms:.1f}"
+                )
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", timing.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_stats.reset(token)
+            if stats.sql_count > QUERY_COUNT_WARNING:
+                logger.warning(
+                    "%s issued %d SQL statements (%.1fms); possible N+1 query pattern",
+                    stats.endpoint, stats.sql_count, stats.sql_ms
+                )
+            logger.debug(
+                "%s sql=%d (%.1fms) mongo=%d (%.1fms)",
+                stats.endpoint, stats.sql_count, stats.sql_ms, stats.mongo_count, stats.mongo_ms
+            )
@@ -1,36 +1,99 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from datetime import timedelta
-from typing import List
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from typing import List, Optional
 
-from database import get_db, engine
-from models import Base, User, Campaign, Donation, Category, Transaction, UserProfile
+from database import get_async_db, engine, async_engine, AsyncSessionLocal
+from models import Base, User, Campaign, Donation, Category, UserProfile, DonationGoal, Notification, CampaignUpdate
 from schemas import (
     UserCreate, UserLogin, User as UserSchema, Token,
-    CampaignCreate, Campaign as CampaignSchema,
+    CampaignCreate, Campaign as CampaignSchema, CampaignAnalyticsDay, CampaignCounters,
+    DonationGoalCreate, DonationGoal as DonationGoalSchema,
+    CampaignUpdateCreate, CampaignUpdate as CampaignUpdateSchema,
+    Notification as NotificationSchema, UnreadCount,
     DonationCreate, Donation as DonationSchema,
     CategoryCreate, Category as CategorySchema,
-    CityRankingResponse
+    BulkDonationResult, CityRankingResponse, RankingPeriod, PeriodCityRankingResponse,
+    CityStatistics as CityStatisticsSchema
 )
 from auth import (
     authenticate_user, create_access_token, get_current_active_user,
-    ACCESS_TOKEN_EXPIRE_MINUTES, get_password_hash
+    ACCESS_TOKEN_EXPIRE_MINUTES, get_password_hash_async
 )
+from campaign_analytics_service import campaign_analytics_service
 from city_ranking_service import city_ranking_service
+from city_statistics_service import city_statistics_service
+from donation_service import BULK_DONATION_FORMATS, aiter_lines, aiter_records, donation_service
+from goal_service import goal_service
+from notification_service import notification_service
+from pagination import NEXT_CURSOR_HEADER, keyset_page, next_cursor
+from response_cache import response_cache
+from instrumentation import QueryStatsMiddleware
+from metrics import MetricsMiddleware, monitor_event_loop_lag, register_runtime_collector, render_metrics
+from user_cache import user_cache
+import asyncio
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
 app = FastAPI(title="Donation Platform API", version="1.0.0")
+app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+async def invalidate_city_responses(cities: List[str]):
+    # Called with every city whose totals or rank changed once queued donations
+    # reach MongoDB, so overtaken cities are invalidated too
+    await response_cache.invalidate("global-statistics", *(f"city:{city}" for city in cities))
+
+@app.on_event("startup")
+async def start_city_ranking_writer():
+    city_ranking_service.add_flush_listener(invalidate_city_responses)
+    await city_ranking_service.start()
+
+@app.on_event("shutdown")
+async def flush_city_ranking_writer():
+    await city_ranking_service.close()
+
+@app.on_event("startup")
+async def start_metrics():
+    register_runtime_collector(async_engine, {"response": response_cache, "user": user_cache})
+    app.state.event_loop_monitor = asyncio.create_task(monitor_event_loop_lag())
+
+@app.on_event("shutdown")
+async def stop_metrics():
+    app.state.event_loop_monitor.cancel()
+
+@app.on_event("startup")
+async def start_campaign_analytics():
+    await campaign_analytics_service.start(AsyncSessionLocal)
+
+@app.on_event("startup")
+async def start_notification_fanout():
+    await notification_service.start(AsyncSessionLocal)
+
+@app.on_event("shutdown")
+async def stop_notification_fanout():
+    await notification_service.close()
+
+@app.on_event("shutdown")
+async def flush_campaign_analytics():
+    await campaign_analytics_service.close()
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, headers={"Content-Type": content_type})
 
 # User Registration and Authentication
 @app.post("/register", response_model=UserSchema)
-async def register_user(user: UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     # Check if user already exists
-    db_user = db.query(User).filter(
+    result = await db.execute(select(User).filter(
         (User.username == user.username) | (User.email == user.email)
-    ).first()
+    ))
+    db_user = result.scalars().first()
     if db_user:
         raise HTTPException(
             status_code=400,
@@ -38,7 +101,7 @@ async def register_user(user: UserCreate, db: Session = Depends(get_db)):
         )
     
     # Create new user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     db_user = User(
         username=user.username,
         email=user.email,
@@ -48,19 +111,19 @@ async def register_user(user: UserCreate, db: Session = Depends(get_db)):
         hashed_password=hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     # Create user profile
     user_profile = UserProfile(user_id=db_user.id)
     db.add(user_profile)
-    db.commit()
+    await db.commit()
     
     return db_user
 
 @app.post("/login", response_model=Token)
-async def login_user(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login_user(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -82,7 +145,7 @@ async def read_users_me(current_user: User = Depends(get_current_active_user)):
 async def create_campaign(
     campaign: CampaignCreate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     db_campaign = Campaign(
         title=campaign.title,
@@ -92,89 +155,188 @@ async def create_campaign(
         category_id=campaign.category_id
     )
     db.add(db_campaign)
-    db.commit()
-    db.refresh(db_campaign)
+    await db.commit()
+    await db.refresh(db_campaign)
+    await response_cache.invalidate("campaigns")
     
     # Update user profile
-    user_profile = db.query(UserProfile).filter(UserProfile.user_id == current_user.id).first()
+    result = await db.execute(select(UserProfile).filter(UserProfile.user_id == current_user.id))
+    user_profile = result.scalars().first()
     if user_profile:
         user_profile.total_campaigns += 1
-        db.commit()
+        await db.commit()
     
     return db_campaign
 
 @app.get("/campaigns", response_model=List[CampaignSchema])
-async def get_campaigns(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    campaigns = db.query(Campaign).offset(skip).limit(limit).all()
-    return campaigns
+async def get_campaigns(
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    async def load(headers):
+        # Pass the X-Next-Cursor header back as ?cursor= for constant-cost paging
+        result = await db.execute(keyset_page(select(Campaign), Campaign, cursor, skip, limit))
+        campaigns = result.scalars().all()
+        page_cursor = next_cursor(campaigns, limit)
+        if page_cursor:
+            headers[NEXT_CURSOR_HEADER] = page_cursor
+        return campaigns
+    
+    return await response_cache.cached(request, ["campaigns"], load, List[CampaignSchema])
 
 @app.get("/campaigns/{campaign_id}", response_model=CampaignSchema)
-async def get_campaign(campaign_id: int, db: Session = Depends(get_db)):
-    campaign = db.query(Campaign).filter(Campaign.id == campaign_id).first()
+async def get_campaign(request: Request, campaign_id: int, db: AsyncSession = Depends(get_async_db)):
+    async def load(headers):
+        campaign = await db.get(Campaign, campaign_id)
+        if not campaign:
+            raise HTTPException(status_code=404, detail="Campaign not found")
+        return campaign
+    
+    response = await response_cache.cached(request, [f"campaign:{campaign_id}"], load, CampaignSchema)
+    # Counted outside the cache so hits and 304s count too; buffered, not a write per view
+    campaign_analytics_service.record_view(campaign_id)
+    return response
+
+@app.post("/campaigns/{campaign_id}/share", status_code=status.HTTP_204_NO_CONTENT)
+async def share_campaign(campaign_id: int, db: AsyncSession = Depends(get_async_db)):
+    if not await db.get(Campaign, campaign_id):
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    campaign_analytics_service.record_share(campaign_id)
+
+@app.get("/campaigns/{campaign_id}/counters", response_model=CampaignCounters)
+async def get_campaign_counters(campaign_id: int, db: AsyncSession = Depends(get_async_db)):
+    # Approximate: other workers' unflushed counts show up after their next flush
+    if not await db.get(Campaign, campaign_id):
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    counts = await campaign_analytics_service.get_live_counts(db, campaign_id)
+    return CampaignCounters(campaign_id=campaign_id, **counts)
+
+@app.get("/campaigns/{campaign_id}/analytics", response_model=List[CampaignAnalyticsDay])
+async def get_campaign_analytics(
+    campaign_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Daily rows from the campaign_analytics rollup; never scans donations
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(days=29)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if not await db.get(Campaign, campaign_id):
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return await campaign_analytics_service.get_series(db, campaign_id, start, end)
+
+@app.post("/campaigns/{campaign_id}/goals", response_model=DonationGoalSchema)
+async def create_donation_goal(
+    campaign_id: int,
+    goal: DonationGoalCreate,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    campaign = await db.get(Campaign, campaign_id)
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    if campaign.creator_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Only the campaign creator can add goals")
+    # Marked achieved straight away if the campaign is already past it
+    return await goal_service.create_goal(db, DonationGoal(
+        campaign_id=campaign_id,
+        goal_amount=goal.goal_amount,
+        goal_type=goal.goal_type.value,
+        description=goal.description
+    ))
+
+@app.get("/campaigns/{campaign_id}/goals", response_model=List[DonationGoalSchema])
+async def get_donation_goals(campaign_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await goal_service.get_goals(db, campaign_id)
+
+@app.post("/campaigns/{campaign_id}/updates", response_model=CampaignUpdateSchema)
+async def create_campaign_update(
+    campaign_id: int,
+    campaign_update: CampaignUpdateCreate,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    campaign = await db.get(Campaign, campaign_id)
     if not campaign:
         raise HTTPException(status_code=404, detail="Campaign not found")
-    return campaign
+    if campaign.creator_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Only the campaign creator can post updates")
+    # Donors are notified by the background fan-out worker, not in this request
+    return await notification_service.post_update(db, CampaignUpdate(
+        campaign_id=campaign_id, title=campaign_update.title, content=campaign_update.content
+    ))
+
+@app.get("/campaigns/{campaign_id}/updates", response_model=List[CampaignUpdateSchema])
+async def get_campaign_updates(campaign_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(
+        select(CampaignUpdate).filter(CampaignUpdate.campaign_id == campaign_id).order_by(CampaignUpdate.created_at.desc())
+    )
+    return result.scalars().all()
 
 # Donation Management
 @app.post("/donations", response_model=DonationSchema)
 async def create_donation(
     donation: DonationCreate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    # Verify campaign exists
-    campaign = db.query(Campaign).filter(Campaign.id == donation.campaign_id).first()
-    if not campaign:
+    # Record the donation, its transaction and the campaign/profile totals
+    # atomically (a single statement on PostgreSQL)
+    db_donation = await donation_service.create_donation(db, current_user.id, donation)
+    if db_donation is None:
         raise HTTPException(status_code=404, detail="Campaign not found")
+    await response_cache.invalidate("campaigns", f"campaign:{donation.campaign_id}")
     
-    # Create donation
-    db_donation = Donation(
-        amount=donation.amount,
-        donor_id=current_user.id,
-        campaign_id=donation.campaign_id,
-        message=donation.message,
-        is_anonymous=donation.is_anonymous
-    )
-    db.add(db_donation)
-    db.flush()  # Flush to get the donation ID without committing
-    
-    # Update campaign amount
-    campaign.current_amount += donation.amount
-    
-    # Create transaction record
-    transaction = Transaction(
-        donation_id=db_donation.id,
-        transaction_type="donation",
-        amount=donation.amount,
-        status="completed",
-        payment_method="online",
-        transaction_id=f"TXN_{db_donation.id}_{current_user.id}"
-    )
-    db.add(transaction)
-    
-    # Update user profile
-    user_profile = db.query(UserProfile).filter(UserProfile.user_id == current_user.id).first()
-    if user_profile:
-        user_profile.total_donated += donation.amount
-    
-    db.commit()
-    db.refresh(db_donation)
-    
-    # Update city ranking in MongoDB
+    # Queue the city ranking update; it is written to MongoDB in the background
     await city_ranking_service.update_city_ranking(
         current_user.city, donation.amount, current_user.id
     )
     
     return db_donation
 
+@app.post("/donations/bulk", response_model=BulkDonationResult)
+async def create_donations_bulk(
+    request: Request,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # The body is streamed as NDJSON or CSV (with a header row) and written in chunks
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    fmt = BULK_DONATION_FORMATS.get(content_type)
+    if fmt is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Content-Type must be one of: {', '.join(BULK_DONATION_FORMATS)}"
+        )
+    
+    result = await donation_service.import_donations(
+        db, aiter_records(aiter_lines(request.stream()), fmt), donor_id=current_user.id
+    )
+    if result.campaign_ids:
+        await response_cache.invalidate("campaigns", *(f"campaign:{campaign_id}" for campaign_id in result.campaign_ids))
+    return result
+
 @app.get("/donations", response_model=List[DonationSchema])
 async def get_donations(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    donations = db.query(Donation).filter(Donation.donor_id == current_user.id).offset(skip).limit(limit).all()
+    result = await db.execute(keyset_page(
+        select(Donation).filter(Donation.donor_id == current_user.id), Donation, cursor, skip, limit
+    ))
+    donations = result.scalars().all()
+    cursor = next_cursor(donations, limit)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
     return donations
 
 # City Rankings
@@ -189,42 +351,68 @@ async def get_city_rankings(current_user: User = Depends(get_current_active_user
         user_city_rank=city_context["user_city_rank"]
     )
 
+@app.get("/city-rankings/periods/{period}", response_model=PeriodCityRankingResponse)
+async def get_period_city_rankings(
+    period: RankingPeriod,
+    current_user: User = Depends(get_current_active_user)
+):
+    return await city_ranking_service.get_period_rankings(period.value, current_user.city, 3, 3)
+
 @app.get("/city-rankings/{city}")
-async def get_city_statistics(city: str):
-    stats = await city_ranking_service.get_city_statistics(city)
+async def get_city_statistics(request: Request, city: str):
+    async def load(headers):
+        stats = await city_ranking_service.get_city_statistics(city)
+        if not stats:
+            raise HTTPException(status_code=404, detail="City not found")
+        return stats
+    
+    return await response_cache.cached(request, [f"city:{city}"], load)
+
+@app.get("/global-statistics")
+async def get_global_statistics(request: Request):
+    async def load(headers):
+        return await city_ranking_service.get_global_statistics()
+    
+    return await response_cache.cached(request, ["global-statistics"], load)
+
+@app.get("/city-statistics/{city}", response_model=CityStatisticsSchema)
+async def get_city_sql_statistics(city: str, db: AsyncSession = Depends(get_async_db)):
+    # Maintained incrementally by the donation write path; a single-row read
+    stats = await city_statistics_service.get(db, city)
     if not stats:
         raise HTTPException(status_code=404, detail="City not found")
     return stats
 
-@app.get("/global-statistics")
-async def get_global_statistics():
-    return await city_ranking_service.get_global_statistics()
-
 # Category Management
 @app.post("/categories", response_model=CategorySchema)
 async def create_category(
     category: CategoryCreate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     db_category = Category(name=category.name, description=category.description)
     db.add(db_category)
-    db.commit()
-    db.refresh(db_category)
+    await db.commit()
+    await db.refresh(db_category)
+    await response_cache.invalidate("categories")
     return db_category
 
 @app.get("/categories", response_model=List[CategorySchema])
-async def get_categories(db: Session = Depends(get_db)):
-    categories = db.query(Category).all()
-    return categories
+async def get_categories(request: Request, db: AsyncSession = Depends(get_async_db)):
+    async def load(headers):
+        result = await db.execute(select(Category))
+        return result.scalars().all()
+    
+    return await response_cache.cached(request, ["categories"], load, List[CategorySchema])
 
 # User Profile Management
 @app.get("/profile")
 async def get_user_profile(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    profile = db.query(UserProfile).filter(UserProfile.user_id == current_user.id).first()
+    result = await db.execute(select(UserProfile).filter(UserProfile.user_id == current_user.id))
+    profile = result.scalars().first()
     if not profile:
         raise HTTPException(status_code=404, detail="Profile not found")
     
@@ -238,9 +426,10 @@ async def update_user_profile(
     bio: str = None,
     profile_picture: str = None,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    profile = db.query(UserProfile).filter(UserProfile.user_id == current_user.id).first()
+    result = await db.execute(select(UserProfile).filter(UserProfile.user_id == current_user.id))
+    profile = result.scalars().first()
     if not profile:
         raise HTTPException(status_code=404, detail="Profile not found")
     
@@ -249,9 +438,51 @@ async def update_user_profile(
     if profile_picture is not None:
         profile.profile_picture = profile_picture
     
-    db.commit()
+    await db.commit()
     return profile
 
+# Notifications
+@app.get("/notifications", response_model=List[NotificationSchema])
+async def get_notifications(
+    response: Response,
+    skip: int = 0,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    result = await db.execute(keyset_page(
+        select(Notification).filter(Notification.user_id == current_user.id), Notification, cursor, skip, limit
+    ))
+    notifications = result.scalars().all()
+    cursor = next_cursor(notifications, limit)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
+    return notifications
+
+@app.get("/notifications/unread-count", response_model=UnreadCount)
+async def get_unread_notification_count(
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Reads the counter kept on the profile; never counts notification rows
+    return UnreadCount(unread=await notification_service.get_unread_count(db, current_user.id))
+
+@app.post("/notifications/{notification_id}/read", response_model=UnreadCount)
+async def mark_notification_read(
+    notification_id: int,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    return UnreadCount(unread=await notification_service.mark_read(db, current_user.id, [notification_id]))
+
+@app.post("/notifications/read-all", response_model=UnreadCount)
+async def mark_all_notifications_read(
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    return UnreadCount(unread=await notification_service.mark_read(db, current_user.id))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,117 @@
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import os
+import time
+
+# How often the event loop lag probe wakes up
+EVENT_LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("EVENT_LOOP_LAG_INTERVAL_SECONDS", "0.5"))
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ["method", "route", "status"]
+)
+MONGO_COMMAND_LATENCY = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency by command", ["command"]
+)
+CITY_RANKING_RECALCULATION = Histogram(
+    "city_ranking_recalculation_seconds", "Time to rebuild the city rank index from MongoDB"
+)
+CITY_RANKING_FLUSH = Histogram(
+    "city_ranking_flush_seconds", "Time to write one batch of queued city ranking updates"
+)
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "How late the event loop lag probe woke up",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+EVENT_LOOP_LAG_LAST = Gauge("event_loop_lag_last_seconds", "Most recent event loop lag sample")
+
+def render_metrics():
+    """Metrics in the Prometheus text format, with its content type"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency per route template"""
+
+    def __init__(self, app):
+        self.app = app
+        # labels() takes a lock and hashes the label values; reuse the children
+        self._histograms: Dict[Tuple[str, str, int], Any] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Unmatched paths share one label so 404 scans cannot blow up cardinality
+            key = (scope["method"], getattr(scope.get("route"), "path", "unmatched"), status)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = REQUEST_LATENCY.labels(key[0], key[1], str(status))
+            histogram.observe(time.perf_counter() - started)
+
+class RuntimeCollector:
+    """Reads pool and cache state at scrape time, so it costs nothing per request"""
+
+    def __init__(self, engine, caches):
+        self.engine = engine
+        self.caches = caches
+
+    def collect(self):
+        pool = self.engine.pool
+        if hasattr(pool, "checkedout"):
+            checked_out = GaugeMetricFamily("db_pool_checked_out", "Connections in use")
+            checked_out.add_metric([], pool.checkedout())
+            yield checked_out
+            idle = GaugeMetricFamily("db_pool_checked_in", "Idle connections in the pool")
+            idle.add_metric([], pool.checkedin())
+            yield idle
+            size = GaugeMetricFamily("db_pool_size", "Configured pool size")
+            size.add_metric([], pool.size())
+            yield size
+            overflow = GaugeMetricFamily("db_pool_overflow", "Connections opened beyond the pool size")
+            overflow.add_metric([], max(pool.overflow(), 0))
+            yield overflow
+
+        hits = CounterMetricFamily("cache_hits", "Cache hits", labels=["cache"])
+        misses = CounterMetricFamily("cache_misses", "Cache misses", labels=["cache"])
+        ratio = GaugeMetricFamily("cache_hit_ratio", "Cache hit ratio since start", labels=["cache"])
+        for name, cache in self.caches.items():
+            stats = cache.stats()
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+            ratio.add_metric([name], stats["hit_ratio"])
+        yield hits
+        yield misses
+        yield ratio
+
+_runtime_collector: Optional[RuntimeCollector] = None
+
+def register_runtime_collector(engine, caches):
+    """Expose DB pool usage for ``engine`` and hit rates for ``caches`` (name -> object with stats())"""
+    global _runtime_collector
+    if _runtime_collector is None:
+        _runtime_collector = RuntimeCollector(engine, caches)
+        REGISTRY.register(_runtime_collector)
+
+async def monitor_event_loop_lag(interval: float = EVENT_LOOP_LAG_INTERVAL_SECONDS):
+    """Sleep in a loop and record how much later than requested each wake-up was"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - started - interval, 0.0)
+        EVENT_LOOP_LAG.observe(lag)
+        EVENT_LOOP_LAG_LAST.set(lag)
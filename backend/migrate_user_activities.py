@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Migrate User Activities
+Moves the user_activities collection to the storage type selected by
+USER_ACTIVITY_STORAGE ("collection" or "timeseries"). MongoDB cannot convert
+a collection between the two in place, so the activities still inside
+USER_ACTIVITY_RETENTION_DAYS are copied into a new collection and the old
+one (with its TTL index) is dropped. Stop the API first; rerunning after an
+interruption starts the copy over.
+
+Usage:
+    USER_ACTIVITY_STORAGE=timeseries python migrate_user_activities.py
+"""
+
+import argparse
+import asyncio
+import time
+
+from city_ranking_service import USER_ACTIVITY_STORAGE, city_ranking_service
+
+async def main():
+    parser = argparse.ArgumentParser(description="Move user_activities to the USER_ACTIVITY_STORAGE type")
+    parser.add_argument("--batch-size", type=int, default=10000, help="activities copied per insert")
+    args = parser.parse_args()
+    
+    print(f"🔄 Migrating user activities to {USER_ACTIVITY_STORAGE} storage...")
+    started = time.perf_counter()
+    copied = await city_ranking_service.migrate_activity_storage(batch_size=args.batch_size)
+    print(f"✅ Copied {copied} activities in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+"""Unread notification counters and campaign update fan-out progress
+
+Adds user_profiles.unread_notifications, filled from the notifications
+already unread, and campaign_updates.notified_donor_id / notified_at.
+Updates posted before this migration are marked as notified, so the
+fan-out worker does not deliver them again at startup.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 00:00:00
+"""
+
+from alembic import context, op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+user_profiles = sa.table("user_profiles", sa.column("user_id", sa.Integer), sa.column("unread_notifications", sa.Integer))
+notifications = sa.table("notifications", sa.column("user_id", sa.Integer), sa.column("is_read", sa.Boolean))
+campaign_updates = sa.table(
+    "campaign_updates", sa.column("created_at", sa.DateTime), sa.column("notified_at", sa.DateTime)
+)
+
+def _columns(table):
+    """Existing column names; tables made by init_db.py's create_all may already have them"""
+    if context.is_offline_mode():
+        return set()
+    return {column["name"] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+def upgrade():
+    if "unread_notifications" not in _columns("user_profiles"):
+        with op.batch_alter_table("user_profiles") as batch:
+            batch.add_column(sa.Column("unread_notifications", sa.Integer(), server_default="0"))
+        unread = (
+            sa.select(sa.func.count())
+            .select_from(notifications)
+            .where(notifications.c.user_id == user_profiles.c.user_id, notifications.c.is_read == sa.false())
+            .scalar_subquery()
+        )
+        op.execute(user_profiles.update().values(unread_notifications=unread))
+
+    existing = _columns("campaign_updates")
+    if "notified_donor_id" not in existing or "notified_at" not in existing:
+        with op.batch_alter_table("campaign_updates") as batch:
+            if "notified_donor_id" not in existing:
+                batch.add_column(sa.Column("notified_donor_id", sa.Integer(), server_default="0"))
+            if "notified_at" not in existing:
+                batch.add_column(sa.Column("notified_at", sa.DateTime()))
+        # Updates posted before fan-out existed were never meant to notify donors
+        op.execute(
+            campaign_updates.update()
+            .where(campaign_updates.c.notified_at.is_(None))
+            .values(notified_at=sa.func.coalesce(campaign_updates.c.created_at, sa.func.current_timestamp()))
+        )
+
+def downgrade():
+    with op.batch_alter_table("campaign_updates") as batch:
+        batch.drop_column("notified_at")
+        batch.drop_column("notified_donor_id")
+    with op.batch_alter_table("user_profiles") as batch:
+        batch.drop_column("unread_notifications")
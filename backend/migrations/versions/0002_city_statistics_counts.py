@@ -0,0 +1,45 @@
+"""City statistics donation count and first donation time
+
+Adds city_statistics.donation_count and first_donation_at, which the
+donation path's upsert now maintains, and fills them (and the other totals)
+with the same set-based rebuild as rebuild_city_statistics.py.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:01
+"""
+
+from datetime import datetime
+
+from alembic import context, op
+import sqlalchemy as sa
+
+from city_statistics_service import city_statistics_service
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+def _columns(table):
+    """Existing column names; tables made by init_db.py's create_all may already have them"""
+    if context.is_offline_mode():
+        return set()
+    return {column["name"] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+def upgrade():
+    existing = _columns("city_statistics")
+    if "donation_count" in existing and "first_donation_at" in existing:
+        return
+    with op.batch_alter_table("city_statistics") as batch:
+        if "donation_count" not in existing:
+            batch.add_column(sa.Column("donation_count", sa.Integer(), server_default="0"))
+        if "first_donation_at" not in existing:
+            batch.add_column(sa.Column("first_donation_at", sa.DateTime()))
+    for stmt in city_statistics_service.rebuild_statements(context.get_context().dialect.name, datetime.utcnow()):
+        op.execute(stmt)
+
+def downgrade():
+    with op.batch_alter_table("city_statistics") as batch:
+        batch.drop_column("first_donation_at")
+        batch.drop_column("donation_count")
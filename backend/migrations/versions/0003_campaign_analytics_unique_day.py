@@ -0,0 +1,84 @@
+"""One campaign_analytics row per campaign and day
+
+The rollup and the view/share counter flush upsert on (campaign_id, date),
+which needs a unique constraint that older tables do not have. Existing
+rows are first moved to midnight of their day (the form the rollup writes)
+and duplicates are merged into the lowest id: views and shares are added up,
+the donation figures are recomputed by the next rollup anyway.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:02
+"""
+
+from alembic import context, op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+CONSTRAINT = "uq_campaign_analytics_campaign_id_date"
+
+analytics = sa.table(
+    "campaign_analytics",
+    sa.column("id", sa.Integer),
+    sa.column("campaign_id", sa.Integer),
+    sa.column("date", sa.DateTime),
+    sa.column("views", sa.Integer),
+    sa.column("shares", sa.Integer),
+    sa.column("unique_donors", sa.Integer),
+    sa.column("total_donations", sa.Float)
+)
+
+def _has_constraint():
+    if context.is_offline_mode():
+        return False
+    constraints = sa.inspect(op.get_bind()).get_unique_constraints("campaign_analytics")
+    return any(constraint["name"] == CONSTRAINT for constraint in constraints)
+
+def _day(column):
+    """Midnight of a timestamp, in the form CampaignAnalyticsService._day writes"""
+    if context.get_context().dialect.name == "postgresql":
+        return sa.func.date_trunc("day", column)
+    return sa.func.strftime("%Y-%m-%d 00:00:00.000000", column)
+
+def upgrade():
+    if _has_constraint():
+        return
+    op.execute(
+        analytics.update()
+        .where(analytics.c.date.isnot(None), analytics.c.date != _day(analytics.c.date))
+        .values(date=_day(analytics.c.date))
+    )
+
+    # Fold every (campaign_id, date) group into its lowest id, then drop the rest
+    other = analytics.alias("other")
+    same_day = sa.and_(other.c.campaign_id == analytics.c.campaign_id, other.c.date == analytics.c.date)
+    keepers = (
+        sa.select(sa.func.min(analytics.c.id))
+        .group_by(analytics.c.campaign_id, analytics.c.date)
+        .having(sa.func.count() > 1)
+    )
+    op.execute(
+        analytics.update()
+        .where(analytics.c.id.in_(keepers))
+        .values(
+            views=sa.select(sa.func.sum(sa.func.coalesce(other.c.views, 0))).where(same_day).scalar_subquery(),
+            shares=sa.select(sa.func.sum(sa.func.coalesce(other.c.shares, 0))).where(same_day).scalar_subquery(),
+            unique_donors=sa.select(sa.func.max(other.c.unique_donors)).where(same_day).scalar_subquery(),
+            total_donations=sa.select(sa.func.max(other.c.total_donations)).where(same_day).scalar_subquery()
+        )
+    )
+    first_ids = sa.select(sa.func.min(analytics.c.id)).group_by(analytics.c.campaign_id, analytics.c.date)
+    op.execute(
+        analytics.delete().where(analytics.c.date.isnot(None), analytics.c.id.notin_(first_ids))
+    )
+
+    with op.batch_alter_table("campaign_analytics") as batch:
+        batch.create_unique_constraint(CONSTRAINT, ["campaign_id", "date"])
+
+def downgrade():
+    with op.batch_alter_table("campaign_analytics") as batch:
+        batch.drop_constraint(CONSTRAINT, type_="unique")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean, UniqueConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -41,6 +41,17 @@ class Campaign(Base):
     creator = relationship("User", back_populates="campaigns")
     donations = relationship("Donation", back_populates="campaign")
     category = relationship("Category", back_populates="campaigns")
+    
+    __table_args__ = (
+        # Keyset pagination over (created_at, id)
+        Index("ix_campaigns_created_at_id", created_at, id),
+        # Listing active campaigns; other statuses are rarely queried
+        Index(
+            "ix_campaigns_active_created_at", created_at.desc(), id.desc(),
+            postgresql_where=(status == "active"),
+            sqlite_where=(status == "active")
+        ),
+    )
 
 class Donation(Base):
     __tablename__ = "donations"
@@ -56,6 +67,17 @@ class Donation(Base):
     # Relationships
     donor = relationship("User", back_populates="donations")
     campaign = relationship("Campaign", back_populates="donations")
+    
+    __table_args__ = (
+        # A donor's donations, newest first (also serves keyset pagination)
+        Index("ix_donations_donor_id_created_at_id", donor_id, created_at.desc(), id.desc()),
+        # A campaign's donations in time order
+        Index("ix_donations_campaign_id_created_at", campaign_id, created_at),
+        # A campaign's distinct donors in id order (notification fan-out)
+        Index("ix_donations_campaign_id_donor_id", campaign_id, donor_id),
+        # One day of donations (campaign analytics rollup)
+        Index("ix_donations_created_at", created_at),
+    )
 
 class Category(Base):
     __tablename__ = "categories"
@@ -83,6 +105,8 @@ class Transaction(Base):
     
     # Relationships
     donation = relationship("Donation")
+    
+    __table_args__ = (Index("ix_transactions_donation_id", donation_id),)
 
 class UserProfile(Base):
     __tablename__ = "user_profiles"
@@ -95,6 +119,7 @@ class UserProfile(Base):
     total_donated = Column(Float, default=0.0)
     total_campaigns = Column(Integer, default=0)
     verification_status = Column(String(20), default="unverified")
+    unread_notifications = Column(Integer, default=0)  # Kept in step with notifications for the navbar badge
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -114,6 +139,17 @@ class Notification(Base):
     
     # Relationships
     user = relationship("User")
+    
+    __table_args__ = (
+        # Unread notifications per user (navbar badge, inbox)
+        Index(
+            "ix_notifications_user_id_unread", user_id, created_at.desc(),
+            postgresql_where=(is_read == False),
+            sqlite_where=(is_read == False)
+        ),
+        # A user's inbox, newest first (also serves keyset pagination)
+        Index("ix_notifications_user_id_created_at_id", user_id, created_at.desc(), id.desc()),
+    )
 
 class CampaignUpdate(Base):
     __tablename__ = "campaign_updates"
@@ -123,9 +159,17 @@ class CampaignUpdate(Base):
     title = Column(String(200), nullable=False)
     content = Column(Text, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Notification fan-out progress: last donor notified, and when it finished
+    notified_donor_id = Column(Integer, default=0)
+    notified_at = Column(DateTime)
     
     # Relationships
     campaign = relationship("Campaign")
+    
+    __table_args__ = (
+        # A campaign's updates, newest first
+        Index("ix_campaign_updates_campaign_id_created_at", campaign_id, created_at.desc()),
+    )
 
 class DonationGoal(Base):
     __tablename__ = "donation_goals"
@@ -140,6 +184,15 @@ class DonationGoal(Base):
     
     # Relationships
     campaign = relationship("Campaign")
+    
+    __table_args__ = (
+        # Unreached goals per campaign in threshold order (milestone detection)
+        Index(
+            "ix_donation_goals_campaign_id_unreached", campaign_id, goal_amount,
+            postgresql_where=(achieved_at == None),
+            sqlite_where=(achieved_at == None)
+        ),
+    )
 
 class UserBadge(Base):
     __tablename__ = "user_badges"
@@ -167,6 +220,9 @@ class CampaignAnalytics(Base):
     
     # Relationships
     campaign = relationship("Campaign")
+    
+    # One row per campaign per day (date is midnight UTC); also serves time-series reads
+    __table_args__ = (UniqueConstraint("campaign_id", "date", name="uq_campaign_analytics_campaign_id_date"),)
 
 class PaymentMethod(Base):
     __tablename__ = "payment_methods"
@@ -206,7 +262,16 @@ class CityStatistics(Base):
     total_donors = Column(Integer, default=0)
     average_donation = Column(Float, default=0.0)
     donation_frequency = Column(Float, default=0.0)  # donations per month
+    donation_count = Column(Integer, default=0)
+    first_donation_at = Column(DateTime)
     last_updated = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     __table_args__ = (UniqueConstraint('city'),)
+
+class RollupWatermark(Base):
+    __tablename__ = "rollup_watermarks"
+    
+    name = Column(String(50), primary_key=True)
+    watermark = Column(DateTime, nullable=False)  # first day still to be (re)rolled up
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,207 @@
+from collections import Counter
+from sqlalchemy import bindparam, func, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Campaign, CampaignUpdate, Donation, Notification, UserProfile
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Campaign update fan-out writes and commits this many recipients at a time
+NOTIFICATION_FANOUT_CHUNK_SIZE = int(os.getenv("NOTIFICATION_FANOUT_CHUNK_SIZE", "5000"))
+
+class NotificationService:
+    """Notification delivery with an unread counter kept on each user profile.
+
+    Every write that adds or reads notifications adjusts
+    ``user_profiles.unread_notifications`` in the same transaction, so the
+    navbar badge is a single-row read instead of a COUNT(*).
+
+    Campaign updates are fanned out to the campaign's donors by a background
+    worker. Each chunk is one INSERT ... SELECT over the distinct donors plus
+    one counter UPDATE, committed together with the update's progress, so an
+    interrupted fan-out resumes after the last donor notified without
+    duplicates (also across workers).
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._session_factory = None
+
+    @staticmethod
+    async def _add_unread(db: AsyncSession, counts: Dict[int, int]):
+        """Add to each user's unread counter with a single executemany UPDATE"""
+        table = UserProfile.__table__
+        await db.execute(
+            update(table)
+            .where(table.c.user_id == bindparam("b_user_id"))
+            .values(unread_notifications=func.coalesce(table.c.unread_notifications, 0) + bindparam("b_count")),
+            # Sorted so concurrent writers lock profiles in the same order
+            [{"b_user_id": user_id, "b_count": count} for user_id, count in sorted(counts.items())]
+        )
+
+    async def notify(self, db: AsyncSession, notifications: List[Dict[str, Any]]):
+        """Insert notification rows and bump their recipients' unread counts; the caller commits"""
+        if not notifications:
+            return
+        await db.execute(insert(Notification), notifications)
+        await self._add_unread(db, Counter(notification["user_id"] for notification in notifications))
+
+    async def post_update(self, db: AsyncSession, campaign_update: CampaignUpdate) -> CampaignUpdate:
+        """Save a campaign update and queue its fan-out; returns without waiting for delivery"""
+        db.add(campaign_update)
+        await db.commit()
+        await db.refresh(campaign_update)
+        if self._queue is not None:
+            self._queue.put_nowait(campaign_update.id)
+        return campaign_update
+
+    async def fan_out(self, db: AsyncSession, update_id: int, chunk_size: int = NOTIFICATION_FANOUT_CHUNK_SIZE) -> int:
+        """Notify every donor of the update's campaign in chunks; returns the notifications written"""
+        row = (await db.execute(
+            select(CampaignUpdate.campaign_id, CampaignUpdate.title, CampaignUpdate.notified_donor_id,
+                   CampaignUpdate.notified_at, Campaign.title, Campaign.creator_id)
+            .join(Campaign, Campaign.id == CampaignUpdate.campaign_id)
+            .where(CampaignUpdate.id == update_id)
+        )).first()
+        if row is None or row.notified_at is not None:
+            return 0
+        campaign_id, update_title, after, _, campaign_title, creator_id = row
+        after = after or 0
+
+        written = 0
+        while True:
+            # The donors of this chunk are the next chunk_size distinct ids after the watermark
+            donors = (
+                select(Donation.donor_id)
+                .where(Donation.campaign_id == campaign_id, Donation.donor_id > after, Donation.donor_id != creator_id)
+                .distinct()
+                .order_by(Donation.donor_id)
+                .limit(chunk_size)
+                .subquery()
+            )
+            last, count = (await db.execute(select(func.max(donors.c.donor_id), func.count()).select_from(donors))).one()
+            if not count:
+                break
+
+            # Claim the chunk first: a worker that lost the race sees no row and re-reads the watermark
+            claimed = await db.execute(
+                update(CampaignUpdate)
+                .where(CampaignUpdate.id == update_id, CampaignUpdate.notified_donor_id == after)
+                .values(notified_donor_id=last)
+            )
+            if claimed.rowcount == 0:
+                await db.rollback()
+                after = (await db.execute(
+                    select(CampaignUpdate.notified_donor_id).where(CampaignUpdate.id == update_id)
+                )).scalar()
+                continue
+
+            recipients = (
+                select(Donation.donor_id)
+                .where(
+                    Donation.campaign_id == campaign_id,
+                    Donation.donor_id > after,
+                    Donation.donor_id <= last,
+                    Donation.donor_id != creator_id
+                )
+                .distinct()
+            )
+            now = datetime.utcnow()
+            await db.execute(insert(Notification).from_select(
+                ["user_id", "title", "message", "notification_type", "is_read", "created_at"],
+                select(
+                    recipients.subquery().c.donor_id,
+                    literal(f"{campaign_title}: {update_title}"),
+                    literal(f"\"{campaign_title}\" posted an update: {update_title}"),
+                    literal("campaign"),
+                    literal(False),
+                    literal(now)
+                )
+            ))
+            await db.execute(
+                update(UserProfile)
+                .where(UserProfile.user_id.in_(recipients))
+                .values(unread_notifications=func.coalesce(UserProfile.unread_notifications, 0) + 1)
+            )
+            await db.commit()
+            written += count
+            after = last
+            if count < chunk_size:
+                break
+
+        await db.execute(
+            update(CampaignUpdate)
+            .where(CampaignUpdate.id == update_id, CampaignUpdate.notified_at.is_(None))
+            .values(notified_at=datetime.utcnow())
+        )
+        await db.commit()
+        return written
+
+    async def get_unread_count(self, db: AsyncSession, user_id: int) -> int:
+        result = await db.execute(select(UserProfile.unread_notifications).where(UserProfile.user_id == user_id))
+        return result.scalar() or 0
+
+    async def mark_read(self, db: AsyncSession, user_id: int, notification_ids: Optional[Iterable[int]] = None) -> int:
+        """Mark some (or all) of a user's notifications read; returns the new unread count"""
+        stmt = update(Notification).where(Notification.user_id == user_id, Notification.is_read == False)
+        if notification_ids is not None:
+            stmt = stmt.where(Notification.id.in_(list(notification_ids)))
+        marked = (await db.execute(stmt.values(is_read=True))).rowcount
+        if marked:
+            await self._add_unread(db, {user_id: -marked})
+        await db.commit()
+        return await self.get_unread_count(db, user_id)
+
+    async def rebuild_unread_counts(self, db: AsyncSession):
+        """Recompute every unread counter from the notifications table in one statement"""
+        unread = (
+            select(func.count(Notification.id))
+            .where(Notification.user_id == UserProfile.user_id, Notification.is_read == False)
+            .scalar_subquery()
+        )
+        await db.execute(update(UserProfile).values(unread_notifications=unread))
+        await db.commit()
+
+    async def start(self, session_factory):
+        """Start the fan-out worker and requeue fan-outs a restart interrupted"""
+        self._session_factory = session_factory
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue()
+        async with session_factory() as db:
+            pending = (await db.execute(
+                select(CampaignUpdate.id).where(CampaignUpdate.notified_at.is_(None)).order_by(CampaignUpdate.id)
+            )).scalars().all()
+        for update_id in pending:
+            self._queue.put_nowait(update_id)
+        self._worker = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the worker; unfinished fan-outs resume from their progress on the next start"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+            self._queue = None
+
+    async def _run(self):
+        while True:
+            update_id = await self._queue.get()
+            try:
+                async with self._session_factory() as db:
+                    await self.fan_out(db, update_id)
+            except Exception:
+                logger.exception("Notification fan-out for campaign update %s failed", update_id)
+            finally:
+                self._queue.task_done()
+
+# Global instance
+notification_service = NotificationService()
@@ -0,0 +1,43 @@
+import base64
+from datetime import datetime
+from typing import Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+# Keyset (cursor) pagination over (created_at, id), newest first.
+# Cursors are opaque to clients: urlsafe base64 of "<created_at iso>|<id>".
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# Ids are INTEGER columns; a larger value fails in the driver, not with a 400
+MAX_CURSOR_ID = 2**31 - 1
+
+def encode_cursor(created_at: datetime, id: int) -> str:
+    raw = f"{created_at.isoformat()}|{id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, id = base64.urlsafe_b64decode(padded).decode().split("|")
+        created_at, id = datetime.fromisoformat(created_at), int(id)
+        # Timestamps are stored naive (UTC); an offset can only come from a tampered cursor
+        if created_at.tzinfo is not None or not 0 < id <= MAX_CURSOR_ID:
+            raise ValueError(cursor)
+        return created_at, id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_page(query, model, cursor: Optional[str], skip: int, limit: int):
+    """Order a select newest-first and page it by cursor, falling back to offset"""
+    query = query.order_by(model.created_at.desc(), model.id.desc())
+    if cursor:
+        query = query.filter(tuple_(model.created_at, model.id) < decode_cursor(cursor))
+    elif skip:
+        query = query.offset(skip)
+    return query.limit(limit)
+
+def next_cursor(rows, limit: int) -> Optional[str]:
+    """Cursor for the page after rows, or None if this was the last page"""
+    if not rows or len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(last.created_at, last.id)
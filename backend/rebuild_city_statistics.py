@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Rebuild City Statistics
+Recomputes every city_statistics row from donations and processed refunds in
+one set-based pass. The donation write path keeps the table current; run
+this after bulk loads or to repair drift.
+
+Usage:
+    python rebuild_city_statistics.py
+"""
+
+import asyncio
+import time
+
+from database import AsyncSessionLocal
+from city_statistics_service import city_statistics_service
+
+async def main():
+    print("🔄 Rebuilding city statistics...")
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        await city_statistics_service.rebuild(db)
+    print(f"✅ City statistics rebuilt in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,156 @@
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+import hashlib
+import json
+import os
+import time
+
+# Response cache settings. RESPONSE_CACHE_BACKEND is "memory" (per-process LRU)
+# or "redis" (shared across workers; needs the optional redis package and
+# RESPONSE_CACHE_URL).
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "redis://localhost:6379/0")
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "30"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+
+class InMemoryCacheBackend:
+    """Per-process LRU with per-entry TTL"""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._counters: Dict[str, int] = {}
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        now = time.monotonic()
+        values = []
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                values.append(None)
+                continue
+            self._entries.move_to_end(key)
+            values.append(entry[1])
+        return values
+
+    async def set(self, key: str, value: bytes, ttl_seconds: int):
+        self._entries[key] = (time.monotonic() + ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_counters(self, keys: List[str]) -> List[int]:
+        return [self._counters.get(key, 0) for key in keys]
+
+    async def incr(self, key: str) -> int:
+        self._counters[key] = self._counters.get(key, 0) + 1
+        return self._counters[key]
+
+class RedisCacheBackend:
+    """Shared backend over an asyncio Redis client (redis.asyncio or a fake with the same API)"""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        return await self.client.mget(keys)
+
+    async def set(self, key: str, value: bytes, ttl_seconds: int):
+        await self.client.set(key, value, ex=ttl_seconds)
+
+    async def get_counters(self, keys: List[str]) -> List[int]:
+        return [int(value or 0) for value in await self.client.mget(keys)]
+
+    async def incr(self, key: str) -> int:
+        return await self.client.incr(key)
+
+class ResponseCache:
+    """Caches serialized GET responses with ETags and tag-based invalidation.
+
+    Every entry is stored under its URL plus the current version of each of
+    its tags, so invalidating a tag is a single counter increment and stale
+    entries simply stop being addressed (they age out through the LRU/TTL).
+    """
+
+    def __init__(self, backend, ttl_seconds: int = RESPONSE_CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    async def invalidate(self, *tags: str):
+        for tag in tags:
+            await self.backend.incr(f"tag:{tag}")
+
+    async def cached(
+        self,
+        request: Request,
+        tags: Iterable[str],
+        compute: Callable[[Dict[str, str]], Awaitable[Any]],
+        response_model: Any = None
+    ) -> Response:
+        """Serve a GET from cache, or compute, serialize and store it.
+
+        ``compute`` receives a dict it may fill with response headers (for
+        example a pagination cursor); they are cached with the body.
+        """
+        tags = sorted(tags)
+        versions = await self.backend.get_counters([f"tag:{tag}" for tag in tags])
+        key = "response:{}?{}|{}".format(
+            request.url.path,
+            "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items())),
+            ",".join(f"{tag}={version}" for tag, version in zip(tags, versions))
+        )
+        
+        cached = (await self.backend.get_many([key]))[0]
+        if cached is not None:
+            self.hits += 1
+            entry = json.loads(cached)
+            status = "HIT"
+        else:
+            self.misses += 1
+            headers: Dict[str, str] = {}
+            data = await compute(headers)
+            if response_model is not None:
+                data = TypeAdapter(response_model).validate_python(data, from_attributes=True)
+            body = JSONResponse(content=jsonable_encoder(data)).body.decode()
+            entry = {
+                "etag": '"{}"'.format(hashlib.blake2b(body.encode(), digest_size=12).hexdigest()),
+                "headers": headers,
+                "body": body
+            }
+            await self.backend.set(key, json.dumps(entry).encode(), self.ttl_seconds)
+            status = "MISS"
+        
+        headers = {**entry["headers"], "ETag": entry["etag"], "X-Cache": status}
+        if_none_match = {tag.strip() for tag in request.headers.get("if-none-match", "").split(",")}
+        if entry["etag"] in if_none_match or "*" in if_none_match:
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+def _create_backend():
+    if RESPONSE_CACHE_BACKEND == "redis":
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("RESPONSE_CACHE_BACKEND=redis requires the redis package") from e
+        return RedisCacheBackend(redis.from_url(RESPONSE_CACHE_URL))
+    return InMemoryCacheBackend()
+
+# Global instance
+response_cache = ResponseCache(_create_backend())
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Roll Up Campaign Analytics
+Rolls donations into per-campaign daily campaign_analytics rows, from the
+stored watermark through today. Each day is one set-based upsert committed
+with its watermark, so the job is safe to rerun and resumes where an
+interrupted run stopped. Schedule it (e.g. from cron) or set
+CAMPAIGN_ANALYTICS_ROLLUP_SECONDS to run it inside the API.
+
+Usage:
+    python rollup_campaign_analytics.py
+"""
+
+import asyncio
+import time
+
+from database import AsyncSessionLocal
+from campaign_analytics_service import campaign_analytics_service
+
+async def main():
+    print("🔄 Rolling up campaign analytics...")
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        days = await campaign_analytics_service.rollup(db)
+    print(f"✅ Rolled up {days} day(s) in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,6 +1,7 @@
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
 from datetime import datetime
+from enum import Enum
 
 # User Schemas
 class UserBase(BaseModel):
@@ -33,6 +34,7 @@ class UserProfile(BaseModel):
     total_donated: float
     total_campaigns: int
     verification_status: str
+    unread_notifications: int = 0
     
     class Config:
         from_attributes = True
@@ -57,6 +59,53 @@ class Campaign(CampaignBase):
     class Config:
         from_attributes = True
 
+class CampaignAnalyticsDay(BaseModel):
+    date: datetime
+    views: int
+    shares: int
+    unique_donors: int
+    total_donations: float
+    
+    class Config:
+        from_attributes = True
+
+class CampaignCounters(BaseModel):
+    campaign_id: int
+    views: int
+    shares: int
+
+class CampaignUpdateCreate(BaseModel):
+    title: str
+    content: str
+
+class CampaignUpdate(CampaignUpdateCreate):
+    id: int
+    campaign_id: int
+    created_at: datetime
+    notified_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+class GoalType(str, Enum):
+    milestone = "milestone"
+    stretch = "stretch"
+    final = "final"
+
+class DonationGoalCreate(BaseModel):
+    goal_amount: float
+    goal_type: GoalType = GoalType.milestone
+    description: Optional[str] = None
+
+class DonationGoal(DonationGoalCreate):
+    id: int
+    campaign_id: int
+    achieved_at: Optional[datetime] = None
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
 # Donation Schemas
 class DonationBase(BaseModel):
     amount: float
@@ -75,6 +124,17 @@ class Donation(DonationBase):
     class Config:
         from_attributes = True
 
+class BulkDonationError(BaseModel):
+    line: int
+    error: str
+
+class BulkDonationResult(BaseModel):
+    inserted: int = 0
+    rejected: int = 0
+    total_amount: float = 0.0
+    campaign_ids: List[int] = []
+    errors: List[BulkDonationError] = []
+
 # Category Schemas
 class CategoryBase(BaseModel):
     name: str
@@ -98,11 +158,58 @@ class CityRanking(BaseModel):
     rank: int
     average_donation: float
 
+class CityStatistics(BaseModel):
+    city: str
+    total_donations: float
+    total_donors: int
+    donation_count: int
+    average_donation: float
+    donation_frequency: float
+    last_updated: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
 class CityRankingResponse(BaseModel):
     top_cities: List[CityRanking]
     user_city_context: List[CityRanking]
     user_city_rank: int
 
+class RankingPeriod(str, Enum):
+    day = "day"
+    week = "week"
+    month = "month"
+    rolling_30d = "rolling_30d"
+
+class PeriodCityRanking(BaseModel):
+    city: str
+    total_donations: float
+    donation_count: int
+    rank: int
+    average_donation: float
+
+class PeriodCityRankingResponse(BaseModel):
+    period: RankingPeriod
+    bucket: str
+    top_cities: List[PeriodCityRanking]
+    user_city_context: List[PeriodCityRanking]
+    user_city_rank: Optional[int] = None
+
+# Notification Schemas
+class Notification(BaseModel):
+    id: int
+    title: str
+    message: Optional[str] = None
+    notification_type: str
+    is_read: bool
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+class UnreadCount(BaseModel):
+    unread: int
+
 # Token Schemas
 class Token(BaseModel):
     access_token: str
@@ -2,15 +2,30 @@
 """
 Sample Data Seeding Script for Donation Platform
 This script creates sample data to demonstrate the platform functionality.
+It doubles as a synthetic load-data generator: sizes and popularity skew are
+parameters, rows are written with bulk inserts (COPY on PostgreSQL), and the
+same --seed always produces the same dataset. Timestamps are spread over the
+--days before a fixed date rather than taken from the clock.
+
+Usage:
+    python seed_data.py
+    python seed_data.py --users 100000 --campaigns 5000 --donations 10000000 --cities 500 --skew 1.1
 """
 
+import argparse
 import asyncio
+import csv
+import io
+import itertools
 import random
+import time
 from datetime import datetime, timedelta
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import bindparam, create_engine, func, insert, select, text, update
 from models import *
 from city_ranking_service import city_ranking_service
+from city_statistics_service import city_statistics_service
+from database import AsyncSessionLocal
 import os
 from dotenv import load_dotenv
 
@@ -92,30 +107,86 @@ CAMPAIGNS = [
     }
 ]
 
-def create_sample_users(db):
-    """Create sample users with realistic data"""
-    print("Creating sample users...")
-    
-    users = []
-    for i in range(50):
-        city = random.choice(CITIES)
-        user = User(
-            username=f"user{i+1:03d}",
-            email=f"user{i+1:03d}@example.com",
-            full_name=f"User {i+1}",
-            city=city,
-            phone_number=f"+1-{random.randint(200, 999)}-{random.randint(100, 999)}-{random.randint(1000, 9999)}",
-            hashed_password="$2b$12$LQv3c1yqBWVHxkd0LHAkCOYz6TtxMQJqhN8/LewdBPj4J8K8K8K8K",  # password: "password"
-            is_active=True
+MESSAGES = [
+    "Great cause!",
+    "Happy to help!",
+    "Keep up the good work!",
+    "This is important",
+    "Thank you for doing this",
+    None, None, None  # Some donations without messages
+]
+
+SAMPLE_PASSWORD_HASH = "$2b$12$LQv3c1yqBWVHxkd0LHAkCOYz6TtxMQJqhN8/LewdBPj4J8K8K8K8K"  # password: "password"
+
+# Seeded rows are timestamped within the --days before this date, so the
+# dataset does not depend on when the script runs
+SEED_EPOCH = datetime(2024, 1, 1)
+
+def zipf_cum_weights(count, skew):
+    """Cumulative weights picking item i in proportion to 1 / (i + 1) ** skew (0 is uniform)"""
+    return list(itertools.accumulate(1.0 / (i + 1) ** skew for i in range(count)))
+
+def random_time_after(rng, start):
+    """A random whole second between start and SEED_EPOCH"""
+    return start + timedelta(seconds=rng.randrange(int((SEED_EPOCH - start).total_seconds()) + 1))
+
+def next_id(db, model):
+    return (db.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+def bulk_insert(db, model, columns, rows):
+    """Insert tuples with COPY on PostgreSQL, or one batched executemany elsewhere"""
+    if not rows:
+        return
+    if db.bind.dialect.name == "postgresql":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor = db.connection().connection.cursor()
+        cursor.copy_expert(
+            f"COPY {model.__tablename__} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer
         )
-        db.add(user)
-        users.append(user)
+    else:
+        db.execute(insert(model.__table__), [dict(zip(columns, row)) for row in rows])
+
+def reset_id_sequence(db, model):
+    """Move the id sequence past explicitly inserted ids (PostgreSQL only)"""
+    if db.bind.dialect.name == "postgresql":
+        table = model.__tablename__
+        db.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"))
+
+def create_sample_users(db, rng, args):
+    """Create sample users with realistic data; returns (first user id, city and creation time of each user)"""
+    print(f"Creating {args.users:,} sample users...")
+    
+    cities = CITIES[:args.cities] + [f"City {i + 1}" for i in range(len(CITIES), args.cities)]
+    city_weights = zipf_cum_weights(len(cities), args.skew)
+    first_id = next_id(db, User)
+    window_start = SEED_EPOCH - timedelta(days=args.days)
+    columns = [
+        "id", "username", "email", "full_name", "city", "phone_number",
+        "hashed_password", "is_active", "created_at", "updated_at"
+    ]
+    
+    user_cities = rng.choices(cities, cum_weights=city_weights, k=args.users)
+    user_created = [random_time_after(rng, window_start) for _ in range(args.users)]
+    for start in range(0, args.users, args.batch_size):
+        rows = []
+        for i in range(start, min(start + args.batch_size, args.users)):
+            user_id = first_id + i
+            rows.append((
+                user_id, f"user{user_id:03d}", f"user{user_id:03d}@example.com", f"User {user_id}",
+                user_cities[i],
+                f"+1-{rng.randint(200, 999)}-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}",
+                SAMPLE_PASSWORD_HASH, True, user_created[i], user_created[i]
+            ))
+        bulk_insert(db, User, columns, rows)
+    reset_id_sequence(db, User)
     
     db.commit()
-    print(f"Created {len(users)} users")
-    return users
+    print(f"Created {args.users:,} users in {len(set(user_cities))} cities")
+    return first_id, user_cities, user_created
 
-def create_sample_categories(db):
+def create_sample_categories(db, args):
     """Create sample categories"""
     print("Creating sample categories...")
     
@@ -123,7 +194,8 @@ def create_sample_categories(db):
     for cat_data in CATEGORIES:
         category = Category(
             name=cat_data["name"],
-            description=cat_data["description"]
+            description=cat_data["description"],
+            created_at=SEED_EPOCH - timedelta(days=args.days)
         )
         db.add(category)
         categories.append(category)
@@ -132,206 +204,239 @@ def create_sample_categories(db):
     print(f"Created {len(categories)} categories")
     return categories
 
-def create_sample_campaigns(db, users, categories):
-    """Create sample campaigns"""
-    print("Creating sample campaigns...")
+def create_sample_campaigns(db, rng, args, first_user_id, user_created, categories):
+    """Create sample campaigns from the templates; returns (first campaign id, creator and creation time of each campaign)"""
+    print(f"Creating {args.campaigns:,} sample campaigns...")
     
-    campaigns = []
-    category_map = {cat.name: cat for cat in categories}
+    category_map = {cat.name: cat.id for cat in categories}
+    first_id = next_id(db, Campaign)
+    columns = [
+        "id", "title", "description", "target_amount", "current_amount", "creator_id",
+        "category_id", "status", "created_at", "updated_at"
+    ]
     
-    for campaign_data in CAMPAIGNS:
-        creator = random.choice(users)
-        category = category_map[campaign_data["category"]]
-        
-        campaign = Campaign(
-            title=campaign_data["title"],
-            description=campaign_data["description"],
-            target_amount=campaign_data["target_amount"],
-            creator_id=creator.id,
-            category_id=category.id,
-            status="active"
-        )
-        db.add(campaign)
-        campaigns.append(campaign)
+    creators, campaign_created = [], []
+    for start in range(0, args.campaigns, args.batch_size):
+        rows = []
+        for i in range(start, min(start + args.batch_size, args.campaigns)):
+            campaign_data = CAMPAIGNS[i % len(CAMPAIGNS)]
+            copy = i // len(CAMPAIGNS)
+            creator = rng.randrange(args.users)
+            creator_id = first_user_id + creator
+            # Created after its creator joined
+            created_at = random_time_after(rng, user_created[creator])
+            creators.append(creator_id)
+            campaign_created.append(created_at)
+            rows.append((
+                first_id + i,
+                campaign_data["title"] + (f" #{copy + 1}" if copy else ""),
+                campaign_data["description"],
+                campaign_data["target_amount"],
+                0.0,
+                creator_id,
+                category_map[campaign_data["category"]],
+                "active", created_at, created_at
+            ))
+        bulk_insert(db, Campaign, columns, rows)
+    reset_id_sequence(db, Campaign)
     
     db.commit()
-    print(f"Created {len(campaigns)} campaigns")
-    return campaigns
+    print(f"Created {args.campaigns:,} campaigns")
+    return first_id, creators, campaign_created
 
-def create_sample_donations(db, users, campaigns):
-    """Create sample donations and update city rankings"""
-    print("Creating sample donations...")
+def create_sample_donations(db, rng, args, first_user_id, user_cities, user_created,
+                            first_campaign_id, campaign_created):
+    """Create donations and their transactions in batches, aggregating every total on the way"""
+    print(f"Creating {args.donations:,} sample donations...")
     
-    donations = []
-    total_donations = 0
+    # Popular donors and campaigns get a Zipf-like share of the donations
+    user_weights = zipf_cum_weights(args.users, args.skew)
+    campaign_weights = zipf_cum_weights(args.campaigns, args.skew)
+    first_id = next_id(db, Donation)
+    donation_columns = ["id", "amount", "donor_id", "campaign_id", "message", "is_anonymous", "created_at"]
+    transaction_columns = [
+        "donation_id", "transaction_type", "amount", "status", "payment_method",
+        "transaction_id", "created_at", "updated_at"
+    ]
     
-    for _ in range(200):  # Create 200 donations
-        donor = random.choice(users)
-        campaign = random.choice(campaigns)
-        amount = round(random.uniform(10, 1000), 2)
-        
-        donation = Donation(
-            amount=amount,
-            donor_id=donor.id,
-            campaign_id=campaign.id,
-            message=random.choice([
-                "Great cause!",
-                "Happy to help!",
-                "Keep up the good work!",
-                "This is important",
-                "Thank you for doing this",
-                None, None, None  # Some donations without messages
-            ]),
-            is_anonymous=random.choice([True, False])
-        )
-        db.add(donation)
-        donations.append(donation)
-        
-        # Update campaign amount
-        campaign.current_amount += amount
-        total_donations += amount
+    totals = {
+        "amount": 0.0,
+        "donors": [0.0] * args.users,
+        "campaigns": [0.0] * args.campaigns,
+        "cities": {},
+        # Latest donation of each donor and campaign (their updated_at)
+        "donor_updated": list(user_created),
+        "campaign_updated": list(campaign_created)
+    }
+    started = time.perf_counter()
+    for start in range(0, args.donations, args.batch_size):
+        count = min(args.batch_size, args.donations - start)
+        donors = rng.choices(range(args.users), cum_weights=user_weights, k=count)
+        campaigns = rng.choices(range(args.campaigns), cum_weights=campaign_weights, k=count)
+        donations, transactions = [], []
+        for offset in range(count):
+            donation_id = first_id + start + offset
+            donor, campaign = donors[offset], campaigns[offset]
+            donor_id = first_user_id + donor
+            amount = round(rng.uniform(10, 1000), 2)
+            # After both the donor joined and the campaign started
+            created_at = random_time_after(rng, max(user_created[donor], campaign_created[campaign]))
+            donations.append((
+                donation_id, amount, donor_id, first_campaign_id + campaign,
+                rng.choice(MESSAGES), rng.random() < 0.5, created_at
+            ))
+            transactions.append((
+                donation_id, "donation", amount, "completed", "online",
+                f"TXN_{donation_id}_{donor_id}", created_at, created_at
+            ))
+            
+            totals["amount"] += amount
+            totals["donors"][donor] += amount
+            totals["campaigns"][campaign] += amount
+            totals["donor_updated"][donor] = max(totals["donor_updated"][donor], created_at)
+            totals["campaign_updated"][campaign] = max(totals["campaign_updated"][campaign], created_at)
+            city = totals["cities"].setdefault(
+                user_cities[donor], {"total_donations": 0.0, "donation_count": 0, "donor_ids": set()}
+            )
+            city["total_donations"] += amount
+            city["donation_count"] += 1
+            city["donor_ids"].add(donor_id)
         
-        # Create transaction record
-        transaction = Transaction(
-            donation_id=donation.id,
-            transaction_type="donation",
-            amount=amount,
-            status="completed",
-            payment_method="online",
-            transaction_id=f"TXN_{donation.id}_{donor.id}"
-        )
-        db.add(transaction)
-    
+        bulk_insert(db, Donation, donation_columns, donations)
+        bulk_insert(db, Transaction, transaction_columns, transactions)
+        db.commit()
+        done = start + count
+        print(f"   {done:,}/{args.donations:,} donations ({done / (time.perf_counter() - started):,.0f}/s)")
+    reset_id_sequence(db, Donation)
     db.commit()
-    print(f"Created {len(donations)} donations totaling ${total_donations:,.2f}")
-    return donations
+    
+    print(f"Created {args.donations:,} donations totaling ${totals['amount']:,.2f}")
+    return totals
 
-async def update_mongodb_rankings(db, donations):
-    """Update MongoDB city rankings"""
+async def update_mongodb_rankings(city_totals):
+    """Load the aggregated city totals into MongoDB in one batch"""
     print("Updating MongoDB city rankings...")
+    await city_ranking_service.start()
+    await city_ranking_service.load_city_totals(city_totals)
+    await city_ranking_service.close()
     
-    # Group donations by city
-    city_donations = {}
-    for donation in donations:
-        donor = db.query(User).filter(User.id == donation.donor_id).first()
-        city = donor.city
-        
-        if city not in city_donations:
-            city_donations[city] = []
-        city_donations[city].append(donation)
-    
-    # Update MongoDB rankings
-    for city, city_donation_list in city_donations.items():
-        total_amount = sum(d.amount for d in city_donation_list)
-        unique_donors = len(set(d.donor_id for d in city_donation_list))
-        
-        # Update city ranking for each donation
-        for donation in city_donation_list:
-            await city_ranking_service.update_city_ranking(
-                city, donation.amount, donation.donor_id
-            )
-    
-    print(f"Updated rankings for {len(city_donations)} cities")
+    print(f"Updated rankings for {len(city_totals)} cities")
 
-def create_user_profiles(db, users):
-    """Create user profiles"""
+def create_user_profiles(db, rng, args, first_user_id, user_cities, user_created, totals, creators, unread):
+    """Create user profiles with their donation and campaign totals"""
     print("Creating user profiles...")
     
-    profiles = []
-    for user in users:
-        profile = UserProfile(
-            user_id=user.id,
-            bio=f"Passionate about making a difference in {user.city}",
-            total_donated=0.0,  # Will be updated by donations
-            total_campaigns=0,
-            verification_status=random.choice(["verified", "unverified", "pending"])
-        )
-        db.add(profile)
-        profiles.append(profile)
+    campaign_counts = {}
+    for creator_id in creators:
+        campaign_counts[creator_id] = campaign_counts.get(creator_id, 0) + 1
+    columns = [
+        "user_id", "bio", "total_donated", "total_campaigns", "verification_status",
+        "unread_notifications", "created_at", "updated_at"
+    ]
+    
+    for start in range(0, args.users, args.batch_size):
+        rows = []
+        for i in range(start, min(start + args.batch_size, args.users)):
+            user_id = first_user_id + i
+            rows.append((
+                user_id,
+                f"Passionate about making a difference in {user_cities[i]}",
+                round(totals["donors"][i], 2),
+                campaign_counts.get(user_id, 0),
+                rng.choice(["verified", "unverified", "pending"]),
+                unread.get(user_id, 0),
+                user_created[i], totals["donor_updated"][i]
+            ))
+        bulk_insert(db, UserProfile, columns, rows)
     
     db.commit()
-    print(f"Created {len(profiles)} user profiles")
-    return profiles
+    print(f"Created {args.users:,} user profiles")
 
-def update_user_statistics(db, users, donations, campaigns):
-    """Update user statistics based on donations and campaigns"""
-    print("Updating user statistics...")
-    
-    # Update total donated amounts
-    user_donations = {}
-    for donation in donations:
-        donor_id = donation.donor_id
-        if donor_id not in user_donations:
-            user_donations[donor_id] = 0
-        user_donations[donor_id] += donation.amount
-    
-    # Update campaign counts
-    user_campaigns = {}
-    for campaign in campaigns:
-        creator_id = campaign.creator_id
-        if creator_id not in user_campaigns:
-            user_campaigns[creator_id] = 0
-        user_campaigns[creator_id] += 1
-    
-    # Update profiles
-    for user in users:
-        profile = db.query(UserProfile).filter(UserProfile.user_id == user.id).first()
-        if profile:
-            profile.total_donated = user_donations.get(user.id, 0.0)
-            profile.total_campaigns = user_campaigns.get(user.id, 0)
+def update_campaign_totals(db, first_campaign_id, totals):
+    """Set each campaign's current amount and last donation time with one executemany UPDATE"""
+    print("Updating campaign totals...")
+    table = Campaign.__table__
+    db.execute(
+        update(table)
+        .where(table.c.id == bindparam("b_id"))
+        .values(current_amount=bindparam("b_amount"), updated_at=bindparam("b_updated")),
+        [
+            {"b_id": first_campaign_id + i, "b_amount": round(amount, 2), "b_updated": totals["campaign_updated"][i]}
+            for i, amount in enumerate(totals["campaigns"]) if amount
+        ]
+    )
+    db.commit()
 
-def create_sample_notifications(db, users):
-    """Create sample notifications"""
+async def rebuild_city_statistics():
+    """Recompute the SQL city statistics from the loaded donations in one pass"""
+    print("Rebuilding city statistics...")
+    async with AsyncSessionLocal() as db:
+        await city_statistics_service.rebuild(db, now=SEED_EPOCH)
+
+def create_sample_notifications(db, rng, args, first_user_id, user_created):
+    """Create sample notifications; returns the unread count per user"""
     print("Creating sample notifications...")
     
     notifications = []
-    for user in random.sample(users, 20):  # Notify 20 random users
+    unread = {}
+    for i in sorted(rng.sample(range(args.users), min(20, args.users))):  # Notify 20 random users
         notification = Notification(
-            user_id=user.id,
+            user_id=first_user_id + i,
             title="Welcome to DonateHub!",
-            message=f"Thank you for joining our community, {user.full_name}! Start exploring campaigns and help your city climb the rankings.",
+            message=f"Thank you for joining our community, User {first_user_id + i}! Start exploring campaigns and help your city climb the rankings.",
             notification_type="system",
-            is_read=random.choice([True, False])
+            is_read=rng.choice([True, False]),
+            created_at=random_time_after(rng, user_created[i])
         )
         db.add(notification)
         notifications.append(notification)
+        if not notification.is_read:
+            unread[notification.user_id] = unread.get(notification.user_id, 0) + 1
     
     db.commit()
     print(f"Created {len(notifications)} notifications")
+    return unread
 
-async def main():
+async def seed(args):
     """Main seeding function"""
-    print("🌱 Starting database seeding...")
+    print(f"🌱 Starting database seeding (seed {args.seed})...")
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
     
     # Create database session
     db = SessionLocal()
     
     try:
         # Create sample data
-        users = create_sample_users(db)
-        categories = create_sample_categories(db)
-        campaigns = create_sample_campaigns(db, users, categories)
-        donations = create_sample_donations(db, users, campaigns)
-        profiles = create_user_profiles(db, users)
+        first_user_id, user_cities, user_created = create_sample_users(db, rng, args)
+        categories = create_sample_categories(db, args)
+        first_campaign_id, creators, campaign_created = create_sample_campaigns(
+            db, rng, args, first_user_id, user_created, categories
+        )
+        totals = create_sample_donations(
+            db, rng, args, first_user_id, user_cities, user_created, first_campaign_id, campaign_created
+        )
+        unread = create_sample_notifications(db, rng, args, first_user_id, user_created)
         
         # Update statistics
-        update_user_statistics(db, users, donations, campaigns)
-        create_sample_notifications(db, users)
+        create_user_profiles(db, rng, args, first_user_id, user_cities, user_created, totals, creators, unread)
+        update_campaign_totals(db, first_campaign_id, totals)
+        await rebuild_city_statistics()
         
         # Update MongoDB rankings
-        await update_mongodb_rankings(db, donations)
+        await update_mongodb_rankings(totals["cities"])
         
         db.commit()
-        print("✅ Database seeding completed successfully!")
+        print(f"✅ Database seeding completed successfully in {time.perf_counter() - started:.1f}s!")
         
         # Print summary
         print("\n📊 Sample Data Summary:")
-        print(f"   Users: {len(users)}")
+        print(f"   Users: {args.users:,}")
         print(f"   Categories: {len(categories)}")
-        print(f"   Campaigns: {len(campaigns)}")
-        print(f"   Donations: {len(donations)}")
-        print(f"   Total Donation Amount: ${sum(d.amount for d in donations):,.2f}")
-        print(f"   Cities Represented: {len(set(u.city for u in users))}")
+        print(f"   Campaigns: {args.campaigns:,}")
+        print(f"   Donations: {args.donations:,}")
+        print(f"   Total Donation Amount: ${totals['amount']:,.2f}")
+        print(f"   Cities Represented: {len(set(user_cities))}")
         
     except Exception as e:
         print(f"❌ Error during seeding: {e}")
@@ -339,5 +444,19 @@ async def main():
     finally:
         db.close()
 
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="number of users")
+    parser.add_argument("--campaigns", type=int, default=len(CAMPAIGNS), help="number of campaigns")
+    parser.add_argument("--donations", type=int, default=200, help="number of donations")
+    parser.add_argument("--cities", type=int, default=len(CITIES), help="number of distinct cities")
+    parser.add_argument("--skew", type=float, default=0.0,
+                        help="Zipf exponent for donor, campaign and city popularity (0 is uniform)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed; the same seed gives the same data")
+    parser.add_argument("--days", type=int, default=365,
+                        help="timestamps are spread over this many days before the fixed seed epoch")
+    parser.add_argument("--batch-size", type=int, default=50000, help="rows per bulk insert")
+    asyncio.run(seed(parser.parse_args()))
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
@@ -0,0 +1,34 @@
+"""
+Test configuration: the app runs against a throwaway SQLite database and
+in-memory MongoDB collections from mongomock-motor. Both are set up here,
+before any test imports database or the services that capture its
+collections at import time.
+"""
+
+import os
+import tempfile
+
+import pytest
+
+_db_dir = tempfile.mkdtemp(prefix="donation_tests_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+
+from mongomock_motor import AsyncMongoMockClient
+
+import database
+
+_mongodb = AsyncMongoMockClient()[database.mongodb.name]
+database.mongodb = _mongodb
+for _name in dir(database):
+    if _name.endswith("_collection"):
+        setattr(database, _name, _mongodb[getattr(database, _name).name])
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+def mongo():
+    """A fresh in-memory MongoDB database"""
+    return AsyncMongoMockClient()["test"]
@@ -0,0 +1,37 @@
+"""Campaign view/share counter buffering in CampaignAnalyticsService."""
+
+import pytest
+
+import campaign_analytics_service as analytics
+from campaign_analytics_service import CampaignAnalyticsService
+
+class FailingSession:
+    """Stands in for an AsyncSession whose database rejects every write"""
+
+    class bind:
+        class dialect:
+            name = "sqlite"
+
+    async def execute(self, *args, **kwargs):
+        raise RuntimeError("database unavailable")
+
+    async def rollback(self):
+        pass
+
+@pytest.mark.anyio
+async def test_failed_flushes_requeue_then_drop_counts(monkeypatch):
+    monkeypatch.setattr(analytics, "CAMPAIGN_COUNTER_MAX_FAILED_FLUSHES", 3)
+    service = CampaignAnalyticsService()
+    service.record_view(1)
+    service.record_view(1)
+    service.record_share(2)
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            await service.flush_counts(FailingSession())
+        # Requeued for the next flush, not lost and not doubled
+        assert sorted(counts["views"] + counts["shares"] for counts in service._pending_counts.values()) == [1, 2]
+
+    with pytest.raises(RuntimeError):
+        await service.flush_counts(FailingSession())
+    assert service._pending_counts == {}
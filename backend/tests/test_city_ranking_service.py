@@ -0,0 +1,294 @@
+"""CityRankingService against in-memory mongomock-motor collections."""
+
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import ServerSelectionTimeoutError
+
+import city_ranking_service
+from city_ranking_service import CityRankingService
+
+class Clock(datetime):
+    """datetime whose utcnow() is set by the test"""
+    current = datetime(2024, 1, 1)
+
+    @classmethod
+    def utcnow(cls):
+        return cls.current
+
+@pytest.fixture
+def clock(monkeypatch):
+    monkeypatch.setattr(city_ranking_service, "datetime", Clock)
+    monkeypatch.setattr(Clock, "current", datetime(2024, 1, 1))
+    return Clock
+
+@pytest.fixture
+async def service(mongo):
+    service = CityRankingService(
+        mongo.city_rankings, mongo.user_activities, mongo.analytics,
+        mongo.city_donors, mongo.city_ranking_buckets
+    )
+    await service.start()
+    try:
+        yield service
+    finally:
+        await service.close()
+
+async def donate(service, *donations):
+    await service.update_city_rankings(donations)
+    await service.flush()
+
+class Unreachable:
+    """Collection whose next bulk writes fail as if no server were reachable"""
+
+    def __init__(self, collection, failures=1):
+        self._collection = collection
+        self.failures = failures
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def bulk_write(self, *args, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise ServerSelectionTimeoutError("no servers")
+        return await self._collection.bulk_write(*args, **kwargs)
+
+@pytest.mark.anyio
+async def test_flush_writes_city_totals_donors_and_activities(service, mongo):
+    await donate(service, ("Pune", 10.0, 1), ("Pune", 5.0, 1), ("Pune", 2.5, 2), ("Delhi", 4.0, 3))
+    await donate(service, ("Pune", 1.0, 2), ("Pune", 1.5, 4))
+
+    pune = await mongo.city_rankings.find_one({"city": "Pune"})
+    assert pune["total_donations"] == 20.0
+    assert pune["donation_count"] == 5
+    # Repeat donors are counted once
+    assert pune["total_donors"] == 3
+    assert pune["average_donation"] == 4.0
+    assert await mongo.city_donors.count_documents({"city": "Pune"}) == 3
+    assert await mongo.user_activities.count_documents({"city": "Pune", "activity_type": "donation"}) == 5
+
+    # Nothing is left queued, so another flush writes nothing twice
+    await service.flush()
+    assert (await mongo.city_rankings.find_one({"city": "Pune"}))["total_donations"] == 20.0
+
+@pytest.mark.anyio
+async def test_requeued_totals_still_count_recorded_donors(service, mongo):
+    service.collection = Unreachable(service.collection)
+    await service.update_city_rankings([("Pune", 10.0, 1), ("Pune", 5.0, 2)])
+    # The donors are recorded before the city totals write fails
+    with pytest.raises(ServerSelectionTimeoutError):
+        await service.flush()
+    assert await mongo.city_donors.count_documents({"city": "Pune", "counted": False}) == 2
+
+    await service.flush()
+    pune = await mongo.city_rankings.find_one({"city": "Pune"})
+    assert (pune["total_donations"], pune["total_donors"]) == (15.0, 2)
+    assert await mongo.city_donors.count_documents({"counted": True, "claimed_by": None}) == 2
+
+    # Counted donors are not counted again
+    await donate(service, ("Pune", 1.0, 1), ("Pune", 1.0, 3))
+    assert (await mongo.city_rankings.find_one({"city": "Pune"}))["total_donors"] == 3
+
+@pytest.mark.anyio
+async def test_donor_claimed_by_one_worker_is_counted_once(service, mongo):
+    other = CityRankingService(
+        mongo.city_rankings, mongo.user_activities, mongo.analytics,
+        mongo.city_donors, mongo.city_ranking_buckets
+    )
+    await other.start()
+    try:
+        # The first worker claims the new donor but fails to write the totals
+        service.collection = Unreachable(service.collection)
+        await service.update_city_rankings([("Pune", 10.0, 1)])
+        with pytest.raises(ServerSelectionTimeoutError):
+            await service.flush()
+        await donate(other, ("Pune", 5.0, 1))
+        assert (await mongo.city_rankings.find_one({"city": "Pune"}))["total_donors"] == 0
+
+        await service.flush()
+        pune = await mongo.city_rankings.find_one({"city": "Pune"})
+        assert (pune["total_donations"], pune["total_donors"]) == (15.0, 1)
+    finally:
+        await other.close()
+
+@pytest.mark.anyio
+async def test_get_top_cities_orders_by_total_and_limits(service):
+    await donate(service, ("Pune", 10.0, 1), ("Delhi", 30.0, 2), ("Goa", 20.0, 3), ("Agra", 5.0, 4))
+
+    top = await service.get_top_cities(limit=3)
+    assert [(row["city"], row["rank"]) for row in top] == [("Delhi", 1), ("Goa", 2), ("Pune", 3)]
+    assert top[0]["total_donations"] == 30.0
+
+    # A flush that overtakes other cities moves them without a reload
+    await donate(service, ("Agra", 40.0, 5))
+    assert [row["city"] for row in await service.get_top_cities(limit=2)] == ["Agra", "Delhi"]
+
+@pytest.mark.anyio
+async def test_get_city_context_returns_neighbouring_ranks(service):
+    await donate(service, *((f"City {i}", 100.0 - i, i) for i in range(10)))
+
+    context = await service.get_city_context("City 5", context_size=2)
+    assert context["user_city_rank"] == 6
+    assert [row["city"] for row in context["user_city_context"]] == [f"City {i}" for i in range(3, 8)]
+
+    # The window is clipped at the top of the ranking
+    context = await service.get_city_context("City 0", context_size=2)
+    assert [row["rank"] for row in context["user_city_context"]] == [1, 2, 3]
+
+    assert await service.get_city_context("Nowhere") == {"user_city_rank": None, "user_city_context": []}
+
+@pytest.mark.anyio
+async def test_get_global_statistics_follows_flushes(service):
+    assert (await service.get_global_statistics())["total_cities"] == 0
+
+    await donate(service, ("Pune", 10.0, 1), ("Delhi", 30.0, 2), ("Delhi", 20.0, 2))
+    await donate(service, ("Pune", 20.0, 3))
+
+    assert await service.get_global_statistics() == {
+        "total_cities": 2,
+        "total_donations": 80.0,
+        "total_donors": 3,
+        "average_donation_per_city": 40.0
+    }
+    # The incrementally maintained rollup matches a full recount
+    rebuilt = await service.rebuild_global_statistics()
+    assert (rebuilt["total_cities"], rebuilt["total_donations"], rebuilt["total_donors"]) == (2, 80.0, 3)
+
+@pytest.mark.anyio
+async def test_flush_listeners_get_re_ranked_cities(service):
+    await donate(service, ("Pune", 10.0, 1), ("Delhi", 30.0, 2), ("Goa", 20.0, 3))
+    changed = []
+
+    async def listener(cities):
+        changed.append(cities)
+
+    service.add_flush_listener(listener)
+    await donate(service, ("Pune", 25.0, 4))
+    # Pune overtook Goa and Delhi, whose ranks moved too
+    assert changed == [["Delhi", "Goa", "Pune"]]
+
+@pytest.mark.anyio
+async def test_workers_with_stale_indexes_do_not_persist_ranks(service, mongo):
+    # A second worker sharing the collections, with its own rank index
+    other = CityRankingService(
+        mongo.city_rankings, mongo.user_activities, mongo.analytics,
+        mongo.city_donors, mongo.city_ranking_buckets
+    )
+    await other.start()
+    try:
+        await donate(service, ("Pune", 10.0, 1), ("Delhi", 30.0, 2))
+        # The other worker never saw Delhi, so its index ranks Goa first
+        await donate(other, ("Goa", 20.0, 3))
+        assert (await other.get_city_context("Goa"))["user_city_rank"] == 1
+    finally:
+        await other.close()
+
+    assert await mongo.city_rankings.count_documents({"rank": {"$exists": True}}) == 0
+    ranks = {city: (await service.get_city_statistics(city))["rank"] for city in ("Delhi", "Goa", "Pune")}
+    assert ranks == {"Delhi": 1, "Goa": 2, "Pune": 3}
+
+    # Ties are broken by city name, as in the rank index
+    await donate(service, ("Agra", 30.0, 4))
+    assert (await service.get_city_statistics("Agra"))["rank"] == 1
+    assert (await service.get_city_statistics("Delhi"))["rank"] == 2
+
+async def period_totals(service, period, city="Pune"):
+    rankings = await service.get_period_rankings(period, city)
+    return rankings["bucket"], {row["city"]: row["total_donations"] for row in rankings["top_cities"]}
+
+@pytest.mark.anyio
+async def test_day_and_week_rollover(clock, service):
+    # Sunday night, the last day of ISO week 1
+    clock.current = datetime(2024, 1, 7, 23, 30)
+    await donate(service, ("Pune", 10.0, 1))
+    assert await period_totals(service, "day") == ("2024-01-07", {"Pune": 10.0})
+    assert await period_totals(service, "week") == ("2024-W01", {"Pune": 10.0})
+
+    # Queued before midnight but flushed after: it still counts for Sunday
+    await service.update_city_rankings([("Delhi", 4.0, 2)])
+    clock.current = datetime(2024, 1, 8, 0, 10)
+    await service.flush()
+    await donate(service, ("Goa", 5.0, 3))
+
+    assert await period_totals(service, "day") == ("2024-01-08", {"Goa": 5.0})
+    assert await period_totals(service, "week") == ("2024-W02", {"Goa": 5.0})
+    assert await period_totals(service, "month") == ("2024-01", {"Pune": 10.0, "Goa": 5.0, "Delhi": 4.0})
+    sunday = await service.buckets_collection.find_one({"period": "day", "bucket": "2024-01-07", "city": "Delhi"})
+    assert sunday["total_donations"] == 4.0
+
+@pytest.mark.anyio
+async def test_month_and_rolling_window_rollover(clock, service):
+    clock.current = datetime(2024, 1, 1, 12)
+    await donate(service, ("Pune", 10.0, 1))
+    clock.current = datetime(2024, 1, 31, 23, 59)
+    await donate(service, ("Goa", 5.0, 2))
+    assert await period_totals(service, "month") == ("2024-01", {"Pune": 10.0, "Goa": 5.0})
+
+    # A month can roll over mid-week
+    clock.current = datetime(2024, 2, 1, 0, 1)
+    assert await period_totals(service, "month") == ("2024-02", {})
+    assert await period_totals(service, "week") == ("2024-W05", {"Goa": 5.0})
+
+    # The rolling window covers the last 30 days including today
+    assert await period_totals(service, "rolling_30d") == ("2024-01-03..2024-02-01", {"Goa": 5.0})
+    clock.current = datetime(2024, 1, 30, 8)
+    assert await period_totals(service, "rolling_30d") == ("2024-01-01..2024-01-30", {"Pune": 10.0, "Goa": 5.0})
+
+@pytest.mark.anyio
+async def test_bucket_expiry_follows_the_bucket_end(clock, service, mongo, monkeypatch):
+    monkeypatch.setattr(city_ranking_service, "CITY_BUCKET_RETENTION_DAYS", 35)
+    # A future date: the TTL index removes buckets whose expires_at has passed
+    clock.current = datetime(2031, 1, 31, 18)
+    await donate(service, ("Pune", 10.0, 1))
+    buckets = {
+        bucket["period"]: bucket.get("expires_at")
+        for bucket in await mongo.city_ranking_buckets.find({"city": "Pune"}).to_list(length=None)
+    }
+    # Expiry counts from the end of the bucket: Friday Jan 31 + 1 day, Monday Jan 27 + 7 days
+    assert buckets == {"day": datetime(2031, 3, 8), "week": datetime(2031, 3, 10), "month": None}
+
+    # A retention shorter than the rolling window would drop days it still sums
+    monkeypatch.setattr(city_ranking_service, "CITY_BUCKET_RETENTION_DAYS", 7)
+    await donate(service, ("Goa", 10.0, 2))
+    day = await mongo.city_ranking_buckets.find_one({"period": "day", "city": "Goa"})
+    assert day["expires_at"] == datetime(2031, 2, 1) + timedelta(days=30)
+
+@pytest.mark.anyio
+async def test_buckets_are_kept_unless_retention_is_configured(service, mongo, monkeypatch):
+    await donate(service, ("Pune", 10.0, 1))
+    assert await mongo.city_ranking_buckets.count_documents({}) == 3
+    assert await mongo.city_ranking_buckets.count_documents({"expires_at": {"$exists": True}}) == 0
+
+    # Day and week buckets may expire, but never before the raw activities do
+    monkeypatch.setattr(city_ranking_service, "CITY_BUCKET_RETENTION_DAYS", 35)
+    monkeypatch.setattr(city_ranking_service, "USER_ACTIVITY_RETENTION_DAYS", 90)
+    await donate(service, ("Goa", 10.0, 2))
+    buckets = {
+        bucket["period"]: bucket
+        for bucket in await mongo.city_ranking_buckets.find({"city": "Goa"}).to_list(length=None)
+    }
+    assert buckets["day"]["expires_at"] == buckets["day"]["bucket_start"] + timedelta(days=91)
+    assert buckets["week"]["expires_at"] == buckets["week"]["bucket_start"] + timedelta(days=97)
+    assert "expires_at" not in buckets["month"]
+
+    # Turning retention off again keeps the buckets already stamped
+    monkeypatch.setattr(city_ranking_service, "CITY_BUCKET_RETENTION_DAYS", 0)
+    await service.start()
+    assert await mongo.city_ranking_buckets.count_documents({"expires_at": {"$exists": True}}) == 0
+
+@pytest.mark.anyio
+async def test_backpressure_sheds_activities_but_not_bucket_counts(service, mongo, monkeypatch):
+    monkeypatch.setattr(city_ranking_service, "WRITE_BEHIND_MAX_PENDING", 2)
+    monkeypatch.setattr(city_ranking_service, "WRITE_BEHIND_BACKPRESSURE_TIMEOUT_SECONDS", 0.01)
+
+    # A flush stuck behind the lock makes every full batch time out and shed
+    async with service._flush_lock:
+        for donor_id in range(5):
+            await service.update_city_rankings([("Pune", 1.0, donor_id), ("Pune", 2.0, donor_id)])
+    await service.flush()
+
+    assert await mongo.user_activities.count_documents({}) < 10
+    day = await mongo.city_ranking_buckets.find_one({"period": "day", "city": "Pune"})
+    assert (day["total_donations"], day["donation_count"]) == (15.0, 10)
+    assert (await mongo.city_rankings.find_one({"city": "Pune"}))["donation_count"] == 10
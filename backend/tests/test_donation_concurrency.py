@@ -0,0 +1,93 @@
+"""Parallel donations to one campaign must not lose updates (atomic SQL increments)."""
+
+import asyncio
+import itertools
+
+import httpx
+import pytest
+from sqlalchemy import func, select
+
+from auth import create_access_token
+from database import AsyncSessionLocal, SessionLocal, async_engine
+from main import app
+from models import Campaign, Donation, Transaction, User, UserProfile
+
+DONORS = 5
+DONATIONS_PER_DONOR = 20
+# Multiples of 0.25 add up exactly in floating point
+AMOUNTS = [0.25, 1.5, 10.0, 2.75]
+
+def create_campaign_and_donors():
+    """Creator, donors with profiles and one campaign; returns (campaign_id, donor usernames and ids)"""
+    with SessionLocal() as db:
+        users = [
+            User(username=f"concurrency_{i}", email=f"concurrency_{i}@example.com",
+                 full_name=f"Donor {i}", city="Testville", hashed_password="x")
+            for i in range(DONORS + 1)
+        ]
+        db.add_all(users)
+        db.flush()
+        db.add_all(UserProfile(user_id=user.id) for user in users)
+        campaign = Campaign(title="Concurrency", target_amount=1000.0, creator_id=users[0].id)
+        db.add(campaign)
+        db.commit()
+        return campaign.id, [(user.username, user.id) for user in users[1:]]
+
+@pytest.fixture
+async def client():
+    await app.router.startup()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            yield client
+    finally:
+        await app.router.shutdown()
+        await async_engine.dispose()
+
+@pytest.mark.anyio
+async def test_parallel_donations_to_one_campaign(client):
+    campaign_id, donors = create_campaign_and_donors()
+    amounts = itertools.cycle(AMOUNTS)
+    requests = [
+        (username, donor_id, next(amounts))
+        for _ in range(DONATIONS_PER_DONOR)
+        for username, donor_id in donors
+    ]
+
+    headers = {
+        username: {"Authorization": f"Bearer {create_access_token(data={'sub': username})}"}
+        for username, _ in donors
+    }
+
+    async def donate(username, amount):
+        return await client.post(
+            "/donations",
+            json={"amount": amount, "campaign_id": campaign_id},
+            headers=headers[username]
+        )
+
+    responses = await asyncio.gather(*(donate(username, amount) for username, _, amount in requests))
+    assert [response.status_code for response in responses] == [200] * len(requests)
+
+    expected_by_donor = {}
+    for _, donor_id, amount in requests:
+        expected_by_donor[donor_id] = expected_by_donor.get(donor_id, 0.0) + amount
+
+    async with AsyncSessionLocal() as db:
+        campaign = await db.get(Campaign, campaign_id)
+        assert campaign.current_amount == sum(amount for _, _, amount in requests)
+
+        totals = dict((await db.execute(
+            select(UserProfile.user_id, UserProfile.total_donated)
+            .where(UserProfile.user_id.in_(expected_by_donor))
+        )).all())
+        assert totals == expected_by_donor
+
+        donations = (await db.execute(
+            select(func.count(Donation.id)).where(Donation.campaign_id == campaign_id)
+        )).scalar()
+        transactions = (await db.execute(
+            select(func.count(Transaction.id))
+            .join(Donation, Donation.id == Transaction.donation_id)
+            .where(Donation.campaign_id == campaign_id)
+        )).scalar()
+        assert donations == transactions == len(requests)
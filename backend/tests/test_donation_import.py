@@ -0,0 +1,114 @@
+"""Streaming bulk donation import: CSV / NDJSON parsing and chunked writes."""
+
+import pytest
+from sqlalchemy import func, select
+
+from database import AsyncSessionLocal, SessionLocal, async_engine, engine
+from donation_service import aiter_lines, aiter_records, donation_service
+from models import Base, Campaign, Donation, Transaction, User, UserProfile
+
+async def stream(*parts):
+    for part in parts:
+        yield part
+
+async def parse(fmt, *parts):
+    return [record async for record in aiter_records(aiter_lines(stream(*parts)), fmt)]
+
+@pytest.mark.anyio
+async def test_csv_with_bom_crlf_and_multiline_fields():
+    data = (
+        b'\xef\xbb\xbfamount,campaign_id,message\r\n'
+        b'10,1,"Hello\r\nworld"\r\n'
+        b'5,2,"say ""hi"""\r\n'
+        b'\r\n'
+        b'7,3,"Caf\xc3\xa9"\r\n'
+    )
+    # Chunk boundaries fall inside the BOM, a quoted field and a UTF-8 character
+    quoted, accent = data.index(b"world"), data.index(b"\xc3\xa9") + 1
+    parts = (data[:2], data[2:quoted], data[quoted:accent], data[accent:])
+
+    assert await parse("csv", *parts) == [
+        (2, {"amount": "10", "campaign_id": "1", "message": "Hello\r\nworld"}, None),
+        (4, {"amount": "5", "campaign_id": "2", "message": 'say "hi"'}, None),
+        (6, {"amount": "7", "campaign_id": "3", "message": "Café"}, None),
+    ]
+
+@pytest.mark.anyio
+async def test_csv_empty_cells_and_unterminated_quotes():
+    records = await parse("csv", b"amount,campaign_id,message\n1,2,\n3,4,\"oops\n5,6,x\n")
+    assert records == [
+        (2, {"amount": "1", "campaign_id": "2"}, None),
+        (3, None, "Unterminated quoted field"),
+    ]
+
+@pytest.mark.anyio
+async def test_ndjson_reports_bad_lines_and_skips_blank_ones():
+    records = await parse("ndjson", b'{"amount": 1}\r\n\n{bad\n', b'{"amount": 2}')
+    assert [(line, record) for line, record, _ in records] == [(1, {"amount": 1}), (3, None), (4, {"amount": 2})]
+    assert records[1][2].startswith("Invalid JSON")
+
+@pytest.fixture
+async def campaign():
+    """A donor with a profile and a campaign to import into; returns (donor_id, campaign_id)"""
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        user = User(username="importer", email="importer@example.com", full_name="Importer",
+                    city="Importville", hashed_password="x")
+        db.add(user)
+        db.flush()
+        db.add(UserProfile(user_id=user.id))
+        campaign = Campaign(title="Import", target_amount=1000.0, creator_id=user.id)
+        db.add(campaign)
+        db.commit()
+        ids = user.id, campaign.id
+    try:
+        yield ids
+    finally:
+        await async_engine.dispose()
+
+@pytest.mark.anyio
+async def test_import_skips_malformed_rows_across_chunks(campaign):
+    donor_id, campaign_id = campaign
+    body = "\n".join([
+        "amount,campaign_id,message,donor_id",
+        f"1.5,{campaign_id},first,{donor_id}",
+        f"abc,{campaign_id},,{donor_id}",
+        f"2.5,{campaign_id},,{donor_id}",
+        f"3,999999,,{donor_id}",
+        f"4,{campaign_id},,",
+        f"5,{campaign_id},,999999",
+        f'6,{campaign_id},"two\nlines",{donor_id}',
+        f"7,{campaign_id},,{donor_id}",
+    ]).encode()
+
+    async with AsyncSessionLocal() as db:
+        result = await donation_service.import_donations(
+            db, aiter_records(aiter_lines(stream(body)), "csv"), chunk_size=2
+        )
+
+    assert (result.inserted, result.rejected, result.total_amount) == (4, 4, 17.0)
+    assert result.campaign_ids == [campaign_id]
+    # Lookup failures are reported when their chunk is written, after later parse errors
+    assert sorted((error.line, error.error) for error in result.errors) == [
+        (3, "amount: Input should be a valid number, unable to parse string as a number"),
+        (5, "Campaign not found"),
+        (6, "donor_id: a valid integer is required"),
+        (7, "Donor not found"),
+    ]
+
+    async with AsyncSessionLocal() as db:
+        assert (await db.get(Campaign, campaign_id)).current_amount == 17.0
+        total_donated = (await db.execute(
+            select(UserProfile.total_donated).where(UserProfile.user_id == donor_id)
+        )).scalar()
+        assert total_donated == 17.0
+        messages = (await db.execute(
+            select(Donation.message).where(Donation.campaign_id == campaign_id).order_by(Donation.id)
+        )).scalars().all()
+        assert messages == ["first", None, "two\nlines", None]
+        transactions = (await db.execute(
+            select(func.count(Transaction.id))
+            .join(Donation, Donation.id == Transaction.donation_id)
+            .where(Donation.campaign_id == campaign_id)
+        )).scalar()
+        assert transactions == 4
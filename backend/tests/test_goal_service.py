@@ -0,0 +1,116 @@
+"""Goal milestones: threshold crossings, achievement events and the threshold cache."""
+
+import itertools
+
+import pytest
+from sqlalchemy import func, insert, select
+
+from database import AsyncSessionLocal, SessionLocal, async_engine, engine
+from goal_service import GoalService
+from models import Base, Campaign, DonationGoal, User, UserBadge, UserProfile
+
+_campaigns = itertools.count()
+
+def create_campaign(*goals):
+    """A campaign with (goal_amount, goal_type) goals; returns (campaign_id, creator_id)"""
+    Base.metadata.create_all(bind=engine)
+    n = next(_campaigns)
+    with SessionLocal() as db:
+        creator = User(username=f"goals_{n}", email=f"goals_{n}@example.com",
+                       full_name=f"Goals {n}", city="Goalville", hashed_password="x")
+        db.add(creator)
+        db.flush()
+        db.add(UserProfile(user_id=creator.id))
+        campaign = Campaign(title=f"Goals {n}", target_amount=150.0, creator_id=creator.id)
+        db.add(campaign)
+        db.flush()
+        db.add_all(
+            DonationGoal(campaign_id=campaign.id, goal_amount=amount, goal_type=goal_type)
+            for amount, goal_type in goals
+        )
+        db.commit()
+        return campaign.id, creator.id
+
+@pytest.fixture
+async def db():
+    async with AsyncSessionLocal() as session:
+        yield session
+    await async_engine.dispose()
+
+async def achieved_amounts(db, campaign_id):
+    return (await db.execute(
+        select(DonationGoal.goal_amount)
+        .where(DonationGoal.campaign_id == campaign_id, DonationGoal.achieved_at.isnot(None))
+        .order_by(DonationGoal.goal_amount)
+    )).scalars().all()
+
+@pytest.mark.anyio
+async def test_goal_is_reached_exactly_at_its_threshold(db):
+    campaign_id, creator_id = create_campaign((50.0, "milestone"), (100.0, "final"))
+    goals = GoalService()
+
+    assert await goals.check_goals(db, {campaign_id: 49.99}) == []
+    achieved = await goals.check_goals(db, {campaign_id: 50.0})
+    await db.commit()
+    assert [(goal.goal_amount, goal.goal_type) for goal in achieved] == [(50.0, "milestone")]
+    assert await achieved_amounts(db, campaign_id) == [50.0]
+
+    # The creator is notified; a milestone earns no badge
+    unread = (await db.execute(
+        select(UserProfile.unread_notifications).where(UserProfile.user_id == creator_id)
+    )).scalar()
+    assert unread == 1
+    assert (await db.execute(select(func.count()).where(UserBadge.user_id == creator_id))).scalar() == 0
+
+    # A reached goal is not reported again
+    assert await goals.check_goals(db, {campaign_id: 60.0}) == []
+
+@pytest.mark.anyio
+async def test_one_donation_can_cross_several_goals(db):
+    campaign_id, creator_id = create_campaign((50.0, "milestone"), (100.0, "stretch"), (150.0, "final"))
+    goals = GoalService()
+
+    achieved = await goals.check_goals(db, {campaign_id: 120.0})
+    assert sorted(goal.goal_amount for goal in achieved) == [50.0, 100.0]
+    achieved = await goals.check_goals(db, {campaign_id: 500.0})
+    await db.commit()
+    assert [goal.goal_type for goal in achieved] == ["final"]
+    assert await achieved_amounts(db, campaign_id) == [50.0, 100.0, 150.0]
+
+    unread = (await db.execute(
+        select(UserProfile.unread_notifications).where(UserProfile.user_id == creator_id)
+    )).scalar()
+    assert unread == 3
+    badges = (await db.execute(select(UserBadge.badge_type).where(UserBadge.user_id == creator_id))).scalars().all()
+    assert badges == ["campaign_funded"]
+    assert await goals.campaigns_with_goals(db, [campaign_id]) == []
+
+@pytest.mark.anyio
+async def test_threshold_cache_follows_goal_changes(db):
+    campaign_id, _ = create_campaign()
+    goals = GoalService(ttl_seconds=3600)
+    assert await goals.campaigns_with_goals(db, [campaign_id]) == []
+
+    # create_goal invalidates the cached (empty) thresholds
+    goal = await goals.create_goal(db, DonationGoal(campaign_id=campaign_id, goal_amount=100.0, goal_type="milestone"))
+    assert goal.achieved_at is None
+    assert await goals.campaigns_with_goals(db, [campaign_id]) == [campaign_id]
+
+    # A goal the campaign has already passed is stamped straight away
+    await db.execute(Campaign.__table__.update().where(Campaign.id == campaign_id).values(current_amount=75.0))
+    goal = await goals.create_goal(db, DonationGoal(campaign_id=campaign_id, goal_amount=60.0, goal_type="milestone"))
+    assert goal.achieved_at is not None
+
+    # Goals added elsewhere (another worker) only show up once the cache entry goes
+    assert await goals.campaigns_with_goals(db, [campaign_id]) == [campaign_id]
+    await db.execute(insert(DonationGoal).values(campaign_id=campaign_id, goal_amount=80.0, goal_type="stretch"))
+    await db.commit()
+    assert await goals.check_goals(db, {campaign_id: 90.0}) == []
+    goals.invalidate(campaign_id)
+    assert [goal.goal_amount for goal in await goals.check_goals(db, {campaign_id: 90.0})] == [80.0]
+
+    # A rolled-back stamp is picked up again by the next check
+    await db.rollback()
+    assert [goal.goal_amount for goal in await goals.check_goals(db, {campaign_id: 90.0})] == [80.0]
+    await db.commit()
+    assert await achieved_amounts(db, campaign_id) == [60.0, 80.0]
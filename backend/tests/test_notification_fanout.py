@@ -0,0 +1,86 @@
+"""Campaign update fan-out resumes after an interruption without duplicates or gaps."""
+
+import pytest
+from sqlalchemy import func, select
+
+from database import AsyncSessionLocal, SessionLocal, async_engine, engine
+from models import Base, Campaign, CampaignUpdate, Donation, Notification, User, UserProfile
+from notification_service import notification_service
+
+DONORS = 7
+CHUNK_SIZE = 3
+
+def create_update():
+    """Creator, donors (some with several donations) and a posted update; returns (update_id, creator_id, donor_ids)"""
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        users = [
+            User(username=f"fanout_{i}", email=f"fanout_{i}@example.com",
+                 full_name=f"Fan-out {i}", city="Fanville", hashed_password="x")
+            for i in range(DONORS + 1)
+        ]
+        db.add_all(users)
+        db.flush()
+        creator, donors = users[0], users[1:]
+        # One donor already has an unread notification
+        db.add_all(UserProfile(user_id=user.id, unread_notifications=int(user is donors[0])) for user in users)
+        db.add(Notification(user_id=donors[0].id, title="Earlier", notification_type="system"))
+        campaign = Campaign(title="Fan-out", target_amount=100.0, creator_id=creator.id)
+        db.add(campaign)
+        db.flush()
+        db.add_all(
+            Donation(amount=1.0, donor_id=user.id, campaign_id=campaign.id)
+            for user in donors + donors[::2] + [creator]
+        )
+        update = CampaignUpdate(campaign_id=campaign.id, title="Halfway", content="Thanks!")
+        db.add(update)
+        db.commit()
+        return update.id, creator.id, [user.id for user in donors]
+
+@pytest.fixture
+async def posted_update():
+    try:
+        yield create_update()
+    finally:
+        await async_engine.dispose()
+
+@pytest.mark.anyio
+async def test_interrupted_fan_out_resumes_without_duplicates(posted_update, monkeypatch):
+    update_id, creator_id, donor_ids = posted_update
+
+    # The worker dies while committing its second chunk
+    async with AsyncSessionLocal() as db:
+        commit, commits = db.commit, []
+
+        async def failing_commit():
+            commits.append(1)
+            if len(commits) == 2:
+                raise RuntimeError("worker killed")
+            await commit()
+
+        monkeypatch.setattr(db, "commit", failing_commit)
+        with pytest.raises(RuntimeError):
+            await notification_service.fan_out(db, update_id, chunk_size=CHUNK_SIZE)
+        await db.rollback()
+
+    async with AsyncSessionLocal() as db:
+        update = await db.get(CampaignUpdate, update_id)
+        assert (update.notified_donor_id, update.notified_at) == (donor_ids[CHUNK_SIZE - 1], None)
+
+        # The restarted worker picks up after the last committed chunk
+        assert await notification_service.fan_out(db, update_id, chunk_size=CHUNK_SIZE) == DONORS - CHUNK_SIZE
+        assert await notification_service.fan_out(db, update_id, chunk_size=CHUNK_SIZE) == 0
+
+        recipients = (await db.execute(
+            select(Notification.user_id, func.count())
+            .where(Notification.title == "Fan-out: Halfway")
+            .group_by(Notification.user_id)
+        )).all()
+        assert dict(recipients) == {donor_id: 1 for donor_id in donor_ids}
+
+        unread = dict((await db.execute(
+            select(UserProfile.user_id, UserProfile.unread_notifications)
+            .where(UserProfile.user_id.in_(donor_ids + [creator_id]))
+        )).all())
+        assert unread == {creator_id: 0, donor_ids[0]: 2, **{donor_id: 1 for donor_id in donor_ids[1:]}}
+        assert (await db.get(CampaignUpdate, update_id)).notified_at is not None
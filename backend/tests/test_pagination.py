@@ -0,0 +1,101 @@
+"""Keyset pagination: cursor round trips, ties on created_at, the last page and bad cursors."""
+
+import base64
+import itertools
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+
+from auth import create_access_token
+from database import SessionLocal, async_engine
+from main import app
+from models import Campaign, Donation, User
+from pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
+
+SAME_TIME = datetime(2024, 3, 1, 12, 0, 0, 123456)
+_donors = itertools.count()
+
+def create_donations():
+    """A donor with five donations at one instant and two older ones; returns (username, ids newest first)"""
+    n = next(_donors)
+    with SessionLocal() as db:
+        donor = User(username=f"pager_{n}", email=f"pager_{n}@example.com", full_name="Pager",
+                     city="Pageville", hashed_password="x")
+        db.add(donor)
+        db.flush()
+        campaign = Campaign(title="Pages", target_amount=100.0, creator_id=donor.id)
+        db.add(campaign)
+        db.flush()
+        times = [SAME_TIME - timedelta(days=1), SAME_TIME] * 2 + [SAME_TIME] * 3
+        donations = [Donation(amount=1.0, donor_id=donor.id, campaign_id=campaign.id, created_at=t) for t in times]
+        db.add_all(donations)
+        db.commit()
+        ordered = sorted(donations, key=lambda donation: (donation.created_at, donation.id), reverse=True)
+        return donor.username, [donation.id for donation in ordered]
+
+@pytest.fixture
+async def client():
+    await app.router.startup()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            yield client
+    finally:
+        await app.router.shutdown()
+        await async_engine.dispose()
+
+@pytest.fixture
+async def pager(client):
+    username, ids = create_donations()
+    client.headers["Authorization"] = f"Bearer {create_access_token(data={'sub': username})}"
+    return client, ids
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(SAME_TIME, 42)) == (SAME_TIME, 42)
+
+@pytest.mark.anyio
+async def test_pages_split_ties_without_gaps_or_repeats(pager):
+    client, ids = pager
+    seen, pages, params = [], 0, {"limit": 2}
+    while True:
+        response = await client.get("/donations", params=params)
+        assert response.status_code == 200
+        seen += [donation["id"] for donation in response.json()]
+        pages += 1
+        if NEXT_CURSOR_HEADER not in response.headers:
+            break
+        params = {"limit": 2, "cursor": response.headers[NEXT_CURSOR_HEADER]}
+    assert seen == ids
+    assert pages == 4
+
+@pytest.mark.anyio
+async def test_full_last_page_is_followed_by_an_empty_one(pager):
+    client, ids = pager
+    response = await client.get("/donations", params={"limit": len(ids)})
+    assert [donation["id"] for donation in response.json()] == ids
+
+    response = await client.get("/donations", params={"limit": len(ids), "cursor": response.headers[NEXT_CURSOR_HEADER]})
+    assert response.status_code == 200
+    assert response.json() == []
+    assert NEXT_CURSOR_HEADER not in response.headers
+
+def b64(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("cursor", [
+    "not a cursor!",
+    "abc",
+    b64(b"2024-03-01T12:00:00"),
+    b64(b"2024-03-01T12:00:00|one"),
+    b64(b"yesterday|1"),
+    b64(b"2024-03-01T12:00:00|1|2"),
+    b64(b"\xff\xfe|1"),
+    b64(b"2024-03-01T12:00:00+05:30|1"),
+    b64(b"2024-03-01T12:00:00|" + b"9" * 30),
+])
+async def test_malformed_or_tampered_cursor_is_rejected(pager, cursor):
+    client, _ = pager
+    response = await client.get("/donations", params={"cursor": cursor})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
@@ -0,0 +1,74 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from sqlalchemy import event, inspect
+from models import User
+import os
+import time
+
+# Authenticated-user cache settings
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
+
+class UserCache:
+    """TTL + LRU cache of user rows keyed by username (the JWT ``sub`` claim).
+
+    Only column values are cached; each hit returns a fresh transient User so
+    no ORM state is shared between requests. Entries are dropped whenever a
+    User is updated or deleted through the ORM, and expire after the TTL so
+    changes made by other workers become visible.
+    """
+
+    def __init__(self, max_size: int = USER_CACHE_MAX_SIZE, ttl_seconds: float = USER_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username: str) -> Optional[User]:
+        entry = self._entries.get(username)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[username]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(username)
+        self.hits += 1
+        return User(**entry[1])
+
+    def set(self, user: User):
+        if self.max_size <= 0 or self.ttl_seconds <= 0:
+            return
+        values = {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+        self._entries[user.username] = (time.monotonic() + self.ttl_seconds, values)
+        self._entries.move_to_end(user.username)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, username: str):
+        self._entries.pop(username, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+# Global instance
+user_cache = UserCache()
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    # Drop both the current and the previous username in case it was renamed
+    user_cache.invalidate(target.username)
+    history = inspect(target).attrs.username.history
+    for username in history.deleted or ():
+        user_cache.invalidate(username)